@@ -3,7 +3,7 @@
 
 import os
 import json
-from dashscope import Generation # 导入 DashScope SDK
+from dashscope_client import DashScopeError, get_client # 共享的 DashScope 客户端（连接池复用）
 
 # 从环境变量获取阿里云 DashScope API Key
 # 强烈建议将 API Key 设置为环境变量，不要直接写在代码中
@@ -38,19 +38,17 @@ def call_dashscope_llm(system_prompt: str, user_prompt: str, model_name: str = D
             {"role": "user", "content": user_prompt}
         ]
         print(f"准备调用 DashScope，system_prompt: {system_prompt}, user_prompt: {user_prompt}")
-        response = Generation.call(
+        completion = get_client().complete(
+            messages,
             model=model_name,
-            messages=messages,
+            stage="api_llm_caller",
             api_key=DASHSCOPE_API_KEY,
-            result_format='message'
         )
-        print(f"DashScope 返回: {response}")
-        if response.status_code == 200 and response.output and response.output.choices:
-            # 兼容字典格式的返回
-            return response.output.choices[0]['message']['content'].strip()
-        else:
-            print(f"警告: DashScope 响应结果不成功或格式不符。状态码: {response.status_code}, 错误信息: {getattr(response, 'message', None)}, 完整响应: {response}")
-            return None
+        print(f"DashScope 返回: {completion}")
+        return completion.content.strip()
+    except DashScopeError as e:
+        print(f"警告: DashScope 响应结果不成功或格式不符: {e}")
+        return None
     except Exception as e:
         print(f"调用 DashScope LLM 发生异常: {e}")
         return None
@@ -1,11 +1,34 @@
 # my-project/app.py
 import os
 import json
-import requests
 import random
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Response, request, jsonify, render_template
 from flask_cors import CORS
 import sys
+import threading
+import concurrent.futures
+import copy
+import re
+import time
+
+import dashscope_client
+from async_runtime import AsyncRuntime
+from catalog_snapshot import SnapshotWatcher, load_snapshot, save_snapshot
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+import deadline
+from deadline import DeadlineExceeded
+from example_index import ExampleIndex, dedupe_examples, few_shot_text, load_jsonl_examples
+from hedging import Hedger
+from llm_cache import LLMResponseCache, cache_key as llm_request_key
+from lru_cache import LRUCache
+from rule_selector import RuleSelectionStats
+from similarity_cache import SimilarityCache
+from single_flight import SharedFlights, SingleFlight
+from strapi_catalog import Catalog, DEFAULT_SCENARIO
+from strapi_details import StrapiDetailLoader
+from strapi_loader import StrapiFetchError, fetch_bootstrap_bundle, load_collections
+from strapi_sync import StrapiSyncer
+import strapi_webhook
 
 app = Flask(__name__)
 CORS(app)
@@ -17,9 +40,6 @@ def add_header(response):
         response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
     return response
 
-# 全局数据缓存
-global_strapi_data_cache = {}
-
 # 优先从环境变量加载，如果没有设置则使用 None，而不是本地地址
 ALIYUN_DASHSCOPE_API_KEY = os.environ.get("ALIYUN_DASHSCOPE_API_KEY", "")
 # 支持两种环境变量名称：STRAPI_API_URL 和 STRAPI_URL
@@ -38,128 +58,625 @@ if not STRAPI_API_URL:
 else:
     print(f"INFO: 环境变量已设置，使用地址: {STRAPI_API_URL}", file=sys.stderr)
 
+# 后台增量同步间隔（秒），0 表示关闭；每隔多少轮检查一次已删除的记录
+STRAPI_SYNC_INTERVAL = float(os.environ.get("STRAPI_SYNC_INTERVAL", "60"))
+STRAPI_SYNC_ID_CHECK_EVERY = int(os.environ.get("STRAPI_SYNC_ID_CHECK_EVERY", "10"))
+# 本地数据快照文件，worker 启动时先从这里加载；设为空字符串表示关闭
+STRAPI_SNAPSHOT_PATH = os.environ.get("STRAPI_SNAPSHOT_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "strapi_catalog_snapshot.json"))
+# 检查快照文件是否被其他进程更新的间隔（秒），0 表示关闭
+STRAPI_SNAPSHOT_WATCH_INTERVAL = float(os.environ.get("STRAPI_SNAPSHOT_WATCH_INTERVAL", "5"))
+# 是否只请求提示词用到的字段（字段投影），设为 0 时退回 populate=*
+STRAPI_PROJECTION = os.environ.get("STRAPI_PROJECTION", "1") == "1"
+# 启动时是否先尝试一次请求拉取全部集合的 bootstrap bundle 接口，失败时退回逐个集合拉取
+STRAPI_BOOTSTRAP_BUNDLE = os.environ.get("STRAPI_BOOTSTRAP_BUNDLE", "1") == "1"
+# Strapi 分页大小（不超过 Strapi 的 rest.maxLimit）
+STRAPI_PAGE_SIZE = int(os.environ.get("STRAPI_PAGE_SIZE", "100"))
+# 按需加载的特质表现、情境实例缓存：最多缓存的人格 × 挑战组合数、有效期（秒）；容量为 0 表示不按需加载
+STRAPI_DETAIL_CACHE_SIZE = int(os.environ.get("STRAPI_DETAIL_CACHE_SIZE", "256"))
+STRAPI_DETAIL_CACHE_TTL = float(os.environ.get("STRAPI_DETAIL_CACHE_TTL", "600"))
+# 按需加载的单次请求超时（秒），位于对话请求的关键路径上
+STRAPI_DETAIL_TIMEOUT = float(os.environ.get("STRAPI_DETAIL_TIMEOUT", "5"))
+# 按需加载的请求失败后暂停按需加载的时间（秒），Strapi 休眠或不可达时每轮对话不再先等请求超时；0 表示不暂停
+STRAPI_DETAIL_FAILURE_BACKOFF = float(os.environ.get("STRAPI_DETAIL_FAILURE_BACKOFF", "30"))
+# 大模型调用是否走异步路径（httpx.AsyncClient + 进程内事件循环），需要安装 httpx
+LLM_ASYNC = os.environ.get("LLM_ASYNC", "1") == "1"
+# 每个 worker 进程同时进行的大模型调用数上限，超出的调用排队等待
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", "16"))
+# 单次大模型调用（含排队时间）的最长等待时间（秒）
+LLM_ASYNC_TIMEOUT = float(os.environ.get("LLM_ASYNC_TIMEOUT", "30"))
+# 大模型回复的精确匹配缓存：内存层容量（0 表示关闭缓存）、SQLite 文件路径（为空表示只用内存层）、
+# SQLite 中条目的有效期（秒）和最大行数
+LLM_CACHE_SIZE = int(os.environ.get("LLM_CACHE_SIZE", "512"))
+LLM_CACHE_PATH = os.environ.get("LLM_CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "llm_responses.sqlite3"))
+LLM_CACHE_TTL = float(os.environ.get("LLM_CACHE_TTL", "86400"))
+LLM_CACHE_MAX_ROWS = int(os.environ.get("LLM_CACHE_MAX_ROWS", "10000"))
+# 孩子回应（以及包含孩子回应的合并调用输出）是否也走缓存：开启后同样的输入总是得到同样的回应，默认只缓存评估结果
+LLM_CACHE_CHILD_RESPONSES = os.environ.get("LLM_CACHE_CHILD_RESPONSES", "0") == "1"
+# 评估调用的采样温度：较低的温度让同样的输入得到稳定的评级，缓存和复用的评估结果才有意义
+EVAL_TEMPERATURE = float(os.environ.get("EVAL_TEMPERATURE", "0.1"))
+# 近似重复评估缓存：最多保留的条目数（0 表示关闭）、判定为近似重复的 Jaccard 相似度下限、
+# 命中后仍调用大模型核对以测量精确度的抽样比例
+EVAL_SIMILARITY_CACHE_SIZE = int(os.environ.get("EVAL_SIMILARITY_CACHE_SIZE", "2048"))
+EVAL_SIMILARITY_THRESHOLD = float(os.environ.get("EVAL_SIMILARITY_THRESHOLD", "0.8"))
+EVAL_SIMILARITY_VERIFY_RATE = float(os.environ.get("EVAL_SIMILARITY_VERIFY_RATE", "0.05"))
+# 是否合并进行中的相同大模型请求（single-flight）；设置 SQLite 文件路径后同一台机器上的 worker 之间也会合并
+LLM_SINGLE_FLIGHT = os.environ.get("LLM_SINGLE_FLIGHT", "1") == "1"
+LLM_SINGLE_FLIGHT_SHARED_PATH = os.environ.get("LLM_SINGLE_FLIGHT_SHARED_PATH", "")
+# 对冲请求：调用超过该阶段最近耗时的 LLM_HEDGE_PERCENTILE 分位仍未返回时再发一个相同请求，先返回的生效。
+# 只在异步路径（LLM_ASYNC=1）中可用；LLM_HEDGE_BUDGET 为额外请求占正常调用的比例上限，
+# 按 p90 触发时约 10% 的调用会被对冲，预算需略高于 1 - 分位数
+LLM_HEDGE = os.environ.get("LLM_HEDGE", "0") == "1"
+LLM_HEDGE_PERCENTILE = float(os.environ.get("LLM_HEDGE_PERCENTILE", "0.9"))
+LLM_HEDGE_BUDGET = float(os.environ.get("LLM_HEDGE_BUDGET", "0.15"))
+LLM_HEDGE_MIN_SAMPLES = int(os.environ.get("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_HEDGE_MIN_DELAY = float(os.environ.get("LLM_HEDGE_MIN_DELAY", "0.2"))
+LLM_HEDGE_STAGES = [stage.strip() for stage in os.environ.get("LLM_HEDGE_STAGES", "child_response,evaluation").split(",") if stage.strip()]
+# 大模型调用熔断：最近 LLM_BREAKER_WINDOW 秒内失败率或慢调用比例超过阈值时，
+# LLM_BREAKER_OPEN_SECONDS 秒内不再调用大模型，直接返回预设回应和规则评估
+LLM_BREAKER = os.environ.get("LLM_BREAKER", "1") == "1"
+LLM_BREAKER_WINDOW = float(os.environ.get("LLM_BREAKER_WINDOW", "30"))
+LLM_BREAKER_MIN_CALLS = int(os.environ.get("LLM_BREAKER_MIN_CALLS", "10"))
+LLM_BREAKER_ERROR_RATE = float(os.environ.get("LLM_BREAKER_ERROR_RATE", "0.5"))
+LLM_BREAKER_SLOW_CALL = float(os.environ.get("LLM_BREAKER_SLOW_CALL", "10"))
+LLM_BREAKER_SLOW_RATE = float(os.environ.get("LLM_BREAKER_SLOW_RATE", "0.8"))
+LLM_BREAKER_OPEN_SECONDS = float(os.environ.get("LLM_BREAKER_OPEN_SECONDS", "15"))
+# 对话轮次的大模型调用方式：two_call（默认）先生成孩子回应、再单独评估；
+# combined 用一次结构化输出调用同时生成孩子回应和评估，少一次往返（流式接口始终使用 two_call）
+DIALOGUE_TURN_MODE = os.environ.get("DIALOGUE_TURN_MODE", "two_call")
+if DIALOGUE_TURN_MODE not in ("two_call", "combined"):
+    print(f"WARNING: 未知的 DIALOGUE_TURN_MODE={DIALOGUE_TURN_MODE!r}，使用 two_call", file=sys.stderr)
+    DIALOGUE_TURN_MODE = "two_call"
+# 评估和专家指导提示词中最多放入的评估规则条数：按与家长输入、人格和情境的相关性（BM25 + 触发条件）取前 k 条，
+# 0 表示放入全部规则
+EVAL_RULES_TOP_K = int(os.environ.get("EVAL_RULES_TOP_K", "8"))
+# 本地规则引擎：触发条件能机械判定的评估规则（关键词、正则、布尔表达式）在本地判定，
+# 评级和分数由基础分 EVAL_RULE_BASE_SCORE 加上触发规则的 score_impact 计算，大模型只写分析和建议
+EVAL_RULE_ENGINE = os.environ.get("EVAL_RULE_ENGINE", "1") == "1"
+EVAL_RULE_BASE_SCORE = float(os.environ.get("EVAL_RULE_BASE_SCORE", "5"))
+# 评估提示中的评级参考示例：从已评级的对话记录（FEWSHOT_PATHS，逗号分隔）和 Strapi 的理想回应中
+# 检索与家长输入最相似的 FEWSHOT_K 条（0 表示关闭），相似度（字符 bigram tf-idf 余弦）低于下限的不使用
+FEWSHOT_K = int(os.environ.get("FEWSHOT_K", "3"))
+FEWSHOT_MIN_SIMILARITY = float(os.environ.get("FEWSHOT_MIN_SIMILARITY", "0.25"))
+# 检索到参考示例时提示词中最多放入的评估规则条数：示例代替一部分规则说明和评级标准，提示词不因示例变长，
+# 0 表示与 EVAL_RULES_TOP_K 相同
+FEWSHOT_RULES_TOP_K = int(os.environ.get("FEWSHOT_RULES_TOP_K", "4"))
+_APP_DIR = os.path.dirname(os.path.abspath(__file__))
+FEWSHOT_PATHS = [
+    path.strip() for path in os.environ.get(
+        "FEWSHOT_PATHS",
+        f"{os.path.join(_APP_DIR, 'dialogue_evaluations.jsonl')},{os.path.join(_APP_DIR, 'collected_data', 'llm_training_data.jsonl')}",
+    ).split(",") if path.strip()
+]
+# 请求级截止时间（秒）：一轮对话的各个步骤共用这段时间，应小于 gunicorn 的 worker 超时（默认 30 秒），0 表示不限制
+REQUEST_SLA = float(os.environ.get("REQUEST_SLA", "25"))
+# 孩子回应最多用到截止时间前多少秒，剩下的留给评估；剩余时间少于 DEADLINE_MIN_STAGE 秒时不再调用大模型，直接降级
+DEADLINE_EVALUATION_RESERVE = float(os.environ.get("DEADLINE_EVALUATION_RESERVE", "8"))
+DEADLINE_MIN_STAGE = float(os.environ.get("DEADLINE_MIN_STAGE", "1"))
+# Strapi 缓存失效 Webhook 的共享签名密钥，未设置时 Webhook 接口不可用
+STRAPI_WEBHOOK_SECRET = os.environ.get("STRAPI_WEBHOOK_SECRET", "")
+
+
+# 预设反馈规则的评级 -> 分数，A/B/C 与评估提示词中的约定一致，D 比 C 更差
+FEEDBACK_GRADE_SCORES = {"A": 10, "B": 5, "C": -5, "D": -10}
+
+
+def feedback_rule_evaluation(rule):
+    """把命中的预设反馈规则转换为与大模型评估相同结构的结果"""
+    evaluation = {
+        "grade": rule.evaluation_grade,
+        "score": FEEDBACK_GRADE_SCORES[rule.evaluation_grade],
+        "reasonAnalysis": rule.reason_analysis,
+        "suggestionEncouragement": rule.suggestion_encouragement,
+        "triggered_rules": [rule.rule_name] if rule.rule_name else [],
+    }
+    if rule.inner_monologue:
+        evaluation["childDesiredResponseInnerMonologue"] = rule.inner_monologue
+    if rule.parent_input_analysis:
+        evaluation["parentInputAnalysis"] = rule.parent_input_analysis
+    return evaluation
+
+
+# 降级时没有匹配的预设回应时使用的孩子回应
+DEGRADED_CHILD_RESPONSE = "嗯……我想一想。"
+
+
+def degraded_child_response(parent_input, trait_expression=None):
+    """降级（熔断或时间不够）时的孩子回应：使用特质表现中与家长输入匹配的预设回应，没有时使用通用回应"""
+    for preset in trait_expression.parent_inputs if trait_expression else ():
+        if preset.child_response_template and any(keyword in parent_input for keyword in preset.parent_keywords):
+            return preset.child_response_template
+    return DEGRADED_CHILD_RESPONSE
+
+
+# 每种对话模式调用大模型的阶段，用于统计每轮的 token 用量
+TURN_MODE_STAGES = {"two_call": ("child_response", "evaluation"), "combined": ("combined_turn",)}
+
+
+def _strip_code_fence(text):
+    """去掉模型有时包在 JSON 外面的 ```json ... ``` 标记"""
+    text = (text or '').strip()
+    if text.startswith("```"):
+        text = text.split("\n", 1)[1] if "\n" in text else ""
+        if text.rstrip().endswith("```"):
+            text = text.rstrip()[:-3]
+    return text.strip()
+
+
+def _decode_field(text, pattern, decoder=json.JSONDecoder()):
+    """在整体无法解析的 JSON 文本中找到 pattern 之后的第一个 JSON 值，解析失败时返回 None"""
+    match = re.search(pattern, text)
+    if not match:
+        return None
+    try:
+        value, _ = decoder.raw_decode(text, match.end())
+    except ValueError:
+        return None
+    return value
+
+
+def parse_combined_turn(text, required="grade"):
+    """
+    解析合并调用的输出 {"child_response": ..., "evaluation": {...}}，返回 (child_response, evaluation)。
+    两部分分别检查：整体不是合法 JSON 时逐个字段提取，缺失或格式不正确的部分返回 None，
+    由调用方单独补一次调用。required 为评估中必须有的字段（评级由规则引擎计算时为 reasonAnalysis）。
+    """
+    text = _strip_code_fence(text)
+    try:
+        data = json.loads(text)
+    except ValueError:
+        data = None
+    if isinstance(data, dict):
+        child_response, evaluation = data.get("child_response"), data.get("evaluation")
+    else:
+        child_response = _decode_field(text, r'"child_response"\s*:\s*')
+        evaluation = _decode_field(text, r'"evaluation"\s*:\s*')
+
+    if not isinstance(child_response, str) or not child_response.strip():
+        child_response = None
+    if not isinstance(evaluation, dict) or not evaluation.get(required):
+        evaluation = None
+    elif 'triggered_rules' not in evaluation:
+        evaluation['triggered_rules'] = []
+    return child_response, evaluation
+
+
+# 评估需要大模型返回的字段
+EVALUATION_FIELDS = """1. **grade**: 根据家长的沟通效果，给出A (优秀), B (良好), 或 C (有待改进)的评级。
+            2. **score**: 给出一个具体的数字分数，A=10, B=5, C=-5。
+            3. **reasonAnalysis**: 简要分析给这个评级的原因，特别说明哪些评估规则被触发。
+            4. **suggestionEncouragement**: 给出具体的沟通建议或鼓励的话语。
+            5. **parent_mood**: 分析家长的输入情绪，是'positive' (积极), 'neutral' (中性), 还是'negative' (负面)。
+            6. **triggered_rules**: 列出被触发的评估规则名称。"""
+# 有评级参考示例时，评级标准由示例说明，字段说明只保留格式要求
+EVALUATION_FIELDS_WITH_EXAMPLES = """1. **grade** / **score**: 参照评级参考示例给出 A / B / C 评级和分数（A=10, B=5, C=-5）。
+            2. **reasonAnalysis**: 评级原因，说明哪些评估规则被触发。
+            3. **suggestionEncouragement**: 沟通建议或鼓励。
+            4. **parent_mood**: 'positive'、'neutral' 或 'negative'。
+            5. **triggered_rules**: 被触发的评估规则名称。"""
+# 评级和分数由规则引擎计算时，大模型只需要返回的文字字段
+NARRATIVE_EVALUATION_FIELDS = """1. **reasonAnalysis**: 简要分析家长这句话的沟通效果，特别说明哪些评估规则被触发（包括规则引擎已判定的规则）。
+            2. **suggestionEncouragement**: 给出具体的沟通建议或鼓励的话语。
+            3. **parent_mood**: 分析家长的输入情绪，是'positive' (积极), 'neutral' (中性), 还是'negative' (负面)。
+            4. **triggered_rules**: 只列出上述评估规则参考中被触发的规则名称，没有则返回空列表。"""
+
+
+def evaluation_fields(local_rules=None, with_examples=False):
+    """
+    评估提示中要求返回的字段；local_rules 不为 None 时说明规则引擎已判定的规则，不再要求评级和分数；
+    with_examples 为真时（提示中有评级参考示例）使用简短的字段说明
+    """
+    if local_rules is None:
+        return EVALUATION_FIELDS_WITH_EXAMPLES if with_examples else EVALUATION_FIELDS
+    names = "、".join(rule.rule_name for rule in local_rules) or "无"
+    return (f"规则引擎已判定触发的评估规则：{names}。评级和分数由规则计算，不需要返回。\n"
+            f"            {NARRATIVE_EVALUATION_FIELDS}")
+
+
+def degraded_evaluation(local_rules=None):
+    """
+    降级（熔断、时间不够或大模型没有返回内容）且没有命中预设反馈规则时的评估结果。
+    规则引擎判定有规则触发时只缺少文字分析，评级和分数随后由 _apply_rule_engine 计算；否则本轮不计分
+    """
+    if local_rules:
+        return {
+            "reasonAnalysis": "AI评价服务暂时繁忙，本轮评分根据触发的评估规则计算：" + "、".join(rule.rule_name for rule in local_rules) + "。",
+            "suggestionEncouragement": "请留意上述规则，继续和孩子对话。",
+            "parent_mood": "unknown",
+            "triggered_rules": [],
+            "degraded": True,
+        }
+    return {
+        "grade": "",
+        "score": 0,
+        "reasonAnalysis": "AI评价服务暂时繁忙，本轮对话没有评分。",
+        "suggestionEncouragement": "请继续和孩子对话，稍后的回合会恢复评分。",
+        "parent_mood": "unknown",
+        "triggered_rules": [],
+        "degraded": True,
+    }
+
 
 class ChildInteractionSimulator:
-    def __init__(self, personalities, trait_expressions, scenario_instances, daily_challenges, evaluation_rules):
-        self.personalities = personalities
-        self.trait_expressions = trait_expressions
-        self.scenario_instances = scenario_instances
-        self.daily_challenges = daily_challenges
-        self.evaluation_rules = evaluation_rules
+    """
+    长期存活的对话引擎，进程内只创建一个实例。
+
+    持有一个不可变的数据目录快照（Catalog），数据重新加载时通过 swap_catalog 原子替换。
+    每个请求在开始时取一次快照并在整个处理过程中使用它，因此多线程 worker
+    不会看到加载到一半的数据。
+    """
+
+    def __init__(self, catalog=None, details=None, llm_client=None, async_llm=None, runtime=None, llm_cache=None, similarity_cache=None, single_flight=None, hedger=None, breaker=None, examples=None):
+        self._catalog = catalog or Catalog()
+        # 共享的 DashScope 客户端（连接池、统一超时、调用统计）
+        self.llm = llm_client or dashscope_client.get_client()
+        # 异步路径：async_llm 为 AsyncDashScopeClient，runtime 为进程内的事件循环（AsyncRuntime）；
+        # 为 None 时在请求线程中同步调用
+        self.async_llm = async_llm
+        self.runtime = runtime
+        # 异步路径上的对冲请求（Hedger），为 None 时不对冲
+        self.hedger = hedger
+        # 按需加载特质表现和情境实例（StrapiDetailLoader），为 None 时只使用数据目录中的数据
+        self.details = details
+        # 大模型回复的精确匹配缓存（LLMResponseCache），为 None 时不缓存
+        self.llm_cache = llm_cache
+        # 近似重复的评估结果缓存（SimilarityCache），按人格 × 情境划分，为 None 时不使用
+        self.similarity_cache = similarity_cache
+        # 合并进行中的相同大模型请求（SingleFlight），为 None 时每个请求各自调用
+        self.single_flight = single_flight
+        # 大模型调用的熔断器（CircuitBreaker），打开时返回降级结果，为 None 时不熔断
+        self.breaker = breaker
+        # 已评级对话记录的示例索引（ExampleIndex），为 None 时只使用数据目录中的理想回应
+        self.examples = examples
+        # 命中预设反馈规则、跳过大模型评估的次数
+        self.feedback_rule_hits = 0
+        # 返回降级结果的次数：熔断器打开 / 请求剩余时间不足 / 大模型调用失败或未配置 API Key（没有返回内容）
+        self.degraded_responses = {"circuit_open": 0, "deadline": 0, "llm_unavailable": 0}
+        # 按对话模式（DIALOGUE_TURN_MODE）统计的整轮耗时；合并调用中某一部分无法解析、单独补调用的次数
+        self.turn_stats = dashscope_client.CallStats()
+        self.combined_fallbacks = {"child_response": 0, "evaluation": 0}
+        # 评估规则按相关性筛选后的入选条数和节省的提示词字符数（按阶段）
+        self.rule_selection = RuleSelectionStats()
+        # 评级和分数由本地规则引擎计算的评估次数
+        self.rule_engine_evaluations = 0
+        self._swap_lock = threading.Lock()
         self.qwen_model_name = "qwen-turbo"
         self.api_key = ALIYUN_DASHSCOPE_API_KEY
 
-    def _get_entity_data_from_strapi(self, entity_name):
-        """从 Strapi API 获取数据，并增加错误处理"""
-        url = f"{STRAPI_API_URL}/api/{entity_name}?populate=*"
-        print(f"DEBUG: 尝试从 {url} 获取数据...")
-        try:
-            response = requests.get(url, timeout=10)
-            response.raise_for_status()
-            data = response.json()
-            return data.get('data', [])
-        except requests.exceptions.Timeout:
-            print(f"ERROR: 从 Strapi 获取 {entity_name} 数据超时。")
-        except requests.exceptions.ConnectionError as e:
-            print(f"ERROR: 无法连接到 Strapi 服务器，请检查 Strapi 是否已运行在 {STRAPI_API_URL}。错误: {e}")
-        except requests.exceptions.RequestException as e:
-            print(f"ERROR: 从 Strapi 获取 {entity_name} 数据失败。错误: {e}")
-        return []
-
-    def _call_qwen_model(self, prompt_messages):
-        """封装调用阿里云通义千问模型的逻辑，增加错误处理"""
+    @property
+    def catalog(self):
+        """当前的数据目录快照"""
+        return self._catalog
+
+    def swap_catalog(self, catalog):
+        """原子替换数据目录快照，返回被替换的旧快照"""
+        with self._swap_lock:
+            previous, self._catalog = self._catalog, catalog
+        print(f"INFO: 数据目录快照已切换: {previous.version or '空'} -> {catalog.version}", file=sys.stderr)
+        return previous
+
+    def reset_after_fork(self):
+        """fork 之后在子进程中调用，重新创建可能在 fork 时被持有的锁"""
+        self._swap_lock = threading.Lock()
+        self._catalog.reset_after_fork()
+        self.turn_stats.reset_after_fork()
+        self.rule_selection.reset_after_fork()
+        self.llm.reset_after_fork()
+        if self.runtime:
+            self.runtime.reset_after_fork()
+            self.async_llm.reset_after_fork()
+        if self.hedger:
+            self.hedger.reset_after_fork()
+        if self.breaker:
+            self.breaker.reset_after_fork()
+        if self.details:
+            self.details.reset_after_fork()
+        if self.llm_cache:
+            self.llm_cache.reset_after_fork()
+        if self.similarity_cache:
+            self.similarity_cache.reset_after_fork()
+        if self.single_flight:
+            self.single_flight.reset_after_fork()
+
+    def _count_degraded(self, error, stage):
+        """记录一次降级（error 为 CircuitOpenError 或 DeadlineExceeded，为 None 时表示大模型没有返回内容）"""
+        if error is None:
+            self.degraded_responses["llm_unavailable"] += 1
+            print(f"WARNING: 大模型没有返回内容，{stage} 返回降级结果", file=sys.stderr)
+        elif isinstance(error, DeadlineExceeded):
+            self.degraded_responses["deadline"] += 1
+            print(f"WARNING: 请求剩余时间不足，{stage} 返回降级结果: {error}", file=sys.stderr)
+        else:
+            self.degraded_responses["circuit_open"] += 1
+
+    def _cache_lookup(self, catalog, prompt_messages, stage, parameters=None):
+        """
+        查询大模型回复缓存，返回 (cache_key, 缓存的回复)；未启用缓存时返回 (None, None)。
+        缓存键包含数据目录版本，数据变化后旧条目不再命中。
+        """
+        if not self.llm_cache:
+            return None, None
+        cache_key = self.llm_cache.key(self.qwen_model_name, prompt_messages, parameters, namespace=catalog.version)
+        return cache_key, self.llm_cache.get(cache_key, stage)
+
+    def _cache_store(self, cache_key, value, stage):
+        if cache_key and value:
+            self.llm_cache.set(cache_key, value, stage)
+
+    def _call_qwen_model(self, prompt_messages, stage="default", reserve=0.0, **parameters):
+        """
+        封装调用阿里云通义千问模型的逻辑，增加错误处理；stage 用于分阶段统计耗时和用量，
+        reserve 为留给本请求后续步骤的时间（秒），其余关键字参数（temperature 等）原样传给模型。
+
+        Raises:
+            CircuitOpenError: 熔断器打开，调用方应立即返回降级结果
+            DeadlineExceeded: 请求剩余时间不足或在剩余时间内没有完成，调用方应立即返回降级结果
+        """
         if not self.api_key:
             print("ERROR: ALIYUN_DASHSCOPE_API_KEY 未设置。", file=sys.stderr)
             return None
 
+        if self.single_flight:
+            # 同样的提示词正在被其他请求调用时，等待并共用它的结果（最多等到本请求的剩余时间用完）
+            flight_key = llm_request_key(self.qwen_model_name, prompt_messages, parameters, namespace=stage)
+            wait = deadline.budget(None, reserve=reserve, minimum=DEADLINE_MIN_STAGE)
+            try:
+                return self.single_flight.do(flight_key, lambda: self._request_qwen_model(prompt_messages, stage, reserve, **parameters), stage, timeout=wait)
+            except concurrent.futures.TimeoutError:
+                raise DeadlineExceeded(f"等待相同请求的结果超过 {wait:.1f} 秒，阶段: {stage}")
+        return self._request_qwen_model(prompt_messages, stage, reserve, **parameters)
+
+    def _request_qwen_model(self, prompt_messages, stage, reserve=0.0, **parameters):
+        """
+        实际调用大模型，出错或超时时返回 None；
+        熔断器打开时抛出 CircuitOpenError，请求剩余时间不足时抛出 DeadlineExceeded
+        """
+        # 超时取单次调用上限与本请求剩余时间中较小的一个
+        limit = LLM_ASYNC_TIMEOUT if self.runtime else self.llm.read_timeout
+        timeout = deadline.budget(limit, reserve=reserve, minimum=DEADLINE_MIN_STAGE)
+        if self.breaker and not self.breaker.allow():
+            raise CircuitOpenError(f"熔断器打开，跳过大模型调用，阶段: {stage}")
+        started = time.monotonic()
+        # 熔断器统计的耗时从取得并发名额开始，在本进程队列中排队的时间不算作上游慢调用
+        acquired_at = []
+        ok = None
         try:
-            headers = {
-                'Authorization': f'Bearer {self.api_key}',
-                'Content-Type': 'application/json'
-            }
-            payload = {
-                "model": self.qwen_model_name,
-                "input": {
-                    "messages": prompt_messages
-                },
-                "parameters": {
-                    "result_format": "message"
-                }
-            }
-            response = requests.post('https://dashscope.aliyuncs.com/api/v1/services/aigc/text-generation/generation', headers=headers, json=payload, timeout=20)
-            response.raise_for_status()
-            result = response.json()
-            return result['output']['choices'][0]['message']['content']
-        except requests.exceptions.RequestException as e:
+            if self.runtime:
+                # 在进程内事件循环中以协程执行，受每个进程的并发上限约束
+                def make_call():
+                    return self.async_llm.chat(prompt_messages, model=self.qwen_model_name, stage=stage, api_key=self.api_key,
+                                               timeout=min(timeout, self.async_llm.read_timeout), **parameters)
+                call = self.hedger.run(stage, make_call) if self.hedger else make_call()
+                result = self.runtime.run(
+                    self.runtime.limited(call, on_acquire=lambda: acquired_at.append(time.monotonic())), timeout=timeout)
+            else:
+                result = self.llm.chat(prompt_messages, model=self.qwen_model_name, stage=stage, api_key=self.api_key, timeout=timeout, **parameters)
+            ok = True
+            return result
+        except dashscope_client.DashScopeError as e:
+            if timeout < limit and time.monotonic() - started >= timeout:
+                # 同步路径的读取超时被请求的截止时间缩短
+                raise DeadlineExceeded(f"{timeout:.1f} 秒内没有完成，阶段: {stage}")
+            ok = False
             print(f"ERROR: 调用大模型失败。请检查 API 密钥是否有效或网络连接。错误: {e}", file=sys.stderr)
-        except (KeyError, IndexError) as e:
-            print(f"ERROR: 大模型返回的数据格式不正确。错误: {e}", file=sys.stderr)
+        except concurrent.futures.TimeoutError:
+            if timeout < limit:
+                # 超时被请求的截止时间缩短，不能说明大模型不可用，不计入熔断统计
+                raise DeadlineExceeded(f"{timeout:.1f} 秒内没有完成，阶段: {stage}")
+            ok = False
+            print(f"ERROR: 调用大模型超时（{timeout:.1f} 秒，含排队时间），阶段: {stage}", file=sys.stderr)
+        finally:
+            if self.breaker:
+                if self.runtime and not acquired_at:
+                    # 还在本进程队列中就超时了，没有调用上游，不计入熔断统计
+                    ok = None
+                if ok is None:
+                    self.breaker.release()
+                else:
+                    self.breaker.record(ok, time.monotonic() - (acquired_at[0] if acquired_at else started))
         return None
 
-    def _generate_child_response_with_qwen(self, parent_input, selected_personality, selected_scenario):
-        """根据人格和情境生成孩子的回应"""
+    def _stream_qwen_model(self, prompt_messages, stage="default", reserve=0.0):
+        """
+        流式调用大模型，逐段产出回复内容；reserve 为留给本请求后续步骤的时间（秒）。
+
+        Raises:
+            dashscope_client.DashScopeError: 请求失败或流式输出出错（可能已经产出部分内容）
+            concurrent.futures.TimeoutError: 相邻两段内容之间超过 LLM_ASYNC_TIMEOUT 秒
+            CircuitOpenError: 熔断器打开，没有调用大模型
+            DeadlineExceeded: 请求剩余时间不足，或输出在剩余时间内没有结束（可能已经产出部分内容）
+        """
+        if not self.api_key:
+            print("ERROR: ALIYUN_DASHSCOPE_API_KEY 未设置。", file=sys.stderr)
+            return
+
+        # 整段流式输出需要在 until 之前结束
+        budget = deadline.budget(None, reserve=reserve, minimum=DEADLINE_MIN_STAGE)
+        until = time.monotonic() + budget if budget is not None else None
+        if self.breaker and not self.breaker.allow():
+            raise CircuitOpenError(f"熔断器打开，跳过大模型调用，阶段: {stage}")
+        received = False
+        outcome = None
         try:
-            # 处理人格数据
-            if 'attributes' in selected_personality:
-                personality_name = selected_personality['attributes']['name']
-                personality_desc = selected_personality['attributes']['description']
-            else:
-                personality_name = selected_personality.get('name', '未知人格')
-                personality_desc = selected_personality.get('description', '')
-            
-            # 处理情境数据
-            if 'attributes' in selected_scenario:
-                scenario_name = selected_scenario['attributes']['name']
-                scenario_desc = selected_scenario['attributes']['description']
+            if self.runtime:
+                # 在进程内事件循环中消费流式输出，受每个进程的并发上限约束
+                chunks = self.async_llm.stream(prompt_messages, model=self.qwen_model_name, stage=stage, api_key=self.api_key)
+                chunks = self.runtime.iterate(chunks, timeout=LLM_ASYNC_TIMEOUT, until=until)
             else:
-                scenario_name = selected_scenario.get('name', '默认情境')
-                scenario_desc = selected_scenario.get('description', '')
+                timeout = min(self.llm.read_timeout, budget) if budget is not None else None
+                chunks = self.llm.stream(prompt_messages, model=self.qwen_model_name, stage=stage, api_key=self.api_key, timeout=timeout)
+            for delta in chunks:
+                received = True
+                yield delta
+                if until is not None and time.monotonic() >= until:
+                    chunks.close()
+                    raise DeadlineExceeded(f"输出在 {budget:.1f} 秒内没有结束，阶段: {stage}")
+            outcome = True
+        except (dashscope_client.DashScopeError, concurrent.futures.TimeoutError):
+            if until is not None and time.monotonic() >= until:
+                raise DeadlineExceeded(f"输出在 {budget:.1f} 秒内没有结束，阶段: {stage}")
+            outcome = False
+            raise
+        finally:
+            # 流式调用的总耗时取决于回复长度，不计入慢调用统计；
+            # 客户端中途断开或时间用完时，已经收到内容算作成功，否则不计结果
+            if self.breaker:
+                if outcome is None and not received:
+                    self.breaker.release()
+                else:
+                    self.breaker.record(outcome is not False)
 
-            prompt_messages = [
-                {"role": "system", "content": f"你正在扮演一个拥有人格特质为'{personality_name}'的孩子。他的特质是：'{personality_desc}'。当前情境是：'{scenario_name}'，情境描述：'{scenario_desc}'。请根据这些信息，给出一个符合孩子身份的回应，并保持简短。"},
-                {"role": "user", "content": parent_input}
-            ]
-            return self._call_qwen_model(prompt_messages)
+    def _child_response_messages(self, parent_input, selected_personality, selected_scenario, trait_expression=None):
+        """构建生成孩子回应的提示消息"""
+        personality_name = selected_personality.name or '未知人格'
+        personality_desc = selected_personality.description
+        scenario_name = selected_scenario.name or '默认情境'
+        scenario_desc = selected_scenario.description
+
+        system_content = f"你正在扮演一个拥有人格特质为'{personality_name}'的孩子。他的特质是：'{personality_desc}'。当前情境是：'{scenario_name}'，情境描述：'{scenario_desc}'。"
+        if selected_scenario.child_typical_behavior:
+            system_content += f"孩子在这个情境中的典型表现：{'；'.join(selected_scenario.child_typical_behavior)}。"
+        if trait_expression and trait_expression.general_response_guidance:
+            system_content += f"这类孩子的回应方式：{trait_expression.general_response_guidance}。"
+        system_content += "请根据这些信息，给出一个符合孩子身份的回应，并保持简短。"
+
+        return [
+            {"role": "system", "content": system_content},
+            {"role": "user", "content": parent_input}
+        ]
+
+    def _generate_child_response_with_qwen(self, catalog, parent_input, selected_personality, selected_scenario, trait_expression=None):
+        """根据人格、情境以及（可选的）特质表现生成孩子的回应"""
+        try:
+            prompt_messages = self._child_response_messages(parent_input, selected_personality, selected_scenario, trait_expression)
+            cache_key = None
+            if LLM_CACHE_CHILD_RESPONSES:
+                cache_key, cached = self._cache_lookup(catalog, prompt_messages, "child_response")
+                if cached is not None:
+                    return cached
+            # 为评估留出时间
+            child_response = self._call_qwen_model(prompt_messages, stage="child_response", reserve=DEADLINE_EVALUATION_RESERVE)
+            self._cache_store(cache_key, child_response, "child_response")
+            return child_response
+        except (CircuitOpenError, DeadlineExceeded):
+            raise
         except Exception as e:
             print(f"ERROR: 生成孩子回应失败: {e}", file=sys.stderr)
             return "对不起，我现在有点困惑，能请你再说一遍吗？"
 
-    def _evaluate_response(self, parent_input, child_response, selected_personality, selected_scenario):
+    def _feedback_rule_evaluation(self, catalog, parent_input, selected_personality, selected_challenge):
+        """命中带评级的预设反馈规则时返回预设的评估结果，否则返回 None"""
+        feedback_rule = catalog.match_feedback_rule(parent_input, selected_personality, selected_challenge)
+        if feedback_rule and feedback_rule.evaluation_grade in FEEDBACK_GRADE_SCORES:
+            self.feedback_rule_hits += 1
+            return feedback_rule_evaluation(feedback_rule)
+        return None
+
+    @staticmethod
+    def _similarity_scope(catalog, selected_personality, selected_scenario):
+        """近似重复评估缓存的范围：数据目录版本 × 人格 × 情境"""
+        return (catalog.version, selected_personality.id, selected_scenario.id, selected_scenario.name)
+
+    def _relevant_rules_text(self, catalog, stage, query, context='', with_conditions=True, narrative_only=False, with_examples=False):
+        """
+        只包含与 query 最相关的 EVAL_RULES_TOP_K 条评估规则的提示文本，并记录节省的字符数；
+        narrative_only 为真时不包含规则引擎已能判定的规则，
+        with_examples 为真时（提示中有评级参考示例）最多放入 FEWSHOT_RULES_TOP_K 条
+        """
+        k = EVAL_RULES_TOP_K
+        if with_examples and FEWSHOT_RULES_TOP_K > 0 and (k <= 0 or FEWSHOT_RULES_TOP_K < k):
+            k = FEWSHOT_RULES_TOP_K
+        text, selected = catalog.rules_prompt(query, context, k, with_conditions, narrative_only)
+        if catalog.evaluation_rules:
+            full_text = catalog.evaluation_rules_text if with_conditions else catalog.guidance_rules_text
+            self.rule_selection.record(stage, len(catalog.evaluation_rules), selected, len(full_text), len(text))
+        return text
+
+    @staticmethod
+    def _rule_engine(catalog):
+        """当前快照中有可本地判定的评估规则且 EVAL_RULE_ENGINE 开启时返回规则引擎，否则返回 None"""
+        engine = catalog.rule_engine
+        return engine if EVAL_RULE_ENGINE and len(engine) else None
+
+    def _apply_rule_engine(self, catalog, evaluation_data, local_rules):
+        """
+        合并规则引擎判定的规则和大模型判定的（引擎无法判定的）规则，
+        按 score_impact 重新计算分数和评级；大模型列出的可本地判定的规则以本地结果为准
+        """
+        engine = catalog.rule_engine
+        rules = list(local_rules)
+        reported = evaluation_data.get('triggered_rules')
+        for name in reported if isinstance(reported, list) else ():
+            rule = catalog.rule_by_name(name) if isinstance(name, str) and name in engine.uncompiled_names else None
+            if rule is not None and rule not in rules:
+                rules.append(rule)
+        evaluation_data['score'], evaluation_data['grade'] = engine.score(rules, EVAL_RULE_BASE_SCORE)
+        evaluation_data['triggered_rules'] = [rule.rule_name for rule in rules]
+        self.rule_engine_evaluations += 1
+        return evaluation_data
+
+    def _degraded_evaluation(self, catalog, local_rules):
+        """降级时的评估结果：规则引擎判定有规则触发时按 score_impact 计分，否则本轮不计分"""
+        if local_rules:
+            return self._apply_rule_engine(catalog, degraded_evaluation(local_rules), local_rules)
+        return degraded_evaluation()
+
+    def _few_shot_examples(self, catalog, parent_input, selected_personality, selected_scenario):
+        """
+        与家长输入最相似的 FEWSHOT_K 条已评级示例 [(相似度, Example)]；
+        理想回应只在关联到当前人格和情境（或不限）的条目中选取
+        """
+        if FEWSHOT_K <= 0:
+            return []
+        results = []
+        if self.examples:
+            results.extend(self.examples.search(parent_input, FEWSHOT_K, FEWSHOT_MIN_SIMILARITY))
+        # 默认情境不是 Strapi 中的记录，不按情境筛选
+        scenario = None if selected_scenario is DEFAULT_SCENARIO else selected_scenario
+        results.extend(catalog.search_ideal_examples(parent_input, selected_personality, scenario, FEWSHOT_K, FEWSHOT_MIN_SIMILARITY))
+        results.sort(key=lambda item: -item[0])
+        return results[:FEWSHOT_K]
+
+    def few_shot_stats(self):
+        """示例检索的统计，用于 /health"""
+        return {
+            "k": FEWSHOT_K,
+            "rules_top_k": FEWSHOT_RULES_TOP_K or None,
+            "graded_dialogues": self.examples.stats() if self.examples else None,
+            "ideal_responses": self.catalog.ideal_example_stats(),
+        }
+
+    @staticmethod
+    def _rule_context(selected_personality, selected_scenario):
+        """参与规则打分的人格和情境描述"""
+        return " ".join(filter(None, (
+            selected_personality.name, selected_personality.description,
+            selected_scenario.name, selected_scenario.description,
+        )))
+
+    def _evaluate_response(self, catalog, parent_input, child_response, selected_personality, selected_scenario, selected_challenge=None):
         """评估家长输入，并返回包含评分、分值和情绪分析的结构化数据。"""
-        # 处理人格数据
-        if 'attributes' in selected_personality:
-            personality_name = selected_personality['attributes']['name']
-            personality_desc = selected_personality['attributes']['description']
-        else:
-            personality_name = selected_personality.get('name', '未知人格')
-            personality_desc = selected_personality.get('description', '')
-        
-        # 处理情境数据
-        if 'attributes' in selected_scenario:
-            scenario_name = selected_scenario['attributes']['name']
-            scenario_desc = selected_scenario['attributes']['description']
-        else:
-            scenario_name = selected_scenario.get('name', '默认情境')
-            scenario_desc = selected_scenario.get('description', '')
-
-        # 构建评估规则提示
-        evaluation_rules_text = ""
-        if self.evaluation_rules:
-            evaluation_rules_text = "\n\n评估规则参考：\n"
-            for rule in self.evaluation_rules:
-                if 'attributes' in rule:
-                    rule_name = rule['attributes'].get('rule_name', '')
-                    rule_desc = rule['attributes'].get('rule_description', '')
-                    trigger_condition = rule['attributes'].get('trigger_condition', '')
-                    score_impact = rule['attributes'].get('score_impact', 0)
-                    evaluation_rules_text += f"- {rule_name}: {rule_desc}\n  触发条件: {trigger_condition}\n  分数影响: {score_impact}\n"
-                else:
-                    rule_name = rule.get('rule_name', '')
-                    rule_desc = rule.get('rule_description', '')
-                    trigger_condition = rule.get('trigger_condition', '')
-                    score_impact = rule.get('score_impact', 0)
-                    evaluation_rules_text += f"- {rule_name}: {rule_desc}\n  触发条件: {trigger_condition}\n  分数影响: {score_impact}\n"
+        # 命中带评级的预设反馈规则时直接使用预设结果，不调用大模型
+        preset = self._feedback_rule_evaluation(catalog, parent_input, selected_personality, selected_challenge)
+        if preset is not None:
+            return preset
+
+        personality_name = selected_personality.name or '未知人格'
+        personality_desc = selected_personality.description
+        scenario_name = selected_scenario.name or '默认情境'
+        scenario_desc = selected_scenario.description
+
+        # 规则引擎能判定的规则在本地判定，提示词中只放入其余规则里与这句话最相关的几条
+        engine = self._rule_engine(catalog)
+        local_rules = engine.triggered(parent_input) if engine else None
+        examples = self._few_shot_examples(catalog, parent_input, selected_personality, selected_scenario)
+        evaluation_rules_text = self._relevant_rules_text(
+            catalog, "evaluation", parent_input, self._rule_context(selected_personality, selected_scenario),
+            narrative_only=engine is not None, with_examples=bool(examples))
 
+        def rescored(evaluation):
+            return self._apply_rule_engine(catalog, evaluation, local_rules) if engine else evaluation
+
+        child_line = f'孩子回应: "{child_response}"'
         evaluation_prompt_messages = [
             {"role": "system", "content": "你是一个专业的亲子沟通AI，请根据家长和孩子的对话，结合评估规则，分析家长的沟通方式并给出评价。"},
             {"role": "user", "content": f"""
@@ -169,26 +686,59 @@ class ChildInteractionSimulator:
             孩子的人格特质描述: {personality_desc}
             
             家长说: "{parent_input}"
-            孩子回应: "{child_response}"
-            {evaluation_rules_text}
+            {child_line}
+            {evaluation_rules_text}{few_shot_text(examples)}
             
             请结合上述评估规则，从以下几个方面进行分析，并以JSON格式返回，不要有其他任何文字：
-            1. **grade**: 根据家长的沟通效果，给出A (优秀), B (良好), 或 C (有待改进)的评级。
-            2. **score**: 给出一个具体的数字分数，A=10, B=5, C=-5。
-            3. **reasonAnalysis**: 简要分析给这个评级的原因，特别说明哪些评估规则被触发。
-            4. **suggestionEncouragement**: 给出具体的沟通建议或鼓励的话语。
-            5. **parent_mood**: 分析家长的输入情绪，是'positive' (积极), 'neutral' (中性), 还是'negative' (负面)。
-            6. **triggered_rules**: 列出被触发的评估规则名称。
+            {evaluation_fields(local_rules, bool(examples))}
             """}
         ]
         
         try:
-            llm_response = self._call_qwen_model(evaluation_prompt_messages)
+            # 孩子回应是抽样生成的，不放入缓存键：同一快照中同样的家长输入、人格和情境命中同一条评估
+            key_messages = [
+                evaluation_prompt_messages[0],
+                {"role": "user", "content": evaluation_prompt_messages[1]["content"].replace(child_line, "", 1)},
+            ]
+            cache_key, llm_response = self._cache_lookup(catalog, key_messages, "evaluation", {"temperature": EVAL_TEMPERATURE})
+            similarity_scope = self._similarity_scope(catalog, selected_personality, selected_scenario)
+            similar = None
+            if llm_response is None and self.similarity_cache:
+                # 同一人格 × 情境下近似重复的家长输入直接复用评估结果，抽样的命中仍调用大模型核对
+                similar, _ = self.similarity_cache.lookup(similarity_scope, parent_input)
+                if similar is not None and not self.similarity_cache.should_verify():
+                    return rescored(copy.deepcopy(similar))
+            if llm_response is None:
+                try:
+                    llm_response = self._call_qwen_model(evaluation_prompt_messages, stage="evaluation", temperature=EVAL_TEMPERATURE)
+                except (CircuitOpenError, DeadlineExceeded) as e:
+                    # 熔断或时间不够时优先使用近似重复的评估结果，没有时本轮不计分
+                    if similar is not None:
+                        return rescored(copy.deepcopy(similar))
+                    self._count_degraded(e, "evaluation")
+                    return self._degraded_evaluation(catalog, local_rules)
+                if llm_response is None:
+                    # 未配置 API Key，或熔断器未打开时单次调用出错 / 超时
+                    if similar is not None:
+                        return rescored(copy.deepcopy(similar))
+                    self._count_degraded(None, "evaluation")
+                    return self._degraded_evaluation(catalog, local_rules)
+            else:
+                cache_key = None
+            fresh = cache_key is not None or not self.llm_cache
             evaluation_data = json.loads(llm_response)
+            # 只缓存新生成且能解析的评估结果
+            self._cache_store(cache_key, llm_response, "evaluation")
             
             # 如果没有触发规则字段，添加默认值
             if 'triggered_rules' not in evaluation_data:
                 evaluation_data['triggered_rules'] = []
+            evaluation_data = rescored(evaluation_data)
+
+            if similar is not None:
+                self.similarity_cache.record_verification(similar.get('grade') == evaluation_data.get('grade'))
+            elif self.similarity_cache and fresh:
+                self.similarity_cache.add(similarity_scope, parent_input, copy.deepcopy(evaluation_data))
                 
             return evaluation_data
         except json.JSONDecodeError as e:
@@ -202,29 +752,129 @@ class ChildInteractionSimulator:
                 "triggered_rules": []
             }
 
-    def _generate_expert_guidance(self, dialogue_log, selected_personality):
+    def _combined_turn_messages(self, catalog, parent_input, selected_personality, selected_scenario, trait_expression=None, local_rules=None):
+        """
+        构建一次调用同时生成孩子回应和评估的提示消息，人格和情境只发送一次；
+        local_rules 为规则引擎已判定触发的规则，为 None 时评级和分数也交给大模型
+        """
+        child_messages = self._child_response_messages(parent_input, selected_personality, selected_scenario, trait_expression)
+        examples = self._few_shot_examples(catalog, parent_input, selected_personality, selected_scenario)
+        evaluation_rules_text = self._relevant_rules_text(
+            catalog, "combined_turn", parent_input, self._rule_context(selected_personality, selected_scenario),
+            narrative_only=local_rules is not None, with_examples=bool(examples))
+        system_content = (
+            "你需要完成两个任务。任务一：" + child_messages[0]["content"] +
+            "任务二：作为专业的亲子沟通AI，结合评估规则分析家长的沟通方式并给出评价。"
+            "只返回一个JSON对象，不要有其他任何文字。"
+        )
+        user_content = f"""
+            家长说: "{parent_input}"
+            {evaluation_rules_text}{few_shot_text(examples)}
+
+            请返回如下格式的JSON：
+            {{"child_response": "孩子对家长这句话的回应", "evaluation": {{...}}}}
+            其中 evaluation 包含：
+            {evaluation_fields(local_rules, bool(examples))}
+            """
+        return [
+            {"role": "system", "content": system_content},
+            {"role": "user", "content": user_content},
+        ]
+
+    def _combined_turn(self, catalog, parent_input, selected_personality, selected_scenario, selected_challenge, trait_expression=None):
+        """
+        用一次大模型调用同时生成孩子回应和评估，返回 (child_response, evaluation, degraded)。
+
+        命中预设反馈规则或近似重复的评估结果时只需要孩子回应，按普通方式生成（近似重复的命中按抽样比例
+        仍走合并调用核对）；合并调用的输出包含抽样生成的孩子回应，与孩子回应一样只在
+        LLM_CACHE_CHILD_RESPONSES 开启时使用大模型回复缓存。
+        合并调用的输出中某一部分缺失或无法解析时，只为这一部分单独补一次调用。
+        """
+        engine = self._rule_engine(catalog)
+        local_rules = engine.triggered(parent_input) if engine else None
+
+        def rescored(evaluation):
+            return self._apply_rule_engine(catalog, evaluation, local_rules) if engine else evaluation
+
+        evaluation = self._feedback_rule_evaluation(catalog, parent_input, selected_personality, selected_challenge)
+        similarity_scope = self._similarity_scope(catalog, selected_personality, selected_scenario)
+        similar = None
+        if evaluation is None and self.similarity_cache:
+            similar, _ = self.similarity_cache.lookup(similarity_scope, parent_input)
+            if similar is not None and not self.similarity_cache.should_verify():
+                evaluation, similar = rescored(copy.deepcopy(similar)), None
+
+        child_response, degraded = None, False
+        if evaluation is None:
+            prompt_messages = self._combined_turn_messages(catalog, parent_input, selected_personality, selected_scenario, trait_expression, local_rules)
+            cache_key, llm_response = None, None
+            if LLM_CACHE_CHILD_RESPONSES:
+                cache_key, llm_response = self._cache_lookup(catalog, prompt_messages, "combined_turn")
+            fresh = llm_response is None
+            if fresh:
+                error = None
+                try:
+                    llm_response = self._call_qwen_model(prompt_messages, stage="combined_turn", response_format={"type": "json_object"})
+                except (CircuitOpenError, DeadlineExceeded) as e:
+                    error = e
+                if error is not None or llm_response is None:
+                    # 熔断、时间不够或调用失败：孩子回应降级，评估优先使用近似重复的结果
+                    self._count_degraded(error, "combined_turn")
+                    evaluation = rescored(copy.deepcopy(similar)) if similar is not None else self._degraded_evaluation(catalog, local_rules)
+                    return degraded_child_response(parent_input, trait_expression), evaluation, True
+            if llm_response:
+                child_response, evaluation = parse_combined_turn(llm_response, required="reasonAnalysis" if engine else "grade")
+                if child_response is None or evaluation is None:
+                    print(f"WARNING: 合并调用的输出不完整，单独补调用。原始回应: {llm_response}", file=sys.stderr)
+                elif fresh:
+                    # 只缓存新生成且两部分都能解析的输出
+                    self._cache_store(cache_key, llm_response, "combined_turn")
+                if evaluation is not None:
+                    evaluation = rescored(evaluation)
+                    if similar is not None:
+                        self.similarity_cache.record_verification(similar.get('grade') == evaluation.get('grade'))
+                    elif self.similarity_cache and fresh:
+                        self.similarity_cache.add(similarity_scope, parent_input, copy.deepcopy(evaluation))
+            if evaluation is None and similar is not None:
+                # 核对调用没有得到评估，使用近似重复的结果，不再单独补调用
+                evaluation = rescored(copy.deepcopy(similar))
+            if child_response is None:
+                self.combined_fallbacks["child_response"] += 1
+            if evaluation is None:
+                self.combined_fallbacks["evaluation"] += 1
+
+        if child_response is None:
+            try:
+                child_response = self._generate_child_response_with_qwen(catalog, parent_input, selected_personality, selected_scenario, trait_expression)
+            except (CircuitOpenError, DeadlineExceeded) as e:
+                child_response, degraded = degraded_child_response(parent_input, trait_expression), True
+                self._count_degraded(e, "child_response")
+            if child_response is None:
+                child_response, degraded = degraded_child_response(parent_input, trait_expression), True
+                self._count_degraded(None, "child_response")
+            if not child_response:
+                return None, None, degraded
+        if evaluation is None:
+            evaluation = self._evaluate_response(catalog, parent_input, child_response, selected_personality, selected_scenario, selected_challenge)
+        return child_response, evaluation, degraded
+
+    def _generate_expert_guidance(self, catalog, dialogue_log, selected_personality):
         """根据完整的对话历史生成专家指导"""
         try:
-            personality_name = selected_personality.get('attributes', {}).get('name', '未知人格')
+            personality_name = selected_personality.name or '未知人格'
             
             formatted_dialogue = "\n".join([
                 f"家长说: \"{d.get('parent_input', '')}\"\n孩子回应: \"{d.get('child_response', '')}\"\n评价: {d.get('evaluation', {}).get('reasonAnalysis', '无评价')}\n触发规则: {d.get('evaluation', {}).get('triggered_rules', [])}"
                 for d in dialogue_log
             ])
 
-            # 构建评估规则参考
-            evaluation_rules_text = ""
-            if self.evaluation_rules:
-                evaluation_rules_text = "\n\n评估规则参考：\n"
-                for rule in self.evaluation_rules:
-                    if 'attributes' in rule:
-                        rule_name = rule['attributes'].get('rule_name', '')
-                        rule_desc = rule['attributes'].get('rule_description', '')
-                        evaluation_rules_text += f"- {rule_name}: {rule_desc}\n"
-                    else:
-                        rule_name = rule.get('rule_name', '')
-                        rule_desc = rule.get('rule_description', '')
-                        evaluation_rules_text += f"- {rule_name}: {rule_desc}\n"
+            # 只放入与整段对话中家长的话最相关的评估规则
+            evaluation_rules_text = self._relevant_rules_text(
+                catalog, "expert_guidance",
+                " ".join(d.get('parent_input', '') for d in dialogue_log),
+                " ".join(filter(None, (selected_personality.name, selected_personality.description))),
+                with_conditions=False,
+            )
 
             guidance_prompt_messages = [
                 {"role": "system", "content": "你是一个专业的亲子沟通专家，请根据以下对话历史和评估规则，给家长提供一份全面而有针对性的指导和鼓励。"},
@@ -241,7 +891,7 @@ class ChildInteractionSimulator:
                 """}
             ]
             
-            llm_response = self._call_qwen_model(guidance_prompt_messages)
+            llm_response = self._call_qwen_model(guidance_prompt_messages, stage="expert_guidance")
             if not llm_response:
                 raise ValueError("大模型回应为空")
                 
@@ -264,62 +914,262 @@ class ChildInteractionSimulator:
                 "ruleInsights": "无法分析评估规则"
             }
 
-    def simulate_dialogue(self, parent_input, personality_id, daily_challenge_theme_id):
-        """模拟一轮对话，返回一个元组(response, error)"""
-        selected_personality = next((p for p in self.personalities if str(p.get('id')) == str(personality_id)), None)
-        selected_challenge = next((c for c in self.daily_challenges if str(c.get('id')) == str(daily_challenge_theme_id)), None)
+    def _prepare_turn(self, catalog, personality_id, daily_challenge_theme_id):
+        """
+        查找一轮对话用到的人格、挑战、情境和特质表现，
+        返回一个元组((personality, challenge, scenario, trait_expression), error)
+        """
+        selected_personality = catalog.get_personality(personality_id)
+        selected_challenge = catalog.get_challenge(daily_challenge_theme_id)
 
         if not selected_personality or not selected_challenge:
             return None, "无效的人格或挑战主题ID。"
 
-        selected_scenario = self._find_matching_scenario(selected_challenge)
+        scenario_instances, trait_expression = (), None
+        if self.details:
+            scenario_instances = self.details.scenario_instances(catalog, selected_personality, selected_challenge)
+            trait_expression = self.details.trait_expression(catalog, selected_personality, selected_challenge)
+
+        selected_scenario = self._find_matching_scenario(selected_challenge, scenario_instances)
         if not selected_scenario:
             return None, "无法找到匹配的具体情境。"
-        
-        child_response = self._generate_child_response_with_qwen(parent_input, selected_personality, selected_scenario)
-        if not child_response:
-            return None, "大模型生成回应失败。"
-        
-        evaluation_result = self._evaluate_response(parent_input, child_response, selected_personality, selected_scenario)
+        return (selected_personality, selected_challenge, selected_scenario, trait_expression), None
+
+    def simulate_dialogue(self, parent_input, personality_id, daily_challenge_theme_id):
+        """模拟一轮对话，返回一个元组(response, error)"""
+        # 整轮对话只使用这一份快照
+        catalog = self.catalog
+        turn, error = self._prepare_turn(catalog, personality_id, daily_challenge_theme_id)
+        if error:
+            return None, error
+        selected_personality, selected_challenge, selected_scenario, trait_expression = turn
+
+        started = time.monotonic()
+        if DIALOGUE_TURN_MODE == "combined":
+            child_response, evaluation_result, degraded = self._combined_turn(
+                catalog, parent_input, selected_personality, selected_scenario, selected_challenge, trait_expression)
+            if not child_response:
+                return None, "大模型生成回应失败。"
+        else:
+            degraded = False
+            try:
+                child_response = self._generate_child_response_with_qwen(catalog, parent_input, selected_personality, selected_scenario, trait_expression)
+            except (CircuitOpenError, DeadlineExceeded) as e:
+                child_response, degraded = degraded_child_response(parent_input, trait_expression), True
+                self._count_degraded(e, "child_response")
+            if child_response is None:
+                child_response, degraded = degraded_child_response(parent_input, trait_expression), True
+                self._count_degraded(None, "child_response")
+            if not child_response:
+                return None, "大模型生成回应失败。"
+
+            evaluation_result = self._evaluate_response(catalog, parent_input, child_response, selected_personality, selected_scenario, selected_challenge)
         if not evaluation_result:
             return None, "大模型评估失败。"
-            
-        return jsonify({
+        self.turn_stats.record(DIALOGUE_TURN_MODE, time.monotonic() - started)
+
+        response = {
             "response": child_response,
             "evaluation": evaluation_result
-        }), None
+        }
+        if degraded:
+            # 孩子回应来自预设内容，前端可据此提示
+            response["degraded"] = True
+        return jsonify(response), None
 
-    def _find_matching_scenario(self, challenge):
-        """从挑战主题中随机选择一个情境实例"""
-        try:
-            # 检查是否有Strapi格式的数据结构
-            if 'attributes' in challenge and 'dialogue_scenarios' in challenge['attributes']:
-                scenarios = challenge['attributes']['dialogue_scenarios']['data']
-                if scenarios:
-                    return random.choice(scenarios)
-            
-            # 检查是否有scenario字段（默认数据格式）
-            if 'scenario' in challenge and challenge['scenario']:
-                return challenge['scenario']
-            
-            # 如果没有找到情境，创建一个默认情境
-            return {
-                'id': 1,
-                'attributes': {
-                    'name': '默认情境',
-                    'description': '这是一个默认的情境，用于测试对话功能。'
-                }
-            }
-        except Exception as e:
-            print(f"ERROR: 查找匹配情境失败: {e}", file=sys.stderr)
-            # 返回默认情境
-            return {
-                'id': 1,
-                'attributes': {
-                    'name': '默认情境',
-                    'description': '这是一个默认的情境，用于测试对话功能。'
-                }
-            }
+    def stream_dialogue(self, parent_input, personality_id, daily_challenge_theme_id):
+        """
+        流式模拟一轮对话，逐个产出 (事件名, 数据)：
+        delta（孩子回应的增量文本）、child_response（完整回应）、evaluation（评估结果）、
+        error（出错，随后结束）、done（结束）。
+        """
+        catalog = self.catalog
+        turn, error = self._prepare_turn(catalog, personality_id, daily_challenge_theme_id)
+        if error:
+            yield "error", {"error": error}
+            return
+        selected_personality, selected_challenge, selected_scenario, trait_expression = turn
+
+        prompt_messages = self._child_response_messages(parent_input, selected_personality, selected_scenario, trait_expression)
+        cache_key, cached = None, None
+        if LLM_CACHE_CHILD_RESPONSES:
+            cache_key, cached = self._cache_lookup(catalog, prompt_messages, "child_response")
+        degraded = False
+        if cached is not None:
+            child_response = cached
+            yield "delta", {"text": child_response}
+        else:
+            parts = []
+            try:
+                for delta in self._stream_qwen_model(prompt_messages, stage="child_response_stream", reserve=DEADLINE_EVALUATION_RESERVE):
+                    parts.append(delta)
+                    yield "delta", {"text": delta}
+            except (CircuitOpenError, DeadlineExceeded) as e:
+                cache_key = None
+                if parts:
+                    # 时间用完时已经输出的部分作为孩子回应
+                    print(f"WARNING: 请求剩余时间不足，孩子回应在 {len(parts)} 段后截断", file=sys.stderr)
+                else:
+                    parts, degraded = [degraded_child_response(parent_input, trait_expression)], True
+                    self._count_degraded(e, "child_response")
+                    yield "delta", {"text": parts[0]}
+            except dashscope_client.DashScopeError as e:
+                print(f"ERROR: 流式调用大模型失败（已收到 {len(parts)} 段内容）。错误: {e}", file=sys.stderr)
+                cache_key = None
+            except concurrent.futures.TimeoutError:
+                print(f"ERROR: 流式调用大模型超时（{LLM_ASYNC_TIMEOUT} 秒内没有新内容，已收到 {len(parts)} 段内容）", file=sys.stderr)
+                cache_key = None
+            if not parts:
+                # 未配置 API Key 或调用出错时没有任何内容，使用预设回应
+                parts, degraded = [degraded_child_response(parent_input, trait_expression)], True
+                self._count_degraded(None, "child_response")
+                yield "delta", {"text": parts[0]}
+            child_response = "".join(parts)
+            # 中途出错的不完整回应照常展示，但不写入缓存
+            self._cache_store(cache_key, child_response, "child_response")
+        if not child_response:
+            yield "error", {"error": "大模型生成回应失败。"}
+            return
+        yield "child_response", {"response": child_response, "degraded": True} if degraded else {"response": child_response}
+
+        evaluation_result = self._evaluate_response(catalog, parent_input, child_response, selected_personality, selected_scenario, selected_challenge)
+        if not evaluation_result:
+            yield "error", {"error": "大模型评估失败。"}
+            return
+        yield "evaluation", evaluation_result
+        yield "done", {}
+
+    def turn_mode_stats(self):
+        """
+        按对话模式汇总的整轮耗时和平均每轮 token 用量，用于比较 two_call 与 combined。
+        token 用量取自该模式调用大模型的阶段；combined 模式中单独补的调用计入 two_call 的阶段。
+        """
+        stages = self.llm.stats()
+        modes = self.turn_stats.snapshot()
+        for mode, stats in modes.items():
+            tokens = sum(
+                (stages.get(stage) or {}).get("input_tokens", 0) + (stages.get(stage) or {}).get("output_tokens", 0)
+                for stage in TURN_MODE_STAGES.get(mode, ())
+            )
+            stats["turns"] = stats.pop("calls")
+            stats.pop("errors", None)
+            stats.pop("input_tokens", None)
+            stats.pop("output_tokens", None)
+            stats["tokens_per_turn"] = round(tokens / stats["turns"]) if stats["turns"] else None
+        return {
+            "mode": DIALOGUE_TURN_MODE,
+            "modes": modes,
+            "combined_fallbacks": dict(self.combined_fallbacks),
+            # 合并调用的输出包含孩子回应，只在 LLM_CACHE_CHILD_RESPONSES 开启时走大模型回复缓存
+            "combined_llm_cache": bool(self.llm_cache) and LLM_CACHE_CHILD_RESPONSES,
+        }
+
+    def get_expert_guidance(self, dialogue_log, personality_id):
+        """生成专家指导，返回一个元组(guidance, error)"""
+        catalog = self.catalog
+        selected_personality = catalog.get_personality(personality_id)
+        if not selected_personality:
+            return None, "无效的人格ID。"
+        return self._generate_expert_guidance(catalog, dialogue_log, selected_personality), None
+
+    def _find_matching_scenario(self, challenge, scenario_instances=()):
+        """
+        随机选择一个情境实例：优先使用该人格专属的情境实例，其次是挑战主题关联的情境，
+        都没有时使用默认情境
+        """
+        if scenario_instances:
+            return random.choice(scenario_instances)
+        if challenge.scenarios:
+            return random.choice(challenge.scenarios)
+        return DEFAULT_SCENARIO
+
+# 按需加载特质表现和情境实例，按人格 × 挑战缓存
+strapi_details = None
+if STRAPI_DETAIL_CACHE_SIZE > 0:
+    strapi_details = StrapiDetailLoader(
+        STRAPI_API_URL,
+        LRUCache(maxsize=STRAPI_DETAIL_CACHE_SIZE, ttl=STRAPI_DETAIL_CACHE_TTL),
+        timeout=STRAPI_DETAIL_TIMEOUT,
+        use_projection=STRAPI_PROJECTION,
+        failure_backoff=STRAPI_DETAIL_FAILURE_BACKOFF,
+    )
+
+# 异步大模型调用路径：每个进程一个事件循环线程，第一次调用时启动
+llm_runtime, async_llm = None, None
+if LLM_ASYNC:
+    if dashscope_client.httpx is None:
+        print("WARNING: LLM_ASYNC=1 但未安装 httpx，大模型调用使用同步路径", file=sys.stderr)
+    else:
+        llm_runtime = AsyncRuntime(max_concurrency=LLM_MAX_CONCURRENCY)
+        async_llm = dashscope_client.AsyncDashScopeClient()
+
+# 对冲请求，按阶段的延迟分位数触发，额外请求受预算限制
+hedger = None
+if LLM_HEDGE:
+    if llm_runtime is None:
+        print("WARNING: LLM_HEDGE=1 需要异步调用路径（LLM_ASYNC=1 且已安装 httpx），不启用对冲请求", file=sys.stderr)
+    else:
+        hedger = Hedger(
+            dashscope_client.call_stats,
+            percentile=LLM_HEDGE_PERCENTILE,
+            min_samples=LLM_HEDGE_MIN_SAMPLES,
+            min_delay=LLM_HEDGE_MIN_DELAY,
+            budget_ratio=LLM_HEDGE_BUDGET,
+            stages=LLM_HEDGE_STAGES,
+        )
+
+# 大模型调用熔断器，每个 worker 进程一份
+llm_breaker = None
+if LLM_BREAKER:
+    llm_breaker = CircuitBreaker(
+        "dashscope",
+        window=LLM_BREAKER_WINDOW,
+        min_calls=LLM_BREAKER_MIN_CALLS,
+        error_rate=LLM_BREAKER_ERROR_RATE,
+        slow_call=LLM_BREAKER_SLOW_CALL,
+        slow_rate=LLM_BREAKER_SLOW_RATE,
+        open_seconds=LLM_BREAKER_OPEN_SECONDS,
+    )
+
+# 大模型回复的精确匹配缓存：内存 LRU + 本机所有 worker 共用的 SQLite 文件
+llm_cache = None
+if LLM_CACHE_SIZE > 0:
+    llm_cache = LLMResponseCache(
+        LRUCache(maxsize=LLM_CACHE_SIZE, ttl=LLM_CACHE_TTL),
+        path=LLM_CACHE_PATH,
+        ttl=LLM_CACHE_TTL,
+        max_rows=LLM_CACHE_MAX_ROWS,
+    )
+
+# 近似重复的评估结果缓存，每个 worker 进程一份
+similarity_cache = None
+if EVAL_SIMILARITY_CACHE_SIZE > 0:
+    similarity_cache = SimilarityCache(
+        maxsize=EVAL_SIMILARITY_CACHE_SIZE,
+        threshold=EVAL_SIMILARITY_THRESHOLD,
+        verify_rate=EVAL_SIMILARITY_VERIFY_RATE,
+    )
+
+# 合并进行中的相同大模型请求；等待其他 worker 的时间与单次调用的超时一致
+single_flight = None
+if LLM_SINGLE_FLIGHT:
+    shared_flights = None
+    if LLM_SINGLE_FLIGHT_SHARED_PATH:
+        shared_flights = SharedFlights(LLM_SINGLE_FLIGHT_SHARED_PATH, lease=LLM_ASYNC_TIMEOUT)
+    # 熔断器打开对所有等待方都成立；leader 自己的截止时间、超时不传给等待方
+    single_flight = SingleFlight(shared=shared_flights, wait_timeout=LLM_ASYNC_TIMEOUT, shared_errors=(CircuitOpenError,))
+
+# 已评级对话记录的示例索引，启动时构建一次（preload 模式下在 master 中构建，worker 共享）
+example_index = None
+if FEWSHOT_K > 0:
+    example_index = ExampleIndex(dedupe_examples([example for path in FEWSHOT_PATHS for example in load_jsonl_examples(path)]))
+    print(f"INFO: 评级参考示例索引已构建: {len(example_index)} 条", file=sys.stderr)
+
+# 进程内唯一的对话引擎，load_strapi_data 加载完成后切换其数据快照
+simulator = ChildInteractionSimulator(details=strapi_details, async_llm=async_llm, runtime=llm_runtime,
+                                      llm_cache=llm_cache, similarity_cache=similarity_cache,
+                                      single_flight=single_flight, hedger=hedger, breaker=llm_breaker,
+                                      examples=example_index)
 
 # 路由部分
 @app.route('/')
@@ -335,16 +1185,15 @@ def test_guidance():
 @app.route('/get_personalities', methods=['GET'])
 def get_personalities():
     """获取所有孩子人格"""
-    return jsonify(global_strapi_data_cache.get('personalities', []))
+    return jsonify(list(simulator.catalog.raw.get('personalities', ())))
 
 @app.route('/get_daily_challenges', methods=['GET'])
 def get_daily_challenges():
     """获取所有日常挑战主题"""
-    return jsonify(global_strapi_data_cache.get('daily-challenges', []))
+    return jsonify(list(simulator.catalog.raw.get('daily-challenges', ())))
 
-@app.route('/simulate_dialogue', methods=['POST'])
-def simulate_dialogue_route():
-    """处理一轮对话模拟"""
+def read_dialogue_request(route_name):
+    """读取并检查对话请求参数，返回 ((parent_input, personality_id, daily_challenge_id), error_response)"""
     data = request.get_json()
     parent_input = data.get('parent_input')
     personality_id = data.get('personality_id')
@@ -352,29 +1201,54 @@ def simulate_dialogue_route():
     
     # 增加更详细的参数检查和日志
     if not parent_input:
-        print("ERROR: simulate_dialogue request is missing 'parent_input'", file=sys.stderr)
-        return jsonify({"error": "缺少必要的对话参数: parent_input。"}), 400
+        print(f"ERROR: {route_name} request is missing 'parent_input'", file=sys.stderr)
+        return None, (jsonify({"error": "缺少必要的对话参数: parent_input。"}), 400)
     if not personality_id:
-        print("ERROR: simulate_dialogue request is missing 'personality_id'", file=sys.stderr)
-        return jsonify({"error": "缺少必要的对话参数: personality_id。"}), 400
+        print(f"ERROR: {route_name} request is missing 'personality_id'", file=sys.stderr)
+        return None, (jsonify({"error": "缺少必要的对话参数: personality_id。"}), 400)
     if not daily_challenge_theme_id:
-        print("ERROR: simulate_dialogue request is missing 'daily_challenge_id'", file=sys.stderr)
-        return jsonify({"error": "缺少必要的对话参数: daily_challenge_id。"}), 400
-
-    simulator = ChildInteractionSimulator(
-        global_strapi_data_cache.get('personalities', []),
-        global_strapi_data_cache.get('trait-expressions', []),
-        global_strapi_data_cache.get('scenario-instances', []),
-        global_strapi_data_cache.get('daily-challenges', []),
-        global_strapi_data_cache.get('evaluation-rules', [])
-    )
-    
-    result, error = simulator.simulate_dialogue(parent_input, personality_id, daily_challenge_theme_id)
+        print(f"ERROR: {route_name} request is missing 'daily_challenge_id'", file=sys.stderr)
+        return None, (jsonify({"error": "缺少必要的对话参数: daily_challenge_id。"}), 400)
+    return (parent_input, personality_id, daily_challenge_theme_id), None
+
+@app.route('/simulate_dialogue', methods=['POST'])
+def simulate_dialogue_route():
+    """处理一轮对话模拟"""
+    params, error_response = read_dialogue_request('simulate_dialogue')
+    if error_response:
+        return error_response
+    parent_input, personality_id, daily_challenge_theme_id = params
+
+    # 各个步骤共用 REQUEST_SLA 秒，时间不够时跳过或降级，保证在 worker 超时之前返回
+    with deadline.scope(REQUEST_SLA):
+        result, error = simulator.simulate_dialogue(parent_input, personality_id, daily_challenge_theme_id)
     if error:
         return jsonify({"error": error}), 500
     
     return result
 
+@app.route('/simulate_dialogue_stream', methods=['POST'])
+def simulate_dialogue_stream_route():
+    """
+    流式处理一轮对话模拟（Server-Sent Events）：孩子回应逐段推送（delta），
+    完整回应（child_response）之后推送评估结果（evaluation），最后是 done 或 error。
+    """
+    params, error_response = read_dialogue_request('simulate_dialogue_stream')
+    if error_response:
+        return error_response
+
+    def events():
+        # 生成器在路由函数返回之后才执行，截止时间在这里设置
+        with deadline.scope(REQUEST_SLA):
+            for event, data in simulator.stream_dialogue(*params):
+                yield f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+    return Response(events(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        # 关闭反向代理（nginx 等）的响应缓冲，增量内容立即送达浏览器
+        'X-Accel-Buffering': 'no',
+    })
+
 @app.route('/get_expert_guidance', methods=['POST'])
 def get_expert_guidance():
     """处理专家指导请求"""
@@ -390,137 +1264,345 @@ def get_expert_guidance():
         print("ERROR: get_expert_guidance request is missing 'personality_id'", file=sys.stderr)
         return jsonify({"error": "缺少必要的参数: personality_id。"}), 400
 
-    simulator = ChildInteractionSimulator(
-        global_strapi_data_cache.get('personalities', []),
-        global_strapi_data_cache.get('trait-expressions', []),
-        global_strapi_data_cache.get('scenario-instances', []),
-        global_strapi_data_cache.get('daily-challenges', []),
-        global_strapi_data_cache.get('evaluation-rules', [])
-    )
-
-    selected_personality = next((p for p in simulator.personalities if str(p.get('id')) == str(personality_id)), None)
-    if not selected_personality:
-        return jsonify({"error": "无效的人格ID。"}), 400
-        
-    guidance = simulator._generate_expert_guidance(dialogue_log, selected_personality)
+    with deadline.scope(REQUEST_SLA):
+        guidance, error = simulator.get_expert_guidance(dialogue_log, personality_id)
+    if error:
+        return jsonify({"error": error}), 400
     
     return jsonify(guidance)
 
+@app.route('/health', methods=['GET'])
+def health():
+    """健康检查，返回当前数据快照的概况"""
+    catalog = simulator.catalog
+    return jsonify({
+        "status": "ok",
+        "catalog_version": catalog.version,
+        "personalities_count": len(catalog.personalities),
+        "daily_challenges_count": len(catalog.daily_challenges),
+        "evaluation_rules_count": len(catalog.evaluation_rules),
+        "evaluation_rules_top_k": EVAL_RULES_TOP_K or None,
+        "evaluation_rule_selection": simulator.rule_selection.stats(),
+        "evaluation_rule_context_cache": catalog.rule_context_cache_stats(),
+        "evaluation_rule_engine": {
+            "enabled": EVAL_RULE_ENGINE,
+            "compiled_rules": len(catalog.rule_engine),
+            "llm_judged_rules": len(catalog.rule_engine.uncompiled),
+            "evaluations_scored": simulator.rule_engine_evaluations,
+        },
+        "feedback_rules_count": len(catalog.feedback_rules),
+        "ideal_responses_count": len(catalog.ideal_responses),
+        "few_shot_examples": simulator.few_shot_stats(),
+        "feedback_rule_hits": simulator.feedback_rule_hits,
+        "simulator_initialized": bool(catalog.version),
+        "strapi_load_seconds": {key: round(seconds, 3) for key, seconds in strapi_load_timings.items()},
+        "strapi_detail_cache": strapi_details.stats() if strapi_details else None,
+        "llm_calls": simulator.llm.stats(),
+        "llm_async": llm_runtime.stats() if llm_runtime else None,
+        "llm_hedging": hedger.stats() if hedger else None,
+        "llm_circuit_breaker": llm_breaker.stats() if llm_breaker else None,
+        "request_sla": REQUEST_SLA or None,
+        "degraded_responses": dict(simulator.degraded_responses),
+        "dialogue_turns": simulator.turn_mode_stats(),
+        "llm_response_cache": llm_cache.stats() if llm_cache else None,
+        "evaluation_similarity_cache": similarity_cache.stats() if similarity_cache else None,
+        "llm_single_flight": single_flight.stats() if single_flight else None,
+    })
+
+@app.route('/webhooks/strapi', methods=['POST'])
+def strapi_webhook_route():
+    """接收 Strapi 条目变更事件，立即更新内存中的数据快照"""
+    if not STRAPI_WEBHOOK_SECRET:
+        print("ERROR: 收到 Strapi Webhook，但 STRAPI_WEBHOOK_SECRET 未设置。", file=sys.stderr)
+        return jsonify({"error": "Webhook 未启用。"}), 403
+
+    body = request.get_data()
+    try:
+        strapi_webhook.verify_request(
+            STRAPI_WEBHOOK_SECRET,
+            request.headers.get(strapi_webhook.TIMESTAMP_HEADER),
+            request.headers.get(strapi_webhook.SIGNATURE_HEADER),
+            body,
+        )
+    except strapi_webhook.WebhookError as e:
+        print(f"WARNING: 拒绝 Strapi Webhook: {e}", file=sys.stderr)
+        return jsonify({"error": str(e)}), 401
+
+    try:
+        event, collection_key, entry = strapi_webhook.parse_event(body)
+    except strapi_webhook.WebhookError as e:
+        print(f"WARNING: Strapi Webhook 内容无效: {e}", file=sys.stderr)
+        return jsonify({"error": str(e)}), 400
+
+    if collection_key is None:
+        return jsonify({"status": "ignored"}), 202
+
+    if event in strapi_webhook.REMOVE_EVENTS:
+        changed = strapi_syncer.remove_entry(collection_key, entry)
+    elif 'publishedAt' in entry and not entry['publishedAt']:
+        # 草稿的修改不影响已发布内容
+        changed = False
+    else:
+        changed = strapi_syncer.patch_entry(collection_key, entry)
+
+    print(f"INFO: 收到 Strapi Webhook: {event} {collection_key} id={entry.get('id')} changed={changed}", file=sys.stderr)
+    if changed:
+        strapi_syncer.notify()
+    return jsonify({"status": "ok", "changed": changed, "catalog_version": simulator.catalog.version})
+
+
+# Strapi 不可用时使用的默认数据
+DEFAULT_PERSONALITIES = [
+    {
+        'id': 1,
+        'attributes': {
+            'name': '慢能量孩子',
+            'description': '性格内向，反应较慢，需要更多时间思考和回应'
+        }
+    },
+    {
+        'id': 2,
+        'attributes': {
+            'name': '破能量孩子',
+            'description': '性格外向，反应较快，容易冲动'
+        }
+    }
+]
+
+DEFAULT_DAILY_CHALLENGES = [
+    {
+        'id': 1,
+        'attributes': {
+            'name': '学习与成长',
+            'description': '与孩子的学习习惯、作业、考试等相关的挑战'
+        }
+    },
+    {
+        'id': 2,
+        'attributes': {
+            'name': '情绪管理',
+            'description': '孩子在表达、理解和控制自己情绪方面的挑战'
+        }
+    }
+]
+
 
-def load_strapi_data():
+def build_catalog(collections):
+    """用原始集合构建数据快照，人格或挑战为空时使用默认数据"""
+    return Catalog.from_collections(
+        personalities=collections.get('personalities') or DEFAULT_PERSONALITIES,
+        daily_challenges=collections.get('daily-challenges') or DEFAULT_DAILY_CHALLENGES,
+        evaluation_rules=collections.get('evaluation-rules') or [],
+        feedback_rules=collections.get('feedback-rules') or [],
+        ideal_responses=collections.get('ideal-responses') or [],
+    )
+
+
+# 本地快照文件中当前保存的数据版本及 bundle ETag，都未变化时不重复写入
+snapshot_file_version = None
+snapshot_file_etag = None
+
+
+def save_catalog_snapshot(collections, catalog, etag=None):
     """
-    加载 Strapi 中的所有数据，并在应用启动时运行
+    把来自 Strapi 的数据写入本地快照文件，只有默认数据时不写入。
+    etag 只在集合整体来自 bootstrap bundle 时传入，增量同步得到的集合不对应任何 ETag。
     """
-    global global_strapi_data_cache
-    
-    print("INFO: 正在尝试从 Strapi 加载数据...", file=sys.stderr)
-    simulator = ChildInteractionSimulator([], [], [], [], [])
-    
+    global snapshot_file_version, snapshot_file_etag
+    if not STRAPI_SNAPSHOT_PATH:
+        return
+    if catalog.version == snapshot_file_version and (not etag or etag == snapshot_file_etag):
+        return
+    if not collections.get('personalities') or not collections.get('daily-challenges'):
+        return
+    if save_snapshot(STRAPI_SNAPSHOT_PATH, collections, catalog.version, etag=etag):
+        snapshot_file_version = catalog.version
+        snapshot_file_etag = etag
+        print(f"INFO: 数据快照已保存到 {STRAPI_SNAPSHOT_PATH}（版本 {catalog.version}）", file=sys.stderr)
+
+
+def apply_strapi_collections(collections):
+    """增量同步发现变化后的回调：构建新快照并原子切换"""
+    catalog = build_catalog(collections)
+    if catalog.version != simulator.catalog.version:
+        simulator.swap_catalog(catalog)
+        save_catalog_snapshot(collections, catalog)
+
+
+# 启动时每个集合的加载耗时（秒），由 /health 返回
+strapi_load_timings = {}
+
+# 后台增量同步器，启动加载完成后用已加载的数据初始化
+strapi_syncer = StrapiSyncer(
+    STRAPI_API_URL,
+    on_change=apply_strapi_collections,
+    interval=STRAPI_SYNC_INTERVAL,
+    id_check_every=STRAPI_SYNC_ID_CHECK_EVERY,
+    use_projection=STRAPI_PROJECTION,
+)
+
+
+def load_bootstrap_bundle(fallback=None, etag=None):
+    """
+    一次请求从 bootstrap bundle 接口拉取全部集合。
+
+    etag 为本地快照对应的 ETag，服务端内容未变化时返回 304，直接沿用 fallback。
+
+    Returns:
+        tuple | None: (collections, timings, etag)，接口不可用时返回 None
+    """
+    started = time.perf_counter()
     try:
-        # 使用 STRAPI_API_URL 变量
-        personalities_data = simulator._get_entity_data_from_strapi("personality-traits")
-        daily_challenges_data = simulator._get_entity_data_from_strapi("daily-challenges")
-        evaluation_rules_data = simulator._get_entity_data_from_strapi("evaluation-rules")
-
-        # 处理人格数据
-        if not personalities_data:
-            print("WARNING: 无法从Strapi加载人格数据，使用默认数据", file=sys.stderr)
-            personalities_data = [
-                {
-                    'id': 1,
-                    'attributes': {
-                        'name': '慢能量孩子',
-                        'description': '性格内向，反应较慢，需要更多时间思考和回应'
-                    }
-                },
-                {
-                    'id': 2,
-                    'attributes': {
-                        'name': '破能量孩子',
-                        'description': '性格外向，反应较快，容易冲动'
-                    }
-                }
-            ]
-        
-        # 处理挑战数据
-        if not daily_challenges_data:
-            print("WARNING: 无法从Strapi加载挑战数据，使用默认数据", file=sys.stderr)
-            daily_challenges_data = [
-                {
-                    'id': 1,
-                    'attributes': {
-                        'name': '学习与成长',
-                        'description': '与孩子的学习习惯、作业、考试等相关的挑战'
-                    }
-                },
-                {
-                    'id': 2,
-                    'attributes': {
-                        'name': '情绪管理',
-                        'description': '孩子在表达、理解和控制自己情绪方面的挑战'
-                    }
-                }
-            ]
-        
-        # 处理评估规则数据
-        if not evaluation_rules_data:
-            print("WARNING: 无法从Strapi加载评估规则数据，使用默认数据", file=sys.stderr)
-            evaluation_rules_data = []
-        
-        # 存储到全局缓存
-        global_strapi_data_cache['personalities'] = personalities_data
-        global_strapi_data_cache['daily-challenges'] = daily_challenges_data
-        global_strapi_data_cache['evaluation-rules'] = evaluation_rules_data
-        
-        print("INFO: Strapi数据加载完成.", file=sys.stderr)
-        print(f"INFO: 加载了 {len(global_strapi_data_cache['personalities'])} 个人格.", file=sys.stderr)
-        print(f"INFO: 加载了 {len(global_strapi_data_cache['daily-challenges'])} 个挑战主题.", file=sys.stderr)
-
-    except Exception as e:
-        print(f"WARNING: 无法从Strapi加载数据，使用默认数据. 错误: {e}", file=sys.stderr)
-        # 如果加载失败，使用默认数据
-        global_strapi_data_cache['personalities'] = [
-            {
-                'id': 1,
-                'attributes': {
-                    'name': '慢能量孩子',
-                    'description': '性格内向，反应较慢，需要更多时间思考和回应'
-                }
-            },
-            {
-                'id': 2,
-                'attributes': {
-                    'name': '破能量孩子',
-                    'description': '性格外向，反应较快，容易冲动'
-                }
-            }
-        ]
-        global_strapi_data_cache['daily-challenges'] = [
-            {
-                'id': 1,
-                'attributes': {
-                    'name': '学习与成长',
-                    'description': '与孩子的学习习惯、作业、考试等相关的挑战'
-                }
-            },
-            {
-                'id': 2,
-                'attributes': {
-                    'name': '情绪管理',
-                    'description': '孩子在表达、理解和控制自己情绪方面的挑战'
-                }
-            }
-        ]
-        global_strapi_data_cache['evaluation-rules'] = []
-        print("INFO: 使用默认数据完成初始化.", file=sys.stderr)
+        collections, new_etag = fetch_bootstrap_bundle(STRAPI_API_URL, etag=etag if fallback else None)
+    except StrapiFetchError as e:
+        print(f"WARNING: bootstrap bundle 不可用，改为逐个集合拉取。错误: {e}", file=sys.stderr)
+        return None
+    elapsed = time.perf_counter() - started
+    if collections is None:
+        print(f"INFO: bootstrap bundle 未变化（ETag {etag}），沿用本地快照，耗时 {elapsed:.2f} 秒", file=sys.stderr)
+        collections = {key: list(items or []) for key, items in fallback.items()}
+    else:
+        counts = ', '.join(f"{key} {len(items)} 条" for key, items in collections.items())
+        print(f"INFO: 加载 bootstrap bundle 完成: {counts}，耗时 {elapsed:.2f} 秒", file=sys.stderr)
+    return collections, {'bootstrap-bundle': elapsed}, new_etag
 
-# 在应用启动时加载数据
-load_strapi_data()
 
-if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000)
+def load_strapi_data(fallback=None, etag=None):
+    """
+    加载 Strapi 中的所有数据，并在应用启动时运行。
+
+    数据先加载到局部变量中，构建好新的不可变快照后再一次性切换，
+    正在处理的请求继续使用旧快照。
+    fallback 为本地快照中的集合，某个集合拉取失败时沿用它，而不是退回默认数据；
+    etag 为该快照对应的 bootstrap bundle ETag。
+    """
+    print("INFO: 正在尝试从 Strapi 加载数据...", file=sys.stderr)
+
+    # 优先一次请求拉取全部集合；接口不可用（旧版 Strapi）或关闭字段投影时逐个集合拉取
+    bundle = load_bootstrap_bundle(fallback, etag) if STRAPI_BOOTSTRAP_BUNDLE and STRAPI_PROJECTION else None
+    if bundle:
+        collections, timings, etag = bundle
+    else:
+        etag = None
+        # 各集合并发拉取，每个集合自动翻页直到 pageCount，只请求提示词用到的字段
+        collections, timings = load_collections(
+            STRAPI_API_URL,
+            use_projection=STRAPI_PROJECTION,
+            page_size=STRAPI_PAGE_SIZE,
+        )
+
+    for key, items in collections.items():
+        if items is None and (fallback or {}).get(key):
+            print(f"WARNING: 无法从Strapi加载 {key}，继续使用本地快照中的数据", file=sys.stderr)
+            collections[key] = fallback[key]
+
+    if not collections.get('personalities'):
+        print("WARNING: 无法从Strapi加载人格数据，使用默认数据", file=sys.stderr)
+    if not collections.get('daily-challenges'):
+        print("WARNING: 无法从Strapi加载挑战数据，使用默认数据", file=sys.stderr)
+    if not collections.get('evaluation-rules'):
+        print("WARNING: 无法从Strapi加载评估规则数据，使用默认数据", file=sys.stderr)
+
+    print("INFO: Strapi数据加载完成.", file=sys.stderr)
+    print(f"INFO: 加载了 {len(collections.get('personalities') or [])} 个人格.", file=sys.stderr)
+    print(f"INFO: 加载了 {len(collections.get('daily-challenges') or [])} 个挑战主题.", file=sys.stderr)
+
+    # 没有从 Strapi 加载到的集合交给后台同步做全量拉取
+    for key, entities in collections.items():
+        strapi_syncer.seed(key, entities or None)
+
+    # 构建新的不可变快照并原子切换
+    catalog = build_catalog(collections)
+    if catalog.version != simulator.catalog.version:
+        simulator.swap_catalog(catalog)
+    strapi_load_timings.clear()
+    strapi_load_timings.update(timings)
+    print(f"INFO: 数据目录已构建: {catalog}", file=sys.stderr)
+    save_catalog_snapshot(collections, catalog, etag=etag)
+
+
+def warm_start():
+    """
+    启动时优先从本地快照加载数据，立即可以处理请求，
+    再在后台线程中从 Strapi 刷新；没有快照时同步加载。
+    """
+    global snapshot_file_version, snapshot_file_etag
+    snapshot = load_snapshot(STRAPI_SNAPSHOT_PATH)
+    if not snapshot:
+        load_strapi_data()
+        return
+
+    collections = snapshot['collections']
+    for key, entities in collections.items():
+        strapi_syncer.seed(key, entities or None)
+    catalog = build_catalog(collections)
+    snapshot_file_version = catalog.version
+    snapshot_file_etag = snapshot.get('etag')
+    simulator.swap_catalog(catalog)
+
+    threading.Thread(
+        target=load_strapi_data,
+        kwargs={'fallback': collections, 'etag': snapshot_file_etag},
+        name='strapi-refresh',
+        daemon=True,
+    ).start()
+
+def reload_from_snapshot(snapshot):
+    """快照文件被其他进程更新后的回调：切换到文件中的数据"""
+    global snapshot_file_version, snapshot_file_etag
+    snapshot_file_version = snapshot.get('version')
+    snapshot_file_etag = snapshot.get('etag')
+    collections = snapshot['collections']
+    catalog = build_catalog(collections)
+    if catalog.version == simulator.catalog.version:
+        return
+    for key, entities in collections.items():
+        strapi_syncer.seed(key, entities or None)
+    simulator.swap_catalog(catalog)
 
 
+# 监视本地快照文件，其他进程写入新数据后在本进程重新加载
+snapshot_watcher = SnapshotWatcher(
+    STRAPI_SNAPSHOT_PATH,
+    on_reload=reload_from_snapshot,
+    interval=STRAPI_SNAPSHOT_WATCH_INTERVAL,
+)
 
 
+def start_snapshot_watcher():
+    if STRAPI_SNAPSHOT_PATH and STRAPI_SNAPSHOT_WATCH_INTERVAL > 0:
+        snapshot_watcher.start()
 
+
+def warm_up_llm():
+    """在后台预热实际会使用的 DashScope 连接（异步路径或同步连接池）"""
+    if llm_runtime:
+        llm_runtime.submit(async_llm.warm_up())
+    else:
+        simulator.llm.warm_up_in_background()
+
+
+def on_worker_start():
+    """
+    gunicorn preload 模式下由 gunicorn.conf.py 的 post_fork 钩子调用。
+
+    数据目录已在 master 中加载，worker 通过 fork 的写时复制直接共享，不再各自请求 Strapi。
+    后台增量同步只在 master 中运行并写入快照文件，worker 只监视快照文件并在变化时重新加载。
+    """
+    simulator.reset_after_fork()
+    strapi_syncer.reset_after_fork()
+    snapshot_watcher.reset_after_fork()
+    start_snapshot_watcher()
+    warm_up_llm()
+
+
+# 在应用启动时加载数据，并启动后台增量同步；同时预热到 DashScope 的连接
+# （preload 模式下 worker fork 后会重新建立连接池并再次预热）
+warm_up_llm()
+warm_start()
+if STRAPI_SYNC_INTERVAL > 0:
+    strapi_syncer.start()
+start_snapshot_watcher()
+
+if __name__ == '__main__':
+    app.run(debug=True, host='0.0.0.0', port=5000)
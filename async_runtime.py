@@ -0,0 +1,165 @@
+# my-project/async_runtime.py
+"""
+进程内共享的 asyncio 事件循环
+
+WSGI（gunicorn + Flask）的请求处理本身是同步的，因此不为每个请求创建事件循环，
+而是在每个进程中运行一个后台事件循环线程：请求线程把协程提交到这个循环并等待结果，
+大模型调用在循环中以协程方式执行，由信号量限制每个进程同时进行的调用数。
+
+配合 gunicorn 的 gthread worker（见 gunicorn.conf.py），等待大模型的请求只占用
+一个轻量线程，真正的网络 I/O 由单个事件循环复用少量连接完成；超过并发上限的调用
+在信号量上排队（协程），而不是占满 worker 进程。
+"""
+
+import asyncio
+import concurrent.futures
+import queue
+import sys
+import threading
+import time
+
+
+class AsyncRuntime:
+    """
+    后台事件循环线程，第一次提交协程时启动。
+
+    Args:
+        max_concurrency (int): 每个进程同时进行的大模型调用数上限
+        name (str): 线程名称
+    """
+
+    def __init__(self, max_concurrency=16, name='llm-async'):
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.name = name
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._semaphore = None
+        self.in_flight = 0
+        self.waiting = 0
+        self.completed = 0
+        self.timeouts = 0
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._loop is not None:
+                return self._loop
+            loop = asyncio.new_event_loop()
+            ready = threading.Event()
+
+            def run():
+                asyncio.set_event_loop(loop)
+                # Python 3.9 的 Semaphore 在创建时绑定当前事件循环，必须在循环线程中创建
+                self._semaphore = asyncio.Semaphore(self.max_concurrency)
+                loop.call_soon(ready.set)
+                loop.run_forever()
+
+            self._thread = threading.Thread(target=run, name=self.name, daemon=True)
+            self._thread.start()
+            ready.wait()
+            self._loop = loop
+            print(f"INFO: 异步事件循环已启动，大模型调用并发上限 {self.max_concurrency}", file=sys.stderr)
+            return loop
+
+    async def limited(self, awaitable, on_acquire=None):
+        """
+        在并发上限内执行 awaitable（在事件循环中调用）；
+        on_acquire 在取得并发名额后、开始执行前调用，用于把排队时间和调用耗时分开统计
+        """
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        if on_acquire is not None:
+            on_acquire()
+        self.in_flight += 1
+        try:
+            return await awaitable
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    def submit(self, coro):
+        """把协程提交到事件循环，返回 concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self._ensure_started())
+
+    def run(self, coro, timeout=None):
+        """
+        在事件循环中执行协程并阻塞等待结果（在请求线程中调用）。
+
+        Raises:
+            concurrent.futures.TimeoutError: 超过 timeout 秒未完成，协程会被取消
+        """
+        future = self.submit(coro)
+        try:
+            result = future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            self.timeouts += 1
+            raise
+        self.completed += 1
+        return result
+
+    def iterate(self, async_iterable, timeout=None, until=None):
+        """
+        在事件循环中消费异步迭代器（受并发上限约束），在调用线程中逐个产出元素，
+        用于把流式输出转发给同步的 Flask 流式响应。
+
+        调用方提前关闭生成器（例如客户端断开）时取消事件循环中的任务。
+
+        Raises:
+            concurrent.futures.TimeoutError: 相邻两个元素之间超过 timeout 秒，
+                或者到了 until（time.monotonic() 时刻）仍未结束
+        """
+        items = queue.Queue()
+        finished = object()
+
+        async def pump():
+            try:
+                async for item in async_iterable:
+                    items.put((True, item))
+            except Exception as e:
+                items.put((False, e))
+            finally:
+                items.put((True, finished))
+
+        future = self.submit(self.limited(pump()))
+        try:
+            while True:
+                wait = timeout
+                if until is not None:
+                    left = max(0.0, until - time.monotonic())
+                    wait = left if wait is None else min(wait, left)
+                try:
+                    ok, item = items.get(timeout=wait)
+                except queue.Empty:
+                    self.timeouts += 1
+                    raise concurrent.futures.TimeoutError()
+                if not ok:
+                    raise item
+                if item is finished:
+                    self.completed += 1
+                    return
+                yield item
+        finally:
+            future.cancel()
+
+    def stats(self):
+        return {
+            "running": self._loop is not None,
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "completed": self.completed,
+            "timeouts": self.timeouts,
+        }
+
+    def reset_after_fork(self):
+        """fork 之后在子进程中调用：父进程的事件循环线程不会被继承，下一次提交时重新启动"""
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._semaphore = None
+        self.in_flight = 0
+        self.waiting = 0
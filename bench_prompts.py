@@ -0,0 +1,117 @@
+# my-project/bench_prompts.py
+"""
+每轮构建提示词的耗时：缓存人格 × 情境的静态部分之前和之后
+
+用接近真实规模的人格（长描述、8 个关键特征）、挑战和 30 条评估规则，测量一轮对话中
+评估 / 合并调用提示词里评估规则部分的构建耗时：
+
+- 规则筛选：人格和情境描述的 bigram 打分每轮重新计算（之前）vs 按描述缓存（rule_selector.py，之后）；
+- 规则文本：入选规则每轮重新渲染（之前）vs 拼接快照中预先渲染的文本（strapi_catalog.py，之后）；
+
+并给出 child_main.py 两个提示词构建函数（只有 f-string 拼接）的耗时作参考，核对前后得到的文本相同。
+
+    python bench_prompts.py [轮数]
+"""
+
+import contextlib
+import io
+import sys
+import time
+
+import child_main
+from rule_selector import RuleIndex
+from strapi_catalog import Catalog, Scenario, _rules_prompt_text
+
+PARENT_INPUTS = [
+    "你怎么又把玩具扔得到处都是？快去收拾！",
+    "我知道你现在很难过，妈妈陪你坐一会儿好吗？",
+    "再不写作业就别想看电视了。",
+    "你觉得这件事我们可以怎么一起解决呢？",
+]
+
+
+def _sample_collections(rules=30):
+    personality = {
+        "id": 1,
+        "name": "内省温和型",
+        "description": "内省温和、知足随性、追求和谐与安全，但行动力可能受阻的孩子。" * 6,
+        "keycharacteristic": ["高共情与利他倾向", "知足与低物欲", "豁达与顺势而为", "周全思考与计划倾向",
+                              "行动力不足 / 拖延", "高包容与不争", "自洽与内在平衡", "治愈系气质"],
+        "core_need_description": "内在和谐与平静，渴望自身思想和外部环境都处于平静、和谐的状态，避免冲突和纷争。" * 2,
+    }
+    challenge = {
+        "id": 1,
+        "name": "拖延写作业",
+        "description": "放学回家后迟迟不开始写作业，一直在玩或发呆，家长催促时表现出抵触。" * 3,
+    }
+    evaluation_rules = [
+        {
+            "id": index,
+            "rule_name": f"规则{index}",
+            "rule_description": f"家长在沟通中表现出第 {index} 类沟通方式，会影响孩子的安全感和配合意愿。" * 2,
+            "trigger_condition": f'家长说出"关键词{index}"、"说法{index}"等表达',
+            "score_impact": -5 if index % 2 else 5,
+        }
+        for index in range(rules)
+    ]
+    return personality, challenge, evaluation_rules
+
+
+def _per_turn_us(function, turns):
+    started = time.perf_counter()
+    for turn in range(turns):
+        function(PARENT_INPUTS[turn % len(PARENT_INPUTS)])
+    return round((time.perf_counter() - started) / turns * 1e6, 2)
+
+
+def bench(turns=20000, k=8):
+    personality_entity, challenge_entity, rule_entities = _sample_collections()
+    catalog = Catalog.from_collections(
+        personalities=[personality_entity], daily_challenges=[challenge_entity], evaluation_rules=rule_entities)
+    personality, challenge = catalog.personalities[0], catalog.daily_challenges[0]
+    scenario = Scenario.from_entity({"id": 1, "name": "作业时间", "description": challenge_entity["description"]})
+    # 与 app.py 的 _rule_context 相同
+    context = " ".join((personality.name, personality.description, scenario.name, scenario.description))
+    uncached_index = RuleIndex(catalog.evaluation_rules, context_cache_size=0)
+
+    def before(parent_input):
+        return _rules_prompt_text(uncached_index.select(parent_input, context, k), with_conditions=True)
+
+    def after(parent_input):
+        return catalog.rules_prompt(parent_input, context, k)[0]
+
+    for parent_input in PARENT_INPUTS:
+        if before(parent_input) != after(parent_input):
+            raise AssertionError("缓存前后筛选出的评估规则文本不同")
+
+    selected = catalog.select_rules(PARENT_INPUTS[0], context, k)
+    with contextlib.redirect_stdout(io.StringIO()):
+        legacy = child_main.ChildInteractionSimulator([personality_entity], [], [], [challenge_entity])
+    legacy_personality, legacy_challenge = legacy.catalog.personalities[0], legacy.catalog.daily_challenges[0]
+
+    results = {
+        "rules_prompt": {"before_us": _per_turn_us(before, turns), "after_us": _per_turn_us(after, turns)},
+        "rule_selection": {
+            "before_us": _per_turn_us(lambda text: uncached_index.select(text, context, k), turns),
+            "after_us": _per_turn_us(lambda text: catalog.select_rules(text, context, k), turns),
+        },
+        "rules_text": {
+            "before_us": _per_turn_us(lambda text: _rules_prompt_text(selected, True), turns),
+            "after_us": _per_turn_us(lambda text: _rules_prompt_text(selected, True, catalog._rule_lines), turns),
+        },
+        "child_main.build_child_response_prompt_us": _per_turn_us(
+            lambda text: legacy.build_child_response_prompt(text, legacy_personality, legacy_challenge), turns),
+        "child_main.build_evaluation_prompt_us": _per_turn_us(
+            lambda text: legacy.build_evaluation_prompt(text, "我等一下再写嘛", legacy_personality, legacy_challenge), turns),
+        "context_cache": catalog.rule_context_cache_stats()["all_rules"],
+    }
+    for result in results.values():
+        if isinstance(result, dict) and "before_us" in result:
+            result["speedup"] = round(result["before_us"] / result["after_us"], 1)
+    return results
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    for name, result in bench(count).items():
+        print(f"{name}: {result}")
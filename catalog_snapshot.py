@@ -0,0 +1,147 @@
+# my-project/catalog_snapshot.py
+"""
+数据目录的本地快照文件
+
+把从 Strapi 加载到的原始集合保存为带格式版本号的紧凑 JSON 文件，
+worker 启动时先从快照加载（毫秒级），再在后台从 Strapi 刷新。
+写入时先写临时文件再 os.replace，读取方不会读到写了一半的文件。
+
+快照文件同时是多进程之间的重新加载协议：任一进程（gunicorn master 或某个 worker）
+拿到新数据后写入快照文件，其余进程的 SnapshotWatcher 发现文件变化后重新加载。
+"""
+
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+# 快照文件格式版本，结构变化时递增，旧格式的快照会被忽略
+SNAPSHOT_FORMAT = 1
+
+
+def save_snapshot(path, collections, version, etag=None):
+    """
+    保存快照文件。
+
+    Args:
+        path (str): 快照文件路径
+        collections (dict): 集合键 -> 原始记录列表
+        version (str): 数据目录版本号
+        etag (str): 这些集合来自 bootstrap bundle 时对应的 ETag，下次启动时用于条件请求
+
+    Returns:
+        bool: 是否保存成功
+    """
+    payload = {
+        'format': SNAPSHOT_FORMAT,
+        'version': version,
+        'etag': etag,
+        'saved_at': time.time(),
+        'collections': {key: list(items or []) for key, items in collections.items()},
+    }
+    directory = os.path.dirname(os.path.abspath(path))
+    try:
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix='.snapshot-', dir=directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(payload, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+    except OSError as e:
+        print(f"WARNING: 保存数据快照失败: {e}", file=sys.stderr)
+        return False
+    return True
+
+
+def load_snapshot(path):
+    """
+    读取快照文件。
+
+    Returns:
+        dict | None: 快照内容（含 version、etag、saved_at、collections），
+        文件不存在、损坏或格式版本不一致时返回 None
+    """
+    if not path or not os.path.exists(path):
+        return None
+    started = time.perf_counter()
+    try:
+        with open(path, 'rb') as f:
+            payload = json.loads(f.read())
+    except (OSError, ValueError) as e:
+        print(f"WARNING: 读取数据快照失败，忽略该文件: {e}", file=sys.stderr)
+        return None
+    if not isinstance(payload, dict) or payload.get('format') != SNAPSHOT_FORMAT:
+        print(f"WARNING: 数据快照格式版本不匹配，忽略该文件: {path}", file=sys.stderr)
+        return None
+    if not isinstance(payload.get('collections'), dict):
+        print(f"WARNING: 数据快照内容不完整，忽略该文件: {path}", file=sys.stderr)
+        return None
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    age = time.time() - (payload.get('saved_at') or 0)
+    print(f"INFO: 已读取数据快照 {path}（版本 {payload.get('version')}，{age:.0f} 秒前保存，耗时 {elapsed_ms:.1f} 毫秒）", file=sys.stderr)
+    return payload
+
+
+class SnapshotWatcher:
+    """
+    监视快照文件，文件被替换后读取新快照并调用 on_reload(payload)。
+
+    只比较文件的 mtime 和大小，每轮开销是一次 stat 调用。
+    """
+
+    def __init__(self, path, on_reload, interval=5):
+        self.path = path
+        self.on_reload = on_reload
+        self.interval = interval
+        self._signature = self._stat()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def check_once(self):
+        """检查一次文件是否变化，变化时重新加载，返回是否调用了 on_reload"""
+        signature = self._stat()
+        if signature is None or signature == self._signature:
+            return False
+        self._signature = signature
+        payload = load_snapshot(self.path)
+        if not payload:
+            return False
+        try:
+            self.on_reload(payload)
+        except Exception as e:
+            print(f"ERROR: 应用数据快照失败: {e}", file=sys.stderr)
+            return False
+        return True
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            self.check_once()
+
+    def start(self):
+        """启动监视线程（守护线程）"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='snapshot-watcher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def reset_after_fork(self):
+        """fork 之后在子进程中调用，重新创建线程状态"""
+        self._stop_event = threading.Event()
+        self._thread = None
@@ -5,6 +5,11 @@ import uuid
 import os
 from dotenv import load_dotenv
 
+import dashscope_client
+import deadline
+from keyword_matcher import KeywordMatcher
+from strapi_catalog import Catalog
+
 # 移除不必要的导入，因为我们使用直接的 HTTP 请求
 # from api_llm_caller import call_llm_placeholder
 # from my_prompts import GENERATE_CHILD_RESPONSE_PROMPT, EVALUATE_CHILD_RESPONSE_PROMPT
@@ -17,6 +22,10 @@ STRAPI_BASE_URL = "http://127.0.0.1:1337"
 STRAPI_API_PERSONALITY_PATH = "personality-traits" # 确保与 Strapi Collection Type API ID 一致
 STRAPI_API_SCENARIO_PATH = "dialogue-scenarios"
 
+# --- 千问 API 配置 ---
+# 单次调用的读取超时（秒），与改用共享客户端之前相同，不使用客户端默认的 DASHSCOPE_READ_TIMEOUT
+QWEN_API_TIMEOUT = 30
+
 class ChildInteractionSimulator:
     def __init__(self, personality_data, trait_expression_data, scenario_instance_data, daily_challenges_data):
         # 1. 基础验证：确保传入的数据列表存在（可以为空，但不能为None）
@@ -28,6 +37,12 @@ class ChildInteractionSimulator:
         self.trait_expressions = trait_expression_data or []
         self.scenario_instances = scenario_instance_data or []
         self.daily_challenges = daily_challenges_data or []
+
+        # 规范化数据目录，按名称 O(1) 查找人格和挑战
+        self.catalog = Catalog.from_collections(
+            personalities=self.personalities,
+            daily_challenges=self.daily_challenges,
+        )
         
         # 3. 打印初始化信息
         print(f"ChildInteractionSimulator initialized with:")
@@ -104,57 +119,39 @@ class ChildInteractionSimulator:
         if not api_key:
             raise ValueError("未设置 ALIYUN_DASHSCOPE_API_KEY 环境变量")
         
-        # 阿里云 DashScope API 端点
-        url = "https://dashscope.aliyuncs.com/api/v1/services/aigc/text-generation/generation"
-        
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        payload = {
-            "model": model,
-            "input": {
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ]
-            },
-            "parameters": {
-                "temperature": temperature,
-                "max_tokens": max_tokens,
-                "top_p": 0.8,
-                "result_format": "message"
+        messages = [
+            {
+                "role": "user",
+                "content": prompt
             }
-        }
+        ]
         
         try:
             print(f"DEBUG: 正在调用千问 API，模型: {model}")
-            response = requests.post(url, headers=headers, json=payload, timeout=30)
-            response.raise_for_status()
-            
-            result = response.json()
-            print(f"DEBUG: 千问 API 响应: {result}")
+            # 通过共享客户端调用（连接池复用、统一超时）
+            completion = dashscope_client.get_client().complete(
+                messages,
+                model=model,
+                stage="child_main",
+                api_key=api_key,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                top_p=0.8,
+                # 在设置了截止时间的请求中，超时不超过剩余时间
+                timeout=deadline.budget(QWEN_API_TIMEOUT),
+            )
+            print(f"DEBUG: 千问 API 耗时: {completion.latency:.2f} 秒，用量: {completion.usage}")
             
-            # 提取响应内容
-            if 'output' in result and 'choices' in result['output']:
-                content = result['output']['choices'][0]['message']['content']
-                # 清理 Markdown 标记
-                cleaned_content = self.clean_markdown_content(content)
-                print(f"DEBUG: 原始 API 响应: {content}")
-                print(f"DEBUG: 清理后的内容: {cleaned_content}")
-                return cleaned_content
-            else:
-                raise ValueError(f"千问 API 响应格式异常: {result}")
+            content = completion.content
+            # 清理 Markdown 标记
+            cleaned_content = self.clean_markdown_content(content)
+            print(f"DEBUG: 原始 API 响应: {content}")
+            print(f"DEBUG: 清理后的内容: {cleaned_content}")
+            return cleaned_content
                 
-        except requests.exceptions.RequestException as e:
+        except dashscope_client.DashScopeError as e:
             print(f"ERROR: 调用千问 API 失败: {e}")
             raise
-        except Exception as e:
-            print(f"ERROR: 处理千问 API 响应失败: {e}")
-            raise
 
     def build_child_response_prompt(self, parent_utterance, personality_data, challenge_data):
         """
@@ -162,19 +159,19 @@ class ChildInteractionSimulator:
         
         Args:
             parent_utterance (str): 父级输入
-            personality_data (dict): 人格数据
-            challenge_data (dict): 挑战数据
+            personality_data (Personality): 人格记录
+            challenge_data (DailyChallenge): 挑战记录
             
         Returns:
             str: 构建的提示
         """
-        personality_name = personality_data.get('name', '未知人格')
-        personality_desc = personality_data.get('description', '无描述')
-        key_characteristics = personality_data.get('keycharacteristic', [])
-        core_need = personality_data.get('core_need_description', '无')
+        personality_name = personality_data.name or '未知人格'
+        personality_desc = personality_data.description or '无描述'
+        key_characteristics = personality_data.key_characteristics
+        core_need = personality_data.core_need_description or '无'
         
-        challenge_name = challenge_data.get('name', '未知挑战')
-        challenge_desc = challenge_data.get('description', '无描述')
+        challenge_name = challenge_data.name or '未知挑战'
+        challenge_desc = challenge_data.description or '无描述'
         
         # 构建特征字符串
         characteristics_str = "、".join(key_characteristics) if key_characteristics else "无特殊特征"
@@ -210,19 +207,19 @@ class ChildInteractionSimulator:
         Args:
             parent_utterance (str): 父级输入
             child_response (str): 孩子回应
-            personality_data (dict): 人格数据
-            challenge_data (dict): 挑战数据
+            personality_data (Personality): 人格记录
+            challenge_data (DailyChallenge): 挑战记录
             
         Returns:
             str: 构建的提示
         """
-        personality_name = personality_data.get('name', '未知人格')
-        personality_desc = personality_data.get('description', '无描述')
-        key_characteristics = personality_data.get('keycharacteristic', [])
-        core_need = personality_data.get('core_need_description', '无')
+        personality_name = personality_data.name or '未知人格'
+        personality_desc = personality_data.description or '无描述'
+        key_characteristics = personality_data.key_characteristics
+        core_need = personality_data.core_need_description or '无'
         
-        challenge_name = challenge_data.get('name', '未知挑战')
-        challenge_desc = challenge_data.get('description', '无描述')
+        challenge_name = challenge_data.name or '未知挑战'
+        challenge_desc = challenge_data.description or '无描述'
         
         characteristics_str = "、".join(key_characteristics) if key_characteristics else "无特殊特征"
         
@@ -289,28 +286,21 @@ class ChildInteractionSimulator:
 
     def simulate_dialogue(self, parent_utterance, selected_personality_name, selected_challenge_name):
         # 这个方法接收到选定的人格名称和挑战名称
-        # 首先，从存储的列表中查找对应的完整数据对象
+        # 从规范化的数据目录中按名称直接查找对应的记录
 
-        current_personality = next(
-            (p for p in self.personalities if p.get('name') == selected_personality_name),
-            None
-        )
+        current_personality = self.catalog.personality_by_name(selected_personality_name)
         if not current_personality:
             raise ValueError(f"模拟对话失败: 找不到指定的人格 '{selected_personality_name}'。")
 
-        # 从 daily_challenges 中查找挑战数据
-        current_challenge = next(
-            (c for c in self.daily_challenges if c.get('name') == selected_challenge_name),
-            None
-        )
+        current_challenge = self.catalog.challenge_by_name(selected_challenge_name)
         if not current_challenge:
             raise ValueError(f"模拟对话失败: 找不到指定的挑战 '{selected_challenge_name}'。")
 
-        # 现在，您有了 `current_personality` 和 `current_challenge` 这两个字典，
+        # 现在，您有了 `current_personality` 和 `current_challenge` 这两条记录，
         # 它们包含了选定人格和挑战的所有详细信息。
         # 您可以从这里安全地访问它们的属性，例如：
-        personality_description = current_personality.get('description', '无描述')
-        challenge_name = current_challenge.get('name', '无挑战名称')
+        personality_description = current_personality.description or '无描述'
+        challenge_name = current_challenge.name or '无挑战名称'
         # ... 以及其他您需要的人格或挑战属性
 
         # --- 【在这里集成您的 LLM 模型和模拟逻辑】 ---
@@ -318,7 +308,7 @@ class ChildInteractionSimulator:
         # 这将是您核心模拟逻辑的地方，需要结合 personality, trait_expressions, scenario_instances,
         # 以及 parent_utterance 和 LLM 来生成 child_response 和评估。
 
-        print(f"DEBUG: 正在模拟对话。父级输入: '{parent_utterance}', 选定人格: '{current_personality.get('name')}', 选定挑战: '{current_challenge.get('name')}'")
+        print(f"DEBUG: 正在模拟对话。父级输入: '{parent_utterance}', 选定人格: '{current_personality.name}', 选定挑战: '{current_challenge.name}'")
         
         try:
             # 1. 构建孩子回应的提示
@@ -363,14 +353,14 @@ class ChildInteractionSimulator:
                     "evaluation_score": 65,
                     "reason_analysis": "父母回应需要改进，缺乏对孩子人格特质和核心需求的深入理解",
                     "parent_input_analysis": {
-                        "recognized_trait": current_personality.get('keycharacteristic', ['无'])[0] if current_personality.get('keycharacteristic') else '无',
-                        "recognized_need": current_personality.get('core_need_description', '无'),
+                        "recognized_trait": current_personality.key_characteristics[0] if current_personality.key_characteristics else '无',
+                        "recognized_need": current_personality.core_need_description or '无',
                         "communication_style": "一般询问式",
                         "positive_aspects": ["尝试沟通"],
                         "areas_for_improvement": ["需要更好地理解孩子的人格特质", "缺乏针对性的回应", "沟通方式需要改进"]
                     },
                     "child_desired_response": "理想回应",
-                    "child_desired_response_inner_monologue": f"（内心独白）作为{current_personality.get('name', '孩子')}，我希望父母能更好地理解我的{current_personality.get('core_need_description', '需求')}。"
+                    "child_desired_response_inner_monologue": f"（内心独白）作为{current_personality.name or '孩子'}，我希望父母能更好地理解我的{current_personality.core_need_description or '需求'}。"
                 }
             
             return result
@@ -379,18 +369,18 @@ class ChildInteractionSimulator:
             print(f"ERROR: 调用千问 API 失败，使用模拟响应: {e}")
             # 如果 API 调用失败，返回模拟响应
             mock_response = {
-                "child_response": f"（孩子作为'{current_personality.get('name')}'人格，在'{current_challenge.get('name')}'挑战下回应）我听到了你的话，我需要一点时间来思考一下。",
+                "child_response": f"（孩子作为'{current_personality.name}'人格，在'{current_challenge.name}'挑战下回应）我听到了你的话，我需要一点时间来思考一下。",
                 "evaluation_score": random.randint(50, 75),
                 "reason_analysis": "父母回应需要改进，缺乏对孩子人格特质和核心需求的深入理解。沟通方式有待提升。",
                 "parent_input_analysis": {
-                    "recognized_trait": current_personality.get('keycharacteristic', ['无'])[0] if current_personality.get('keycharacteristic') else '无',
-                    "recognized_need": current_personality.get('core_need_description', '无'),
+                    "recognized_trait": current_personality.key_characteristics[0] if current_personality.key_characteristics else '无',
+                    "recognized_need": current_personality.core_need_description or '无',
                     "communication_style": "一般询问式，缺乏针对性",
                     "positive_aspects": ["尝试沟通"],
                     "areas_for_improvement": ["需要更好地理解孩子的人格特质", "缺乏针对性的回应", "沟通方式需要改进", "需要更有同理心"]
                 },
                 "child_desired_response": "（理想回应）谢谢你，妈妈/爸爸，给我点时间，我很快就会告诉你我的想法。",
-                "child_desired_response_inner_monologue": f"（内心独白）作为{current_personality.get('name', '孩子')}，我希望父母能更好地理解我的{current_personality.get('core_need_description', '需求')}。"
+                "child_desired_response_inner_monologue": f"（内心独白）作为{current_personality.name or '孩子'}，我希望父母能更好地理解我的{current_personality.core_need_description or '需求'}。"
             }
             print(f"DEBUG: 模拟响应内心独白字段值: {mock_response['child_desired_response_inner_monologue']}")
             return mock_response
@@ -497,6 +487,19 @@ class ChildInteractionSimulator:
             self.core_need = {"description": "无核心需求"}
             self.current_scenario = {"name": "默认情境", "description": "无描述"}
 
+    def _parent_inputs_matcher(self):
+        """
+        把 parent_inputs_map 中所有预设的关键词编译为一个自动机，
+        parent_inputs_map 被替换或增删条目后重新编译。
+        """
+        source = self.parent_inputs_map
+        cached = getattr(self, '_parent_inputs_matcher_cache', None)
+        if cached is None or cached[0] is not source or cached[1] != len(source):
+            matcher = KeywordMatcher((preset_map.get('parent_keywords', []), preset_map) for preset_map in source)
+            cached = (source, len(source), matcher)
+            self._parent_inputs_matcher_cache = cached
+        return cached[2]
+
     def _build_llm_prompt(self, parent_input):
         # 将列表形式的特征拼接成字符串，方便LLM理解
         personality_key_chars_str = "\n- " + "\n- ".join(self.personality_key_chars) if self.personality_key_chars else "无"
@@ -507,15 +510,11 @@ class ChildInteractionSimulator:
         # 预设回应匹配
         matched_preset_response = None
         matched_follow_up_hint = None
-        parent_input_lower = parent_input.lower()
-        for preset_map in self.parent_inputs_map:
-            keywords = preset_map.get('parent_keywords', [])
-            child_resp_template = preset_map.get('child_response_template')
-            follow_up_hint = preset_map.get('follow_up_prompt_hint')
-            if any(keyword.lower() in parent_input_lower for keyword in keywords):
-                matched_preset_response = child_resp_template
-                matched_follow_up_hint = follow_up_hint
-                break
+        # 所有预设关键词在一个自动机中，只扫描一遍家长输入；多条命中时取排在最前的预设
+        preset_map = self._parent_inputs_matcher().first(parent_input)
+        if preset_map:
+            matched_preset_response = preset_map.get('child_response_template')
+            matched_follow_up_hint = preset_map.get('follow_up_prompt_hint')
 
         if matched_preset_response:
             prompt_parts = [
@@ -0,0 +1,164 @@
+# my-project/circuit_breaker.py
+"""
+大模型调用的熔断器
+
+DashScope 出错或变慢时，每个请求仍要等到超时才失败，请求线程和并发名额都被占住，
+worker 很快全部堵在一个已经不可用的依赖上。熔断器统计最近一段时间内调用的失败率和慢调用比例：
+
+- closed（正常）：调用照常进行，记录结果；失败率或慢调用比例超过阈值时转为 open；
+- open（熔断）：直接拒绝调用（抛出 CircuitOpenError），调用方立即返回降级结果；
+  持续 open_seconds 秒后转为 half_open；
+- half_open（试探）：只放行 probes 个试探调用，全部成功则恢复 closed，任意一个失败或过慢则重新 open。
+
+每个 worker 进程各自统计、各自熔断。
+"""
+
+import sys
+import threading
+import time
+from collections import deque
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """熔断器处于打开状态，调用被拒绝"""
+
+
+class CircuitBreaker:
+    """
+    按失败率和慢调用比例熔断，线程安全。
+
+    Args:
+        name (str): 名称，用于日志
+        window (float): 统计窗口（秒）
+        min_calls (int): 窗口内调用数少于该值时不熔断
+        error_rate (float): 触发熔断的失败率
+        slow_call (float): 超过该耗时（秒）的调用视为慢调用
+        slow_rate (float): 触发熔断的慢调用比例
+        open_seconds (float): 熔断持续时间（秒），之后进入试探状态
+        probes (int): 试探状态下放行的调用数
+    """
+
+    def __init__(self, name="llm", window=30, min_calls=10, error_rate=0.5, slow_call=10,
+                 slow_rate=0.8, open_seconds=15, probes=1):
+        self.name = name
+        self.window = window
+        self.min_calls = max(1, int(min_calls))
+        self.error_rate = error_rate
+        self.slow_call = slow_call
+        self.slow_rate = slow_rate
+        self.open_seconds = open_seconds
+        self.probes = max(1, int(probes))
+        self._lock = threading.Lock()
+        self._calls = deque()
+        self._failures = 0
+        self._slow = 0
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        self.times_opened = 0
+        self.rejected = 0
+
+    def _prune(self, now):
+        """在持有 self._lock 时调用，丢弃统计窗口之外的调用"""
+        while self._calls and self._calls[0][0] < now - self.window:
+            _, failed, slow = self._calls.popleft()
+            self._failures -= failed
+            self._slow -= slow
+
+    def _open(self, now, reason):
+        """在持有 self._lock 时调用"""
+        self._state = OPEN
+        self._opened_at = now
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        self.times_opened += 1
+        print(f"WARNING: 熔断器 {self.name} 打开（{reason}），{self.open_seconds} 秒内直接返回降级结果", file=sys.stderr)
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+                return HALF_OPEN
+            return self._state
+
+    def allow(self):
+        """
+        是否放行一次调用。放行后必须调用 record()（或在没有结果时调用 release()），
+        否则试探状态下的名额不会归还。
+        """
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN:
+                if time.monotonic() - self._opened_at < self.open_seconds:
+                    self.rejected += 1
+                    return False
+                self._state = HALF_OPEN
+                print(f"INFO: 熔断器 {self.name} 进入试探状态", file=sys.stderr)
+            if self._probes_in_flight + self._probe_successes >= self.probes:
+                self.rejected += 1
+                return False
+            self._probes_in_flight += 1
+            return True
+
+    def record(self, ok, latency=None):
+        """记录一次放行的调用结果；latency 为 None 时不参与慢调用统计"""
+        slow = latency is not None and latency >= self.slow_call
+        now = time.monotonic()
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._probes_in_flight = max(0, self._probes_in_flight - 1)
+                if not ok or slow:
+                    self._open(now, "试探调用失败" if not ok else f"试探调用耗时 {latency:.1f} 秒")
+                    return
+                self._probe_successes += 1
+                if self._probe_successes >= self.probes:
+                    self._state = CLOSED
+                    self._calls.clear()
+                    self._failures = self._slow = 0
+                    print(f"INFO: 熔断器 {self.name} 已恢复", file=sys.stderr)
+                return
+            if self._state == OPEN:
+                # 熔断之前放行、现在才返回的调用不再计入
+                return
+
+            self._calls.append((now, not ok, slow))
+            self._failures += not ok
+            self._slow += slow
+            self._prune(now)
+            total = len(self._calls)
+            if total < self.min_calls:
+                return
+            if self._failures / total >= self.error_rate:
+                self._open(now, f"最近 {self.window} 秒失败率 {self._failures / total:.0%}")
+            elif self._slow / total >= self.slow_rate:
+                self._open(now, f"最近 {self.window} 秒慢调用比例 {self._slow / total:.0%}")
+
+    def release(self):
+        """放行的调用没有得到结果（例如客户端断开）时归还试探名额"""
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._probes_in_flight = max(0, self._probes_in_flight - 1)
+
+    def stats(self):
+        state = self.state
+        with self._lock:
+            self._prune(time.monotonic())
+            total = len(self._calls)
+            return {
+                "state": state,
+                "window_calls": total,
+                "error_rate": round(self._failures / total, 3) if total else None,
+                "slow_rate": round(self._slow / total, 3) if total else None,
+                "times_opened": self.times_opened,
+                "rejected": self.rejected,
+            }
+
+    def reset_after_fork(self):
+        """fork 之后在子进程中调用，重新创建可能在 fork 时被持有的锁"""
+        self._lock = threading.Lock()
@@ -0,0 +1,460 @@
+# my-project/dashscope_client.py
+"""
+共享的 DashScope（通义千问）HTTP 客户端
+
+所有大模型调用（app.py、child_main.py、api_llm_caller.py）都通过同一个客户端发出：
+- 复用 requests.Session 的 keep-alive 连接池，每轮对话不再重新做 TCP + TLS 握手；
+- worker 启动时预先建立一条 TLS 连接（warm_up），第一轮对话不承担握手延迟；
+- 连接超时和读取超时统一配置；
+- 每次调用记录耗时和 token 用量，按调用阶段（stage）汇总，供 /health 展示；
+- stream() 使用增量输出（incremental_output + SSE）逐段返回回复内容，并记录首个 token 的耗时。
+
+AsyncDashScopeClient 是基于 httpx.AsyncClient 的异步版本（见 async_runtime.py），
+与同步客户端共用请求构造、结果解析和调用统计。httpx 未安装时只能使用同步客户端。
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import httpx
+except ImportError:  # 异步调用路径是可选的
+    httpx = None
+
+# DashScope 地址，可指向兼容的代理或本地模拟服务
+DASHSCOPE_BASE_URL = os.environ.get("DASHSCOPE_BASE_URL", "https://dashscope.aliyuncs.com").rstrip("/")
+GENERATION_PATH = "/api/v1/services/aigc/text-generation/generation"
+DEFAULT_MODEL = os.environ.get("DASHSCOPE_MODEL_NAME", "qwen-turbo")
+
+# 连接超时、读取超时（秒）
+DASHSCOPE_CONNECT_TIMEOUT = float(os.environ.get("DASHSCOPE_CONNECT_TIMEOUT", "3"))
+DASHSCOPE_READ_TIMEOUT = float(os.environ.get("DASHSCOPE_READ_TIMEOUT", "20"))
+# 连接池大小，应不小于 worker 的线程数
+DASHSCOPE_POOL_SIZE = int(os.environ.get("DASHSCOPE_POOL_SIZE", "10"))
+
+# 每个阶段保留最近多少次调用的耗时，用于计算分位数
+LATENCY_WINDOW = 200
+
+
+class DashScopeError(Exception):
+    """调用 DashScope 失败（网络错误、HTTP 错误或返回格式不正确）"""
+
+
+class Completion:
+    """一次调用的结果：回复内容、token 用量、耗时（秒）和请求 id"""
+    __slots__ = ('content', 'usage', 'latency', 'request_id')
+
+    def __init__(self, content, usage=None, latency=0.0, request_id=None):
+        self.content = content
+        self.usage = usage or {}
+        self.latency = latency
+        self.request_id = request_id
+
+    def __repr__(self):
+        return f"Completion(latency={self.latency:.3f}, usage={self.usage!r})"
+
+
+def _percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    return round(sorted_values[min(len(sorted_values) - 1, int(p * len(sorted_values)))], 3)
+
+
+class _StageStats:
+    """单个调用阶段的累计统计"""
+    __slots__ = ('calls', 'errors', 'input_tokens', 'output_tokens', 'latencies', 'first_token_latencies')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.first_token_latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def snapshot(self):
+        latencies = sorted(self.latencies)
+        snapshot = {
+            "calls": self.calls,
+            "errors": self.errors,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "latency_p50": _percentile(latencies, 0.5),
+            "latency_p90": _percentile(latencies, 0.9),
+            "latency_max": round(latencies[-1], 3) if latencies else None,
+        }
+        if self.first_token_latencies:
+            first_token = sorted(self.first_token_latencies)
+            snapshot["first_token_p50"] = _percentile(first_token, 0.5)
+            snapshot["first_token_p90"] = _percentile(first_token, 0.9)
+        return snapshot
+
+
+class CallStats:
+    """按调用阶段汇总的调用统计，同步和异步客户端共用一个实例"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+
+    def record(self, stage, latency, usage=None, error=False, first_token=None):
+        with self._lock:
+            stats = self._stages.setdefault(stage, _StageStats())
+            stats.calls += 1
+            stats.latencies.append(latency)
+            if first_token is not None:
+                stats.first_token_latencies.append(first_token)
+            if error:
+                stats.errors += 1
+            if usage:
+                stats.input_tokens += usage.get("input_tokens") or 0
+                stats.output_tokens += usage.get("output_tokens") or 0
+
+    def snapshot(self):
+        with self._lock:
+            return {stage: stats.snapshot() for stage, stats in self._stages.items()}
+
+    def latency_percentile(self, stage, p, min_samples=1):
+        """该阶段最近调用耗时的 p 分位数（秒），样本少于 min_samples 时返回 None"""
+        with self._lock:
+            stats = self._stages.get(stage)
+            if stats is None or len(stats.latencies) < max(1, min_samples):
+                return None
+            latencies = sorted(stats.latencies)
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+
+    def reset_after_fork(self):
+        self._lock = threading.Lock()
+
+
+# 进程内共享的调用统计
+call_stats = CallStats()
+
+
+def _api_key_from_env():
+    return os.environ.get("ALIYUN_DASHSCOPE_API_KEY") or os.environ.get("DASHSCOPE_API_KEY") or ""
+
+
+def _build_payload(messages, model, parameters):
+    return {
+        "model": model or DEFAULT_MODEL,
+        "input": {"messages": messages},
+        "parameters": dict(parameters, result_format="message"),
+    }
+
+
+def _stream_headers(api_key):
+    return {"Authorization": f"Bearer {api_key}", "Accept": "text/event-stream", "X-DashScope-SSE": "enable"}
+
+
+def _parse_stream_line(line):
+    """
+    解析增量输出 SSE 中的一行，返回 (增量内容, usage)；不是 data 行时返回 (None, None)。
+    出错事件（data 中没有 output）抛出 DashScopeError。
+    """
+    if not line or not line.startswith("data:"):
+        return None, None
+    result = json.loads(line[5:])
+    if "output" not in result:
+        raise DashScopeError(f"DashScope 流式输出出错: {result.get('code')} {result.get('message')}")
+    choices = result["output"].get("choices") or []
+    delta = (choices[0].get("message") or {}).get("content") or "" if choices else ""
+    return delta, result.get("usage") or {}
+
+
+def _parse_result(result, latency):
+    """从接口返回的 JSON 中取出回复内容，格式不正确时抛出 KeyError / IndexError / TypeError"""
+    content = result["output"]["choices"][0]["message"]["content"]
+    return Completion(content, usage=result.get("usage") or {}, latency=latency, request_id=result.get("request_id"))
+
+
+class DashScopeClient:
+    """
+    DashScope 文本生成客户端，线程安全，进程内共享一个实例（见 get_client）。
+
+    Args:
+        api_key (str): 默认的 API Key，单次调用可以覆盖
+        base_url (str): DashScope 地址
+        connect_timeout (float): 连接超时（秒）
+        read_timeout (float): 读取超时（秒）
+        pool_size (int): 连接池大小
+    """
+
+    def __init__(self, api_key=None, base_url=DASHSCOPE_BASE_URL, connect_timeout=DASHSCOPE_CONNECT_TIMEOUT,
+                 read_timeout=DASHSCOPE_READ_TIMEOUT, pool_size=DASHSCOPE_POOL_SIZE, stats=None):
+        self.api_key = api_key if api_key is not None else _api_key_from_env()
+        self.base_url = base_url.rstrip("/")
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.pool_size = pool_size
+        self.call_stats = stats or call_stats
+        self.session = self._new_session()
+
+    def _new_session(self):
+        session = requests.Session()
+        # 只重试建立连接失败（请求尚未发出），不重试读取超时，避免重复计费
+        retry = Retry(total=1, connect=1, read=0, status=0, redirect=0)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=retry)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers.update({"Content-Type": "application/json"})
+        return session
+
+    def complete(self, messages, model=None, stage="default", api_key=None, timeout=None, **parameters):
+        """
+        调用文本生成接口。
+
+        Args:
+            messages (list): [{"role": ..., "content": ...}, ...]
+            model (str): 模型名称，默认 DASHSCOPE_MODEL_NAME
+            stage (str): 调用阶段名称（child_response、evaluation 等），用于分阶段统计
+            api_key (str): 覆盖默认的 API Key
+            timeout (float): 覆盖默认的读取超时（秒）
+            **parameters: 其他生成参数（temperature、max_tokens、top_p 等）
+
+        Returns:
+            Completion
+
+        Raises:
+            DashScopeError: 未设置 API Key、请求失败或返回格式不正确
+        """
+        api_key = api_key or self.api_key
+        if not api_key:
+            raise DashScopeError("未设置 ALIYUN_DASHSCOPE_API_KEY 环境变量")
+
+        started = time.perf_counter()
+        try:
+            response = self.session.post(
+                self.base_url + GENERATION_PATH,
+                json=_build_payload(messages, model, parameters),
+                headers={"Authorization": f"Bearer {api_key}"},
+                timeout=(self.connect_timeout, timeout or self.read_timeout),
+            )
+            response.raise_for_status()
+            completion = _parse_result(response.json(), time.perf_counter() - started)
+        except requests.exceptions.RequestException as e:
+            self.call_stats.record(stage, time.perf_counter() - started, error=True)
+            raise DashScopeError(f"请求 DashScope 失败: {e}") from e
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            self.call_stats.record(stage, time.perf_counter() - started, error=True)
+            raise DashScopeError(f"DashScope 返回的数据格式不正确: {e}") from e
+
+        self.call_stats.record(stage, completion.latency, completion.usage)
+        return completion
+
+    def chat(self, messages, model=None, stage="default", **kwargs):
+        """调用文本生成接口，只返回回复内容"""
+        return self.complete(messages, model=model, stage=stage, **kwargs).content
+
+    def stream(self, messages, model=None, stage="default", api_key=None, timeout=None, **parameters):
+        """
+        流式调用文本生成接口（增量输出），逐段产出回复内容（str）。
+        参数与 complete 相同，timeout 为相邻两段内容之间的最长等待时间。
+
+        Raises:
+            DashScopeError: 未设置 API Key、请求失败或返回格式不正确
+        """
+        api_key = api_key or self.api_key
+        if not api_key:
+            raise DashScopeError("未设置 ALIYUN_DASHSCOPE_API_KEY 环境变量")
+
+        started = time.perf_counter()
+        first_token, usage = None, {}
+        try:
+            with self.session.post(
+                self.base_url + GENERATION_PATH,
+                json=_build_payload(messages, model, dict(parameters, incremental_output=True)),
+                headers=_stream_headers(api_key),
+                timeout=(self.connect_timeout, timeout or self.read_timeout),
+                stream=True,
+            ) as response:
+                response.raise_for_status()
+                # text/event-stream 没有声明字符集时 requests 会按 ISO-8859-1 解码
+                response.encoding = "utf-8"
+                for line in response.iter_lines(decode_unicode=True):
+                    delta, chunk_usage = _parse_stream_line(line)
+                    usage = chunk_usage or usage
+                    if delta:
+                        if first_token is None:
+                            first_token = time.perf_counter() - started
+                        yield delta
+        except requests.exceptions.RequestException as e:
+            self.call_stats.record(stage, time.perf_counter() - started, error=True)
+            raise DashScopeError(f"请求 DashScope 失败: {e}") from e
+        except DashScopeError:
+            self.call_stats.record(stage, time.perf_counter() - started, error=True)
+            raise
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            self.call_stats.record(stage, time.perf_counter() - started, error=True)
+            raise DashScopeError(f"DashScope 流式输出格式不正确: {e}") from e
+        self.call_stats.record(stage, time.perf_counter() - started, usage, first_token=first_token)
+
+    def warm_up(self):
+        """
+        预先建立到 DashScope 的 TLS 连接并放入连接池。
+        只发一个轻量的 HEAD 请求，任何 HTTP 状态码都说明连接已建立。
+        """
+        started = time.perf_counter()
+        try:
+            self.session.head(self.base_url, timeout=(self.connect_timeout, self.connect_timeout))
+        except requests.exceptions.RequestException as e:
+            print(f"WARNING: 预热 DashScope 连接失败: {e}", file=sys.stderr)
+            return False
+        print(f"INFO: DashScope 连接已预热，耗时 {(time.perf_counter() - started) * 1000:.0f} 毫秒", file=sys.stderr)
+        return True
+
+    def warm_up_in_background(self):
+        """在后台线程中预热连接，不阻塞启动"""
+        threading.Thread(target=self.warm_up, name='dashscope-warm-up', daemon=True).start()
+
+    def stats(self):
+        """按调用阶段返回统计数据（包括异步客户端的调用）"""
+        return self.call_stats.snapshot()
+
+    def reset_after_fork(self):
+        """
+        fork 之后在子进程中调用：连接池中的套接字不能与父进程共用，
+        重新创建会话和锁。
+        """
+        self.call_stats.reset_after_fork()
+        self.session = self._new_session()
+
+
+class AsyncDashScopeClient:
+    """
+    基于 httpx.AsyncClient 的异步客户端，只能在同一个事件循环中使用
+    （见 async_runtime.AsyncRuntime）。参数与 DashScopeClient 相同。
+
+    httpx.AsyncClient 在第一次调用时于事件循环内创建，与该循环绑定。
+    """
+
+    def __init__(self, api_key=None, base_url=DASHSCOPE_BASE_URL, connect_timeout=DASHSCOPE_CONNECT_TIMEOUT,
+                 read_timeout=DASHSCOPE_READ_TIMEOUT, pool_size=DASHSCOPE_POOL_SIZE, stats=None):
+        if httpx is None:
+            raise RuntimeError("异步调用需要安装 httpx（见 requirements.txt）")
+        self.api_key = api_key if api_key is not None else _api_key_from_env()
+        self.base_url = base_url.rstrip("/")
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.pool_size = pool_size
+        self.call_stats = stats or call_stats
+        self._http = None
+
+    def _client(self):
+        if self._http is None:
+            self._http = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={"Content-Type": "application/json"},
+                timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+                limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+                # 只重试建立连接失败
+                transport=httpx.AsyncHTTPTransport(retries=1),
+            )
+        return self._http
+
+    async def complete(self, messages, model=None, stage="default", api_key=None, timeout=None, **parameters):
+        """异步调用文本生成接口，参数和返回值与 DashScopeClient.complete 相同"""
+        api_key = api_key or self.api_key
+        if not api_key:
+            raise DashScopeError("未设置 ALIYUN_DASHSCOPE_API_KEY 环境变量")
+
+        started = time.perf_counter()
+        try:
+            response = await self._client().post(
+                GENERATION_PATH,
+                json=_build_payload(messages, model, parameters),
+                headers={"Authorization": f"Bearer {api_key}"},
+                timeout=httpx.Timeout(timeout or self.read_timeout, connect=self.connect_timeout),
+            )
+            response.raise_for_status()
+            completion = _parse_result(response.json(), time.perf_counter() - started)
+        except httpx.HTTPError as e:
+            self.call_stats.record(stage, time.perf_counter() - started, error=True)
+            raise DashScopeError(f"请求 DashScope 失败: {e!r}") from e
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            self.call_stats.record(stage, time.perf_counter() - started, error=True)
+            raise DashScopeError(f"DashScope 返回的数据格式不正确: {e}") from e
+
+        self.call_stats.record(stage, completion.latency, completion.usage)
+        return completion
+
+    async def chat(self, messages, model=None, stage="default", **kwargs):
+        """异步调用文本生成接口，只返回回复内容"""
+        return (await self.complete(messages, model=model, stage=stage, **kwargs)).content
+
+    async def stream(self, messages, model=None, stage="default", api_key=None, timeout=None, **parameters):
+        """异步流式调用（增量输出），逐段产出回复内容，参数与 DashScopeClient.stream 相同"""
+        api_key = api_key or self.api_key
+        if not api_key:
+            raise DashScopeError("未设置 ALIYUN_DASHSCOPE_API_KEY 环境变量")
+
+        started = time.perf_counter()
+        first_token, usage = None, {}
+        try:
+            async with self._client().stream(
+                "POST",
+                GENERATION_PATH,
+                json=_build_payload(messages, model, dict(parameters, incremental_output=True)),
+                headers=_stream_headers(api_key),
+                timeout=httpx.Timeout(timeout or self.read_timeout, connect=self.connect_timeout),
+            ) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    delta, chunk_usage = _parse_stream_line(line)
+                    usage = chunk_usage or usage
+                    if delta:
+                        if first_token is None:
+                            first_token = time.perf_counter() - started
+                        yield delta
+        except httpx.HTTPError as e:
+            self.call_stats.record(stage, time.perf_counter() - started, error=True)
+            raise DashScopeError(f"请求 DashScope 失败: {e!r}") from e
+        except DashScopeError:
+            self.call_stats.record(stage, time.perf_counter() - started, error=True)
+            raise
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            self.call_stats.record(stage, time.perf_counter() - started, error=True)
+            raise DashScopeError(f"DashScope 流式输出格式不正确: {e}") from e
+        self.call_stats.record(stage, time.perf_counter() - started, usage, first_token=first_token)
+
+    async def warm_up(self):
+        """预先建立到 DashScope 的 TLS 连接"""
+        started = time.perf_counter()
+        try:
+            await self._client().head("/", timeout=self.connect_timeout)
+        except httpx.HTTPError as e:
+            print(f"WARNING: 预热 DashScope 异步连接失败: {e!r}", file=sys.stderr)
+            return False
+        print(f"INFO: DashScope 异步连接已预热，耗时 {(time.perf_counter() - started) * 1000:.0f} 毫秒", file=sys.stderr)
+        return True
+
+    async def aclose(self):
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+    def reset_after_fork(self):
+        """fork 之后在子进程中调用：父进程的连接和事件循环不能继续使用，丢弃后重新创建"""
+        self._http = None
+
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+
+def get_client():
+    """返回进程内共享的客户端"""
+    global _default_client
+    if _default_client is None:
+        with _default_client_lock:
+            if _default_client is None:
+                _default_client = DashScopeClient()
+    return _default_client
@@ -0,0 +1,88 @@
+# my-project/deadline.py
+"""
+请求级截止时间
+
+一轮对话依次经过 Strapi 按需加载、孩子回应和评估两次大模型调用，
+每一步各自的超时加起来会超过 gunicorn 的 worker 超时，请求可能在返回之前被直接杀掉。
+这里在路由入口为请求设置一个截止时间（REQUEST_SLA），保存在 contextvar 中，
+之后每一步都从剩余时间中取自己的超时：
+
+    with deadline.scope(REQUEST_SLA):
+        ...
+        timeout = deadline.budget(LLM_ASYNC_TIMEOUT, reserve=8, minimum=1)
+
+剩余时间不足以完成某一步时抛出 DeadlineExceeded，调用方跳过这一步或返回降级结果，
+整个请求在 SLA 之内返回。没有设置截止时间时（后台任务、脚本）各步骤使用自己的默认超时。
+
+contextvar 不会自动传到事件循环线程中，异步调用需要把算好的超时显式传入。
+"""
+
+import contextvars
+import time
+from contextlib import contextmanager
+
+
+class DeadlineExceeded(Exception):
+    """剩余时间不足以完成当前步骤"""
+
+
+class Deadline:
+    """一个绝对截止时间（time.monotonic）"""
+    __slots__ = ('seconds', 'expires_at')
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return time.monotonic() >= self.expires_at
+
+    def __repr__(self):
+        return f"Deadline(remaining={self.remaining():.3f})"
+
+
+_current = contextvars.ContextVar('request_deadline', default=None)
+
+
+def current():
+    """当前请求的截止时间，没有时返回 None"""
+    return _current.get()
+
+
+@contextmanager
+def scope(seconds):
+    """在 with 块内为当前请求设置截止时间；seconds 为 0 或 None 时不设置"""
+    if not seconds:
+        yield None
+        return
+    token = _current.set(Deadline(seconds))
+    try:
+        yield _current.get()
+    finally:
+        _current.reset(token)
+
+
+def remaining(default=None):
+    """当前请求的剩余时间（秒），没有截止时间时返回 default"""
+    deadline = _current.get()
+    return deadline.remaining() if deadline else default
+
+
+def budget(default, reserve=0.0, minimum=0.0):
+    """
+    当前步骤可用的超时（秒）：default 与"剩余时间减去 reserve"中较小的一个。
+    reserve 为留给后续步骤的时间；没有截止时间时返回 default。
+
+    Raises:
+        DeadlineExceeded: 可用时间少于 minimum
+    """
+    deadline = _current.get()
+    if deadline is None:
+        return default
+    available = deadline.remaining() - reserve
+    if available <= 0 or available < minimum:
+        raise DeadlineExceeded(f"剩余 {deadline.remaining():.1f} 秒，不足以完成当前步骤")
+    return available if default is None else min(default, available)
@@ -6,53 +6,57 @@
 import requests
 import json
 
+from strapi_catalog import entity_fields
+
 # 本地 Strapi 配置
 LOCAL_STRAPI_URL = "http://localhost:1337"
 
+# 要导出的集合 -> 显示名称
+EXPORT_COLLECTIONS = {
+    'personality-traits': '人格特质',
+    'daily-challenges': '日常挑战',
+    'trait-expressions': '特质表达',
+}
+
+
+def fetch_bundle(base_url, collections):
+    """通过 bootstrap bundle 接口一次请求拉取多个集合，接口不可用时返回 None"""
+    try:
+        response = requests.get(f"{base_url}/api/public/bootstrap-bundle",
+                                params={'collections': ','.join(collections)}, timeout=30)
+        if response.status_code == 200:
+            return response.json().get('data')
+        print(f"⚠️  bootstrap bundle 接口不可用 ({response.status_code})，改为逐个集合获取")
+    except (requests.exceptions.RequestException, ValueError) as e:
+        print(f"⚠️  bootstrap bundle 接口出错: {e}，改为逐个集合获取")
+    return None
+
+
+def fetch_collection(base_url, collection):
+    """逐个集合获取（旧版 Strapi 没有 bundle 接口时使用）"""
+    response = requests.get(f"{base_url}/api/{collection}", timeout=30)
+    response.raise_for_status()
+    return response.json().get('data', [])
+
+
 def get_local_data():
     """从本地 Strapi 获取数据"""
     print("🔍 从本地 Strapi 获取数据...")
-    
-    # 获取人格特质
-    try:
-        response = requests.get(f"{LOCAL_STRAPI_URL}/api/personality-traits")
-        if response.status_code == 200:
-            data = response.json()
-            print(f"✅ 本地人格特质数据: {len(data.get('data', []))} 条")
-            for item in data.get('data', []):
-                print(f"   - {item.get('attributes', {}).get('name', 'Unknown')}")
-        else:
-            print(f"❌ 获取人格特质失败: {response.status_code}")
-    except Exception as e:
-        print(f"❌ 连接本地 Strapi 失败: {e}")
-        print("请确保本地 Strapi 正在运行 (npm run develop)")
-        return
-    
-    # 获取日常挑战
-    try:
-        response = requests.get(f"{LOCAL_STRAPI_URL}/api/daily-challenges")
-        if response.status_code == 200:
-            data = response.json()
-            print(f"✅ 本地日常挑战数据: {len(data.get('data', []))} 条")
-            for item in data.get('data', []):
-                print(f"   - {item.get('attributes', {}).get('name', 'Unknown')}")
-        else:
-            print(f"❌ 获取日常挑战失败: {response.status_code}")
-    except Exception as e:
-        print(f"❌ 获取日常挑战出错: {e}")
-    
-    # 获取特质表达
-    try:
-        response = requests.get(f"{LOCAL_STRAPI_URL}/api/trait-expressions")
-        if response.status_code == 200:
-            data = response.json()
-            print(f"✅ 本地特质表达数据: {len(data.get('data', []))} 条")
-            for item in data.get('data', []):
-                print(f"   - {item.get('attributes', {}).get('name', 'Unknown')}")
-        else:
-            print(f"❌ 获取特质表达失败: {response.status_code}")
-    except Exception as e:
-        print(f"❌ 获取特质表达出错: {e}")
+
+    bundle = fetch_bundle(LOCAL_STRAPI_URL, EXPORT_COLLECTIONS)
+    for collection, label in EXPORT_COLLECTIONS.items():
+        try:
+            items = bundle.get(collection, []) if bundle is not None else fetch_collection(LOCAL_STRAPI_URL, collection)
+        except Exception as e:
+            print(f"❌ 获取{label}失败: {e}")
+            if collection == 'personality-traits':
+                print("请确保本地 Strapi 正在运行 (npm run develop)")
+                return
+            continue
+
+        print(f"✅ 本地{label}数据: {len(items)} 条")
+        for item in items:
+            print(f"   - {entity_fields(item).get('name', 'Unknown')}")
 
 if __name__ == "__main__":
-    get_local_data() 
\ No newline at end of file
+    get_local_data()
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+本地模拟的 DashScope 文本生成接口，用于在没有真实 API Key 的情况下测试延迟相关的功能
+（对冲请求、超时、并发上限、流式输出等）。
+
+每个请求的延迟从配置的分布中抽样：
+    fixed:S                  固定 S 秒
+    uniform:A,B              A 到 B 秒之间均匀分布
+    lognormal:MEDIAN,SIGMA   对数正态分布，中位数 MEDIAN 秒
+再叠加可选的长尾：--tail P:S 表示以概率 P 额外等待 S 秒。
+评估请求（系统提示中包含"评估"或"评价"）可以用 --eval-latency 单独配置分布；
+合并调用（DIALOGUE_TURN_MODE=combined，提示中要求返回 child_response 字段）同时返回孩子回应和评估。
+
+用法示例：
+    python fake_dashscope.py --port 8089 --latency lognormal:0.8,0.4 --tail 0.1:8
+    DASHSCOPE_BASE_URL=http://127.0.0.1:8089 ALIYUN_DASHSCOPE_API_KEY=fake LLM_HEDGE=1 python app.py
+
+运行中可以通过 POST /_config（JSON：latency、eval_latency、tail、error_rate）修改配置，
+GET /_stats 查看收到的请求数和实际延迟。
+"""
+
+import argparse
+import json
+import math
+import random
+import sys
+import threading
+import time
+
+from flask import Flask, Response, jsonify, request
+
+GENERATION_PATH = "/api/v1/services/aigc/text-generation/generation"
+
+CHILD_REPLY = "我知道了，可是我还想再玩一会儿。"
+EVALUATION_REPLY = {
+    "grade": "B",
+    "score": 5,
+    "reasonAnalysis": "模拟评估：家长语气平和，但没有回应孩子的感受。",
+    "suggestionEncouragement": "可以先说出孩子的感受，再提出要求。",
+    "parent_mood": "neutral",
+    "triggered_rules": [],
+}
+
+
+def parse_distribution(spec):
+    """把 "lognormal:0.8,0.4" 这样的描述解析为抽样函数"""
+    kind, _, args = spec.partition(":")
+    values = [float(v) for v in args.split(",") if v.strip()]
+    if kind == "fixed" and len(values) == 1:
+        return lambda rng: values[0]
+    if kind == "uniform" and len(values) == 2:
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "lognormal" and len(values) == 2:
+        mu = math.log(values[0])
+        return lambda rng: rng.lognormvariate(mu, values[1])
+    raise ValueError(f"无法识别的延迟分布: {spec!r}")
+
+
+def parse_tail(spec):
+    """把 "0.1:8" 解析为 (概率, 额外延迟秒数)"""
+    if not spec:
+        return 0.0, 0.0
+    probability, _, seconds = spec.partition(":")
+    return float(probability), float(seconds)
+
+
+class FakeConfig:
+    """当前的延迟配置和统计，线程安全"""
+
+    def __init__(self, latency, eval_latency=None, tail=None, error_rate=0.0, seed=None):
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+        self.latencies = []
+        self.update(latency=latency, eval_latency=eval_latency, tail=tail, error_rate=error_rate)
+
+    def update(self, latency=None, eval_latency=None, tail=None, error_rate=None):
+        with self._lock:
+            if latency:
+                self.latency_spec = latency
+                self._latency = parse_distribution(latency)
+            if eval_latency is not None:
+                self.eval_latency_spec = eval_latency or None
+                self._eval_latency = parse_distribution(eval_latency) if eval_latency else None
+            if tail is not None:
+                self.tail_spec = tail
+                self._tail = parse_tail(tail)
+            if error_rate is not None:
+                self.error_rate = float(error_rate)
+
+    def sample(self, evaluation):
+        """返回 (延迟秒数, 是否返回错误)"""
+        with self._lock:
+            self.requests += 1
+            distribution = self._eval_latency if evaluation and self._eval_latency else self._latency
+            delay = max(0.0, distribution(self._rng))
+            probability, extra = self._tail
+            if probability and self._rng.random() < probability:
+                delay += extra
+            failed = self._rng.random() < self.error_rate
+            if failed:
+                self.errors += 1
+            self.latencies.append(delay)
+            return delay, failed
+
+    def stats(self):
+        with self._lock:
+            latencies = sorted(self.latencies)
+
+            def pct(p):
+                return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))], 3) if latencies else None
+
+            return {
+                "requests": self.requests,
+                "errors": self.errors,
+                "latency": self.latency_spec,
+                "eval_latency": self.eval_latency_spec,
+                "tail": self.tail_spec,
+                "error_rate": self.error_rate,
+                "sampled_p50": pct(0.5),
+                "sampled_p90": pct(0.9),
+                "sampled_p99": pct(0.99),
+            }
+
+
+def create_app(config):
+    app = Flask(__name__)
+
+    @app.route("/", methods=["GET", "HEAD"])
+    def index():
+        # 客户端预热连接时发送 HEAD /
+        return ""
+
+    @app.route(GENERATION_PATH, methods=["POST"])
+    def generation():
+        body = request.get_json(force=True)
+        messages = body.get("input", {}).get("messages", [])
+        system_prompt = " ".join(m.get("content", "") for m in messages if m.get("role") == "system")
+        evaluation = "评估" in system_prompt or "评价" in system_prompt
+        combined = any('"child_response"' in m.get("content", "") for m in messages)
+        delay, failed = config.sample(evaluation)
+        if combined:
+            content = json.dumps({"child_response": CHILD_REPLY, "evaluation": EVALUATION_REPLY}, ensure_ascii=False)
+        elif evaluation:
+            content = json.dumps(EVALUATION_REPLY, ensure_ascii=False)
+        else:
+            content = CHILD_REPLY
+        usage = {"input_tokens": sum(len(m.get("content", "")) for m in messages), "output_tokens": len(content)}
+
+        if body.get("parameters", {}).get("incremental_output"):
+            def events():
+                # 延迟的一半用于首个 token，其余平均分摊到每段内容
+                time.sleep(delay / 2)
+                if failed:
+                    yield 'data:{"code":"InternalError","message":"fake failure"}\n\n'
+                    return
+                step = delay / 2 / max(1, len(content))
+                for index, ch in enumerate(content):
+                    chunk = {"output": {"choices": [{"message": {"role": "assistant", "content": ch}}]},
+                             "usage": dict(usage, output_tokens=index + 1)}
+                    yield f"id:{index}\nevent:result\ndata:{json.dumps(chunk, ensure_ascii=False)}\n\n"
+                    time.sleep(step)
+            return Response(events(), mimetype="text/event-stream")
+
+        time.sleep(delay)
+        if failed:
+            return jsonify({"code": "InternalError", "message": "fake failure"}), 500
+        return jsonify({
+            "output": {"choices": [{"finish_reason": "stop", "message": {"role": "assistant", "content": content}}]},
+            "usage": usage,
+            "request_id": f"fake-{config.requests}",
+        })
+
+    @app.route("/_config", methods=["POST"])
+    def update_config():
+        data = request.get_json(force=True)
+        try:
+            config.update(
+                latency=data.get("latency"),
+                eval_latency=data.get("eval_latency"),
+                tail=data.get("tail"),
+                error_rate=data.get("error_rate"),
+            )
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        return jsonify(config.stats())
+
+    @app.route("/_stats", methods=["GET"])
+    def stats():
+        return jsonify(config.stats())
+
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="本地模拟的 DashScope 文本生成接口")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", default="lognormal:0.8,0.4", help="延迟分布，例如 fixed:1、uniform:0.5,2、lognormal:0.8,0.4")
+    parser.add_argument("--eval-latency", default="", help="评估请求单独使用的延迟分布，默认与 --latency 相同")
+    parser.add_argument("--tail", default="", help="长尾：P:S 表示以概率 P 额外等待 S 秒，例如 0.1:8")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回 500 错误的概率")
+    parser.add_argument("--seed", type=int, default=None, help="随机数种子，便于复现")
+    args = parser.parse_args()
+
+    try:
+        fake_config = FakeConfig(args.latency, args.eval_latency, args.tail, args.error_rate, args.seed)
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+    # HTTP/1.1 keep-alive，和真实接口一样复用连接
+    from werkzeug.serving import WSGIRequestHandler
+    WSGIRequestHandler.protocol_version = "HTTP/1.1"
+    print(f"🚀 模拟 DashScope 运行在 http://{args.host}:{args.port}（延迟 {args.latency}，长尾 {args.tail or '无'}）")
+    create_app(fake_config).run(host=args.host, port=args.port, threaded=True)
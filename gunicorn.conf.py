@@ -0,0 +1,36 @@
+# my-project/gunicorn.conf.py
+"""
+gunicorn 配置
+
+GUNICORN_PRELOAD=1（默认）时在 master 中加载应用和 Strapi 数据目录，
+worker 通过 fork 的写时复制共享同一份数据，不再各自请求 Strapi、各自持有一份 populate=* 数据。
+数据更新通过本地快照文件传播到所有 worker（见 app.on_worker_start）。
+
+默认使用 gthread worker：等待大模型的请求只占用 worker 中的一个线程，
+大模型调用在每个进程的事件循环中执行并受 LLM_MAX_CONCURRENCY 限制（见 async_runtime.py），
+几个慢调用不会再占满全部 worker 进程。
+"""
+
+import gc
+import os
+
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") == "1"
+
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+# 每个 worker 的请求线程数（仅 gthread 有效），应大于 LLM_MAX_CONCURRENCY，让超出的请求排队而不是被拒绝
+threads = int(os.environ.get("GUNICORN_THREADS", "32"))
+# worker 超时（秒）；对话接口在 REQUEST_SLA（默认 25 秒）之内返回，REQUEST_SLA 应小于这个值
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "30"))
+
+
+def when_ready(server):
+    # 把 master 中已加载的对象移出 GC 跟踪，避免 worker 中的垃圾回收触碰这些对象
+    # 所在的内存页，导致写时复制失效、每个 worker 又复制一份
+    if preload_app:
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    if preload_app:
+        import app
+        app.on_worker_start()
@@ -0,0 +1,134 @@
+# my-project/hedging.py
+"""
+对冲请求（hedged requests）
+
+DashScope 的长尾延迟远高于中位数：大多数调用一两秒返回，少数要等十几秒。
+对冲的做法是：一次调用超过该阶段最近耗时的 p90 仍未返回时，再发一个相同的请求，
+谁先返回用谁，另一个取消。只有慢于 p90 的调用才会被对冲，
+因此额外请求最多约占 10%，而这部分调用的延迟从"长尾"降到"两次中较快的一次"。
+
+额外请求受预算限制：每个正常调用积累 budget_ratio 个额度（上限 burst），
+每次对冲消耗 1 个，DashScope 整体变慢时不会因为对冲而把请求量翻倍。
+
+对冲在进程内的事件循环中以协程实现（见 async_runtime.py），
+阶段耗时取自 dashscope_client 的调用统计。
+"""
+
+import asyncio
+import threading
+
+
+class Hedger:
+    """
+    按阶段的 p 分位延迟触发对冲。
+
+    Args:
+        stats (dashscope_client.CallStats): 调用统计，用于取各阶段的延迟分位数
+        percentile (float): 触发对冲的延迟分位数
+        min_samples (int): 阶段样本少于该数时不对冲
+        min_delay (float): 对冲等待时间下限（秒），避免在极快的阶段频繁对冲
+        budget_ratio (float): 每个正常调用积累的对冲额度
+        burst (float): 对冲额度上限
+        stages (iterable): 允许对冲的阶段，为空表示全部阶段
+    """
+
+    def __init__(self, stats, percentile=0.9, min_samples=20, min_delay=0.2,
+                 budget_ratio=0.1, burst=5, stages=()):
+        self.call_stats = stats
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.budget_ratio = budget_ratio
+        self.burst = burst
+        self.stages = frozenset(stages)
+        self._lock = threading.Lock()
+        self._tokens = float(burst)
+        self._stages = {}
+
+    def _count(self, stage, outcome):
+        with self._lock:
+            counts = self._stages.setdefault(stage, {
+                "calls": 0, "hedged": 0, "hedge_wins": 0, "budget_denied": 0,
+            })
+            counts[outcome] += 1
+
+    def delay(self, stage):
+        """该阶段触发对冲的等待时间（秒），不对冲时返回 None"""
+        if self.stages and stage not in self.stages:
+            return None
+        latency = self.call_stats.latency_percentile(stage, self.percentile, self.min_samples)
+        if latency is None:
+            return None
+        return max(self.min_delay, latency)
+
+    def _earn(self):
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + self.budget_ratio)
+
+    def _spend(self):
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    async def run(self, stage, make_call):
+        """
+        执行 make_call() 返回的协程；超过对冲等待时间仍未完成且预算允许时，
+        再调用一次 make_call()，返回先成功的结果并取消另一个。
+        两个请求都失败时抛出后失败的那个异常。
+        """
+        delay = self.delay(stage)
+        primary = asyncio.ensure_future(make_call())
+        if delay is None:
+            return await primary
+
+        self._count(stage, "calls")
+        self._earn()
+        try:
+            return await asyncio.wait_for(asyncio.shield(primary), delay)
+        except asyncio.TimeoutError:
+            pass
+        except BaseException:
+            primary.cancel()
+            raise
+
+        if not self._spend():
+            self._count(stage, "budget_denied")
+            return await primary
+
+        self._count(stage, "hedged")
+        hedge = asyncio.ensure_future(make_call())
+        pending = {primary, hedge}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self._count(stage, "hedge_wins")
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self):
+        with self._lock:
+            stages = {stage: dict(counts) for stage, counts in self._stages.items()}
+            tokens = self._tokens
+        for stage, counts in stages.items():
+            delay = self.delay(stage)
+            counts["hedge_after"] = round(delay, 3) if delay is not None else None
+        return {
+            "percentile": self.percentile,
+            "budget_ratio": self.budget_ratio,
+            "budget_tokens": round(tokens, 2),
+            "stages": stages,
+        }
+
+    def reset_after_fork(self):
+        """fork 之后在子进程中调用，重新创建可能在 fork 时被持有的锁"""
+        self._lock = threading.Lock()
@@ -0,0 +1,103 @@
+# my-project/keyword_matcher.py
+"""
+多关键词匹配（Aho-Corasick 自动机）
+
+预设的家长反馈规则（Strapi responses 集合的 parentKeywords）和特质表现中的
+家长输入映射（parent_inputs_map）都是"家长的话里出现任一关键词即命中"。
+逐条规则、逐个关键词做子串查找的开销随规则数线性增长；
+这里把所有关键词编译成一个自动机，对家长输入只扫描一遍就能找出所有命中的规则。
+
+自动机构建后只读，可以在多个线程间共享；规则变化时构建新的自动机整体替换
+（数据目录快照切换时随 Catalog 一起重建）。
+"""
+
+from collections import deque
+
+
+class KeywordMatcher:
+    """
+    不区分大小写的多关键词匹配器。
+
+    Args:
+        entries: 可迭代的 (keywords, value)，keywords 为关键词序列；
+            value 按出现顺序编号，匹配结果按这个顺序返回，与逐条检查时"先出现的规则优先"一致
+    """
+
+    __slots__ = ('_goto', '_fail', '_output', 'values', 'keyword_count')
+
+    def __init__(self, entries=()):
+        self.values = []
+        self._goto = [{}]
+        self._output = [()]
+        self.keyword_count = 0
+        outputs = [set()]
+        for index, (keywords, value) in enumerate(entries):
+            self.values.append(value)
+            if isinstance(keywords, str):
+                keywords = (keywords,)
+            for keyword in keywords or ():
+                keyword = str(keyword or '').strip().lower()
+                if not keyword:
+                    continue
+                state = 0
+                for ch in keyword:
+                    next_state = self._goto[state].get(ch)
+                    if next_state is None:
+                        next_state = len(self._goto)
+                        self._goto[state][ch] = next_state
+                        self._goto.append({})
+                        outputs.append(set())
+                    state = next_state
+                outputs[state].add(index)
+                self.keyword_count += 1
+        self._fail = [0] * len(self._goto)
+        self._build_failure_links(outputs)
+        self._output = [tuple(sorted(indexes)) for indexes in outputs]
+
+    def _build_failure_links(self, outputs):
+        """广度优先计算失配指针，并把失配状态的输出合并到当前状态"""
+        queue = deque()
+        for state in self._goto[0].values():
+            queue.append(state)
+        while queue:
+            state = queue.popleft()
+            for ch, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(ch, 0)
+                outputs[next_state] |= outputs[self._fail[next_state]]
+
+    def __len__(self):
+        return len(self.values)
+
+    def matched_indexes(self, text):
+        """返回命中的规则编号集合（扫描 text 一遍）"""
+        matched = set()
+        if not self.keyword_count:
+            return matched
+        state = 0
+        goto, fail, output = self._goto, self._fail, self._output
+        for ch in str(text or '').lower():
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if output[state]:
+                matched.update(output[state])
+        return matched
+
+    def matches(self, text):
+        """按规则顺序返回所有命中的 value"""
+        return [self.values[index] for index in sorted(self.matched_indexes(text))]
+
+    def first(self, text, accept=None):
+        """
+        返回顺序最靠前的命中 value，没有时返回 None。
+        accept 为可选的过滤函数，只返回 accept(value) 为真的命中。
+        """
+        for index in sorted(self.matched_indexes(text)):
+            value = self.values[index]
+            if accept is None or accept(value):
+                return value
+        return None
@@ -0,0 +1,191 @@
+# my-project/llm_cache.py
+"""
+大模型回复的精确匹配缓存
+
+很多练习以同样的话开头（参见 debug_dialogue.py 中的测试用例），同一人格、同一挑战下
+构建出的提示词完全相同，没有必要每次都请求大模型。缓存按内容寻址：
+键是模型、调用参数和规范化后的消息（去掉多余空白）的 SHA-256 摘要，再加上数据目录版本号，
+人格、挑战或评估规则变化后旧条目自然不再命中。
+
+两级存储：
+- 内存 LRU（lru_cache.LRUCache），每个 worker 进程一份；
+- 本地 SQLite 文件，同一台机器上的所有 worker 共用，进程重启后仍然有效，
+  按过期时间和最大行数定期清理。
+
+SQLite 出错（文件被锁、磁盘满等）只记录警告并当作未命中，不影响对话请求。
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+# 每写入多少条清理一次 SQLite 中过期和超出行数上限的条目
+PRUNE_EVERY = 100
+
+
+def normalize_messages(messages):
+    """去掉消息内容中多余的空白（缩进、换行），只保留 role 和 content"""
+    return [
+        {"role": message.get("role"), "content": " ".join(str(message.get("content") or "").split())}
+        for message in messages
+    ]
+
+
+def cache_key(model, messages, parameters=None, namespace=""):
+    """由模型、参数、规范化后的消息和命名空间（数据目录版本）计算缓存键"""
+    material = json.dumps(
+        {
+            "model": model,
+            "parameters": parameters or {},
+            "messages": normalize_messages(messages),
+            "namespace": namespace or "",
+        },
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    内存 LRU + SQLite 两级缓存，线程安全。
+
+    Args:
+        memory (LRUCache): 内存层
+        path (str): SQLite 文件路径，为空时只使用内存层
+        ttl (float): SQLite 中条目的有效期（秒），0 表示不过期
+        max_rows (int): SQLite 中最多保留的条目数
+    """
+
+    def __init__(self, memory, path=None, ttl=86400, max_rows=10000):
+        self.memory = memory
+        self.path = path or None
+        self.ttl = ttl or 0
+        self.max_rows = max(1, int(max_rows))
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._conn = None
+        self._writes_since_prune = 0
+        self._stages = {}
+        self.disk_hits = 0
+        self.writes = 0
+        self.disk_errors = 0
+
+    def key(self, model, messages, parameters=None, namespace=""):
+        return cache_key(model, messages, parameters, namespace)
+
+    def _connection(self):
+        """在持有 self._lock 时调用，第一次使用时打开数据库"""
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=1, check_same_thread=False)
+            # WAL 模式下多个 worker 进程读写互不阻塞
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, stage TEXT, "
+                "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS llm_responses_accessed ON llm_responses (accessed_at)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _disk_get(self, key):
+        now = time.time()
+        with self._lock:
+            try:
+                conn = self._connection()
+                row = conn.execute("SELECT value, created_at FROM llm_responses WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    return None
+                value, created_at = row
+                if self.ttl and created_at + self.ttl <= now:
+                    return None
+                conn.execute("UPDATE llm_responses SET accessed_at = ? WHERE key = ?", (now, key))
+                conn.commit()
+                return value
+            except sqlite3.Error as e:
+                self.disk_errors += 1
+                print(f"WARNING: 读取大模型回复缓存失败: {e}", file=sys.stderr)
+                return None
+
+    def _disk_set(self, key, value, stage):
+        now = time.time()
+        with self._lock:
+            try:
+                conn = self._connection()
+                conn.execute(
+                    "INSERT OR REPLACE INTO llm_responses (key, value, stage, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                    (key, value, stage, now, now),
+                )
+                self._writes_since_prune += 1
+                if self._writes_since_prune >= PRUNE_EVERY:
+                    self._writes_since_prune = 0
+                    self._prune(conn, now)
+                conn.commit()
+            except sqlite3.Error as e:
+                self.disk_errors += 1
+                print(f"WARNING: 写入大模型回复缓存失败: {e}", file=sys.stderr)
+
+    def _prune(self, conn, now):
+        """删除过期条目，并只保留最近访问的 max_rows 条"""
+        if self.ttl:
+            conn.execute("DELETE FROM llm_responses WHERE created_at <= ?", (now - self.ttl,))
+        conn.execute(
+            "DELETE FROM llm_responses WHERE key NOT IN "
+            "(SELECT key FROM llm_responses ORDER BY accessed_at DESC LIMIT ?)",
+            (self.max_rows,),
+        )
+
+    def _count(self, stage, outcome):
+        with self._stats_lock:
+            counts = self._stages.setdefault(stage, {"hits": 0, "misses": 0})
+            counts[outcome] += 1
+
+    def get(self, key, stage="default"):
+        """依次查内存层和 SQLite 层，SQLite 命中时回填内存层；未命中返回 None"""
+        value = self.memory.get(key)
+        if value is None and self.path:
+            value = self._disk_get(key)
+            if value is not None:
+                self.disk_hits += 1
+                self.memory.set(key, value)
+        self._count(stage, "hits" if value is not None else "misses")
+        return value
+
+    def set(self, key, value, stage="default"):
+        """写入两级缓存"""
+        self.memory.set(key, value)
+        self.writes += 1
+        if self.path:
+            self._disk_set(key, value, stage)
+
+    def stats(self):
+        stages = {}
+        with self._stats_lock:
+            snapshot = {stage: dict(counts) for stage, counts in self._stages.items()}
+        for stage, counts in snapshot.items():
+            lookups = counts["hits"] + counts["misses"]
+            stages[stage] = dict(counts, hit_rate=round(counts["hits"] / lookups, 3) if lookups else None)
+        return {
+            "memory": self.memory.stats(),
+            "sqlite_path": self.path,
+            "disk_hits": self.disk_hits,
+            "disk_errors": self.disk_errors,
+            "writes": self.writes,
+            "stages": stages,
+        }
+
+    def reset_after_fork(self):
+        """fork 之后在子进程中调用：SQLite 连接不能跨进程使用，下一次访问时重新打开"""
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._conn = None
+        self.memory.reset_after_fork()
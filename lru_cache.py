@@ -0,0 +1,98 @@
+# my-project/lru_cache.py
+"""
+容量有限、带过期时间的 LRU 缓存
+
+线程安全（多线程 worker 共用一个实例），超过容量时淘汰最久未使用的条目，
+超过 ttl 的条目在下次访问时视为未命中。记录命中、未命中、淘汰和过期次数，供 /health 展示。
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    LRU + TTL 缓存。
+
+    Args:
+        maxsize (int): 最多保留的条目数
+        ttl (float): 条目有效期（秒），0 或 None 表示不过期
+        clock (callable): 时间函数，默认 time.monotonic
+    """
+
+    def __init__(self, maxsize=256, ttl=600, clock=time.monotonic):
+        self.maxsize = max(1, int(maxsize))
+        self.ttl = ttl or 0
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        """取出条目并标记为最近使用，不存在或已过期时返回 default"""
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is not _MISSING:
+                expires_at, value = entry
+                if not expires_at or expires_at > self._clock():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+                self.expirations += 1
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        """写入条目，超过容量时淘汰最久未使用的条目"""
+        expires_at = self._clock() + self.ttl if self.ttl else 0
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_load(self, key, loader):
+        """
+        命中时直接返回，否则调用 loader() 加载并写入缓存。
+        loader 抛出的异常原样传出，失败的结果不会被缓存。
+        """
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        value = loader()
+        self.set(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """返回缓存统计数据"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            }
+
+    def reset_after_fork(self):
+        """fork 之后在子进程中调用，重新创建可能在 fork 时被持有的锁"""
+        self._lock = threading.Lock()
@@ -123,19 +123,19 @@ def migrate_data():
     print(f"\n🎉 数据迁移完成！")
     print(f"📊 总计成功迁移: {total_success} 条数据")
     
-    # 验证迁移结果
+    # 验证迁移结果：通过 bootstrap bundle 接口一次请求获取全部集合
     print(f"\n🔍 验证迁移结果...")
-    for data_type in data_types:
-        try:
-            response = requests.get(f"{RENDER_STRAPI_URL}/api/public/{data_type}")
-            if response.status_code == 200:
-                data = response.json()
-                count = len(data.get('data', []))
-                print(f"✅ {data_type}: {count} 条数据")
-            else:
-                print(f"❌ {data_type}: 验证失败 ({response.status_code})")
-        except Exception as e:
-            print(f"❌ {data_type}: 验证出错 ({e})")
+    try:
+        response = requests.get(f"{RENDER_STRAPI_URL}/api/public/bootstrap-bundle",
+                                params={'collections': ','.join(data_types)})
+        if response.status_code == 200:
+            bundle = response.json().get('data', {})
+            for data_type in data_types:
+                print(f"✅ {data_type}: {len(bundle.get(data_type, []))} 条数据")
+        else:
+            print(f"❌ 验证失败 ({response.status_code})")
+    except Exception as e:
+        print(f"❌ 验证出错 ({e})")
 
 if __name__ == "__main__":
     migrate_data() 
\ No newline at end of file
@@ -0,0 +1,275 @@
+# my-project/rule_engine.py
+"""
+评估规则触发条件的本地判定
+
+Strapi 评估规则（evaluation-rule）的 trigger_condition 和 score_impact 原先只作为提示交给大模型，
+哪些规则被触发、得多少分都由大模型决定，同样的话两次评估可能得到不同的分数。
+这里把能够机械判定的触发条件编译成本地匹配器，对家长输入直接算出触发的规则，
+分数由 score_impact 累加得到；大模型只需要写分析和建议等文字部分。
+
+触发条件的写法：
+
+- 表达式：关键词（不加引号时最多 4 个字）、引号括起来的短语、正则（re:模式 或 /模式/）用运算符组合，
+  运算符为 AND / OR / NOT、且 / 或 / 非、&& / || / !（前后需要空格或括号），支持括号，
+  相邻的两项之间省略运算符时按 AND 处理，例如：
+      ("快去" 或 "马上") 且 非 "好吗"
+      re:再不.{0,4}就
+- 描述加示例：没有运算符、但包含引号括起来的示例说法时（如：家长说出"快去"、"马上"等命令词），
+  出现任一示例即触发；引号外的描述带有否定词时（如：家长没有使用"好吗"等商量语气），
+  示例是"不应出现"的说法，无法按出现示例判定，交给大模型；
+- 其余纯描述性的条件无法机械判定，仍交给大模型判断（RuleEngine.uncompiled）。
+
+所有规则的关键词编译为一个 Aho-Corasick 自动机（keyword_matcher.py），对家长输入只扫描一遍；
+引擎随数据目录快照一起构建，构建后只读，可以在多个线程间共享。
+"""
+
+import re
+import sys
+
+from keyword_matcher import KeywordMatcher
+from rule_selector import trigger_keywords
+
+# 没有触发任何规则时的基础分（对应评级 B）
+BASE_SCORE = 5
+
+_OPERATORS = {
+    'AND': 'and', '且': 'and', '&&': 'and',
+    'OR': 'or', '或': 'or', '||': 'or',
+    'NOT': 'not', '非': 'not', '!': 'not',
+}
+
+_TOKEN = re.compile(r'''
+    \s*(?:
+        (?P<quoted>[“"'‘「『][^“”"'‘’「」『』\n]+?[”"'’」』])
+      | (?P<regex>re:\S+|/(?:\\.|[^/\\\n])+/)
+      | (?P<lparen>[(（])
+      | (?P<rparen>[)）])
+      | (?P<op>(?:AND|OR|NOT|且|或|非)(?=[\s()（）]|$)|&&|\|\||!)
+      | (?P<word>[^\s()（）“"'‘「『]+)
+    )''', re.X)
+
+
+# 表达式中不加引号的关键词最多的字数，更长的不加引号的文字视为描述
+MAX_BARE_KEYWORD = 4
+# 描述性条件中（引号外）的否定词：带否定的描述不能按"出现示例即触发"编译
+_NEGATION = re.compile(r'没|不|未|非|无|别|勿|避免|缺少|缺乏|禁止')
+_QUOTED_TEXT = re.compile(r'[“"\'‘「『][^“”"\'‘’「」『』\n]+?[”"\'’」』]')
+
+
+class ConditionSyntaxError(ValueError):
+    """触发条件表达式无法解析"""
+
+
+def tokenize(condition):
+    """把触发条件切分为 (类型, 文本) 序列"""
+    tokens = []
+    position = 0
+    condition = condition.strip()
+    while position < len(condition):
+        match = _TOKEN.match(condition, position)
+        if not match or match.end() == position:
+            raise ConditionSyntaxError(f"无法识别的内容: {condition[position:]!r}")
+        position = match.end()
+        kind = match.lastgroup
+        text = match.group(kind)
+        if kind == 'quoted':
+            text = text[1:-1].strip()
+        elif kind == 'regex':
+            text = text[3:] if text.startswith('re:') else text[1:-1]
+        tokens.append((kind, text))
+    return tokens
+
+
+class _Parser:
+    """
+    递归下降解析：
+        or_expr  := and_expr (OR and_expr)*
+        and_expr := not_expr ((AND)? not_expr)*
+        not_expr := NOT not_expr | '(' or_expr ')' | 关键词 | 正则
+    解析结果为嵌套元组：('kw', 关键词编号) / ('re', 正则) / ('and' | 'or', 子项...) / ('not', 子项)
+    """
+
+    def __init__(self, tokens, keyword_ids):
+        self.tokens = tokens
+        self.position = 0
+        self.keyword_ids = keyword_ids
+
+    def parse(self):
+        node = self._or()
+        if self.position < len(self.tokens):
+            raise ConditionSyntaxError(f"多余的内容: {self.tokens[self.position][1]!r}")
+        return node
+
+    def _peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+
+    def _operator(self):
+        kind, text = self._peek()
+        return _OPERATORS.get(text) if kind == 'op' else None
+
+    def _or(self):
+        children = [self._and()]
+        while self._operator() == 'or':
+            self.position += 1
+            children.append(self._and())
+        return children[0] if len(children) == 1 else ('or', *children)
+
+    def _and(self):
+        children = [self._not()]
+        while True:
+            operator = self._operator()
+            kind, _ = self._peek()
+            if operator == 'and':
+                self.position += 1
+            elif kind is None or kind == 'rparen' or operator == 'or':
+                break
+            children.append(self._not())
+        return children[0] if len(children) == 1 else ('and', *children)
+
+    def _not(self):
+        kind, text = self._peek()
+        if kind is None:
+            raise ConditionSyntaxError("表达式不完整")
+        self.position += 1
+        if kind == 'op':
+            if _OPERATORS[text] != 'not':
+                raise ConditionSyntaxError(f"运算符 {text!r} 缺少左侧的条件")
+            return ('not', self._not())
+        if kind == 'lparen':
+            node = self._or()
+            if self._peek()[0] != 'rparen':
+                raise ConditionSyntaxError("缺少右括号")
+            self.position += 1
+            return node
+        if kind == 'rparen':
+            raise ConditionSyntaxError("多余的右括号")
+        return literal(kind, text, self.keyword_ids)
+
+
+def literal(kind, text, keyword_ids):
+    """关键词或正则的叶子节点；关键词登记到 keyword_ids（关键词 -> 编号）中"""
+    if kind == 'regex':
+        try:
+            return ('re', re.compile(text, re.IGNORECASE))
+        except re.error as e:
+            raise ConditionSyntaxError(f"正则 {text!r} 无效: {e}") from e
+    keyword = text.strip().lower()
+    if not keyword:
+        raise ConditionSyntaxError("空的关键词")
+    return ('kw', keyword_ids.setdefault(keyword, len(keyword_ids)))
+
+
+def _is_expression_leaf(kind, text):
+    """表达式中的项只能是引号短语、正则或不超过 MAX_BARE_KEYWORD 个字的关键词，其余视为描述性文字"""
+    if kind != 'word':
+        return True
+    return len(text) <= MAX_BARE_KEYWORD and text.isalnum()
+
+
+def compile_condition(condition, keyword_ids):
+    """
+    把触发条件编译为表达式树，无法机械判定的描述性条件返回 None。
+
+    Raises:
+        ConditionSyntaxError: 条件写成了表达式但无法解析
+    """
+    condition = (condition or '').strip()
+    if not condition:
+        return None
+    try:
+        tokens = tokenize(condition)
+    except ConditionSyntaxError:
+        tokens = None
+    if tokens and any(kind in ('op', 'lparen', 'rparen') for kind, _ in tokens):
+        # 只有括号、没有运算符也没有引号短语或正则的（如：（语气强硬））是描述，不是表达式
+        explicit = any(kind in ('op', 'quoted', 'regex') for kind, _ in tokens)
+        if explicit and all(_is_expression_leaf(kind, text) for kind, text in tokens):
+            return _Parser(tokens, keyword_ids).parse()
+        # 带括号或"或"字的描述性文字（如：家长使用命令语气（如"快去"、"马上"）），按描述处理
+    if tokens and all(kind in ('quoted', 'regex') for kind, _ in tokens):
+        children = [literal(kind, text, keyword_ids) for kind, text in tokens]
+        return children[0] if len(children) == 1 else ('or', *children)
+    examples = trigger_keywords(condition)
+    if examples and not _NEGATION.search(_QUOTED_TEXT.sub('', condition)):
+        children = [literal('quoted', text, keyword_ids) for text in examples]
+        return children[0] if len(children) == 1 else ('or', *children)
+    return None
+
+
+def _evaluate(node, text, keywords):
+    kind = node[0]
+    if kind == 'kw':
+        return node[1] in keywords
+    if kind == 're':
+        return node[1].search(text) is not None
+    if kind == 'not':
+        return not _evaluate(node[1], text, keywords)
+    if kind == 'and':
+        return all(_evaluate(child, text, keywords) for child in node[1:])
+    return any(_evaluate(child, text, keywords) for child in node[1:])
+
+
+def grade_for_score(score):
+    """按分数给出评级，与 A=10、B=5、C=-5 的对应关系一致"""
+    if score >= 10:
+        return "A"
+    if score > 0:
+        return "B"
+    return "C"
+
+
+class RuleEngine:
+    """
+    一组评估规则的本地判定器。
+
+    Args:
+        rules: EvaluationRule 序列
+    """
+
+    __slots__ = ('compiled', 'uncompiled', 'uncompiled_names', '_keywords')
+
+    def __init__(self, rules=()):
+        keyword_ids = {}
+        compiled, uncompiled = [], []
+        for rule in rules:
+            try:
+                tree = compile_condition(rule.trigger_condition, keyword_ids)
+            except ConditionSyntaxError as e:
+                print(f"WARNING: 评估规则 {rule.rule_name!r} 的触发条件无法解析（{e}），交给大模型判断", file=sys.stderr)
+                tree = None
+            if tree is None:
+                uncompiled.append(rule)
+            else:
+                compiled.append((rule, tree))
+        self.compiled = tuple(compiled)
+        self.uncompiled = tuple(uncompiled)
+        # 交给大模型判断的规则名称，用于过滤大模型返回的 triggered_rules
+        self.uncompiled_names = frozenset(rule.rule_name for rule in uncompiled)
+        # 自动机中的编号与关键词编号一致（按登记顺序）
+        self._keywords = KeywordMatcher(((keyword,), keyword) for keyword in keyword_ids)
+
+    def __len__(self):
+        return len(self.compiled)
+
+    def triggered(self, text):
+        """返回 text 触发的已编译规则（按原有顺序）"""
+        if not self.compiled:
+            return []
+        text = str(text or '')
+        keywords = self._keywords.matched_indexes(text)
+        return [rule for rule, tree in self.compiled if _evaluate(tree, text, keywords)]
+
+    def score(self, rules, base=BASE_SCORE):
+        """基础分加上触发规则的 score_impact，返回 (分数, 评级)"""
+        score = base + sum(_score_impact(rule) for rule in rules)
+        if isinstance(score, float) and score.is_integer():
+            score = int(score)
+        return score, grade_for_score(score)
+
+
+def _score_impact(rule):
+    try:
+        value = float(rule.score_impact or 0)
+    except (TypeError, ValueError):
+        return 0
+    return int(value) if value.is_integer() else value
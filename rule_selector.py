@@ -0,0 +1,171 @@
+# my-project/rule_selector.py
+"""
+评估规则的相关性筛选
+
+评估和专家指导的提示词原先带上全部评估规则（名称、描述、触发条件、分数影响），
+输入 token 数、延迟和费用都随规则数量线性增长，而一句家长的话通常只和少数几条规则有关。
+这里为每个数据目录快照建立一个规则索引，按家长输入（以及人格、情境描述）给规则打分，
+只把得分最高的 k 条放进提示词：
+
+- BM25：规则的名称、描述和触发条件按字符 bigram 建立倒排索引（中文不分词）；
+  家长输入的 bigram 为主查询，人格和情境描述的 bigram 以较低权重参与打分；
+  人格和情境描述比家长输入长得多，对同一人格 × 情境又不变，它们的得分按描述缓存，每轮只为家长输入打分；
+- 触发条件匹配：触发条件中用引号括起来的示例说法（如"快去"、'马上'）编译为一个
+  Aho-Corasick 自动机（keyword_matcher.py），家长输入中出现时该规则优先入选。
+
+选中的规则按原有顺序输出，同样的输入总是得到同样的提示词（不影响 llm_cache.py 的缓存命中）。
+"""
+
+import heapq
+import math
+import re
+import threading
+from collections import Counter
+
+from keyword_matcher import KeywordMatcher
+from lru_cache import LRUCache
+from similarity_cache import normalize_utterance
+
+# 人格、情境描述的 bigram 相对家长输入的权重
+CONTEXT_WEIGHT = 0.3
+# 每个索引缓存的人格、情境描述得分的条数（人格 × 情境的组合数）
+CONTEXT_CACHE_SIZE = 256
+# 触发条件命中时加的分数，保证命中的规则排在只靠 BM25 入选的规则之前
+TRIGGER_BOOST = 1000.0
+
+# 触发条件中用引号括起来的示例说法
+_QUOTED = re.compile(r'[“"\'‘「『]([^“”"\'‘’「」『』\n]{1,20})[”"\'’」』]')
+
+
+def bigrams(text):
+    """规范化后的字符 bigram 列表；单个字符的文本返回它本身"""
+    text = normalize_utterance(text)
+    if len(text) < 2:
+        return [text] if text else []
+    return [text[i:i + 2] for i in range(len(text) - 1)]
+
+
+def trigger_keywords(trigger_condition):
+    """取出触发条件中引号括起来的示例说法"""
+    return [match.strip() for match in _QUOTED.findall(trigger_condition or '') if match.strip()]
+
+
+class RuleIndex:
+    """
+    一组评估规则的 BM25 + 触发条件索引，构建后只读（描述得分的缓存是线程安全的），可以在多个线程间共享。
+
+    Args:
+        rules: EvaluationRule 序列
+        k1 (float): BM25 词频饱和参数
+        b (float): BM25 文档长度归一化参数
+        context_cache_size (int): 缓存的描述得分条数，0 表示不缓存
+    """
+
+    __slots__ = ('rules', '_postings', '_triggers', '_context_scores')
+
+    def __init__(self, rules=(), k1=1.5, b=0.75, context_cache_size=CONTEXT_CACHE_SIZE):
+        self.rules = tuple(rules)
+        documents = [
+            Counter(bigrams(f"{rule.rule_name} {rule.rule_description} {rule.trigger_condition}"))
+            for rule in self.rules
+        ]
+        lengths = [sum(document.values()) for document in documents]
+        average_length = (sum(lengths) / len(lengths)) if lengths else 0
+        document_frequency = Counter(term for document in documents for term in document)
+        total = len(documents)
+
+        # 每个 bigram 在每条规则中的 BM25 权重预先算好，查询时只需要累加
+        postings = {}
+        for index, document in enumerate(documents):
+            norm = k1 * (1 - b + b * lengths[index] / average_length) if average_length else k1
+            for term, tf in document.items():
+                df = document_frequency[term]
+                idf = math.log(1 + (total - df + 0.5) / (df + 0.5))
+                postings.setdefault(term, []).append((index, idf * tf * (k1 + 1) / (tf + norm)))
+        self._postings = postings
+        self._triggers = KeywordMatcher(
+            (trigger_keywords(rule.trigger_condition), index) for index, rule in enumerate(self.rules)
+        )
+        self._context_scores = LRUCache(maxsize=context_cache_size, ttl=0) if context_cache_size > 0 else None
+
+    def __len__(self):
+        return len(self.rules)
+
+    def scores(self, query, context=''):
+        """每条规则对 query（家长输入）和 context（人格、情境描述）的相关性得分"""
+        scores = self._term_scores(query, 1.0)
+        if context:
+            if self._context_scores is None:
+                context_scores = self._term_scores(context, CONTEXT_WEIGHT)
+            else:
+                context_scores = self._context_scores.get_or_load(context, lambda: tuple(self._term_scores(context, CONTEXT_WEIGHT)))
+            scores = [score + context_score for score, context_score in zip(scores, context_scores)]
+        for index in self._triggers.matched_indexes(query):
+            scores[index] += TRIGGER_BOOST
+        return scores
+
+    def _term_scores(self, text, weight):
+        scores = [0.0] * len(self.rules)
+        for term in set(bigrams(text)):
+            for index, score in self._postings.get(term, ()):
+                scores[index] += weight * score
+        return scores
+
+    def context_cache_stats(self):
+        """人格、情境描述得分缓存的统计"""
+        return self._context_scores.stats() if self._context_scores is not None else None
+
+    def reset_after_fork(self):
+        """fork 之后在子进程中调用，重新创建可能在 fork 时被持有的锁"""
+        if self._context_scores is not None:
+            self._context_scores.reset_after_fork()
+
+    def select(self, query, context='', k=0):
+        """
+        返回得分最高的 k 条规则（按原有顺序）；k <= 0 或不少于规则总数时返回全部规则。
+        得分相同时排在前面的规则优先。
+        """
+        if k <= 0 or k >= len(self.rules):
+            return self.rules
+        scores = self.scores(query, context)
+        top = heapq.nlargest(k, range(len(self.rules)), key=lambda index: (scores[index], -index))
+        return tuple(self.rules[index] for index in sorted(top))
+
+
+class RuleSelectionStats:
+    """规则筛选的累计统计：入选规则数和提示词中规则文本的字符数（与带上全部规则相比），线程安全"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+
+    def record(self, stage, total_rules, selected_rules, full_chars, selected_chars):
+        with self._lock:
+            counts = self._stages.setdefault(stage, {
+                "selections": 0, "rules_total": 0, "rules_selected": 0, "full_chars": 0, "selected_chars": 0,
+            })
+            counts["selections"] += 1
+            counts["rules_total"] += total_rules
+            counts["rules_selected"] += selected_rules
+            counts["full_chars"] += full_chars
+            counts["selected_chars"] += selected_chars
+
+    def stats(self):
+        with self._lock:
+            stages = {stage: dict(counts) for stage, counts in self._stages.items()}
+        result = {}
+        for stage, counts in stages.items():
+            selections = counts["selections"]
+            result[stage] = {
+                "selections": selections,
+                "mean_rules_selected": round(counts["rules_selected"] / selections, 2),
+                "mean_rules_total": round(counts["rules_total"] / selections, 2),
+                # 中文提示词的 token 数与字符数大致成正比，字符节省比例即输入 token 的节省比例
+                "rule_chars_saved": counts["full_chars"] - counts["selected_chars"],
+                "rule_chars_saved_ratio": round(1 - counts["selected_chars"] / counts["full_chars"], 3) if counts["full_chars"] else None,
+            }
+        return result
+
+    def reset_after_fork(self):
+        """fork 之后在子进程中调用，重新创建可能在 fork 时被持有的锁"""
+        self._lock = threading.Lock()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+本地模拟 Strapi 发送缓存失效 Webhook
+
+用法示例：
+    export STRAPI_WEBHOOK_SECRET=dev-secret
+    python send_test_webhook.py entry.update personality-trait 1 '{"name": "慢能量孩子", "description": "新的描述"}'
+    python send_test_webhook.py entry.delete personality-trait 1
+"""
+
+import json
+import os
+import sys
+import time
+
+import requests
+
+from strapi_webhook import SIGNATURE_HEADER, TIMESTAMP_HEADER, sign_payload
+
+# Flask 应用 URL
+FLASK_URL = os.environ.get("FLASK_URL", "http://localhost:5000")
+
+
+def send_event(event, model, entry_id, fields=None, secret=None):
+    """签名并发送一个条目事件，返回响应"""
+    secret = secret or os.environ.get("STRAPI_WEBHOOK_SECRET", "")
+    entry = {"id": entry_id, "publishedAt": time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime())}
+    entry.update(fields or {})
+    body = json.dumps({
+        "event": event,
+        "model": model,
+        "uid": f"api::{model}.{model}",
+        "entry": entry,
+    }, ensure_ascii=False).encode("utf-8")
+
+    timestamp = int(time.time())
+    headers = {
+        "Content-Type": "application/json",
+        TIMESTAMP_HEADER: str(timestamp),
+        SIGNATURE_HEADER: sign_payload(secret, timestamp, body),
+    }
+    return requests.post(f"{FLASK_URL}/webhooks/strapi", data=body, headers=headers, timeout=10)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 4:
+        print(__doc__)
+        sys.exit(1)
+
+    event_name, model_name, entity_id = sys.argv[1], sys.argv[2], int(sys.argv[3])
+    extra_fields = json.loads(sys.argv[4]) if len(sys.argv) > 4 else {}
+
+    print(f"🔔 发送 {event_name} {model_name} id={entity_id} 到 {FLASK_URL} ...")
+    try:
+        response = send_event(event_name, model_name, entity_id, extra_fields)
+        print(f"   状态码: {response.status_code}")
+        print(f"   响应: {response.text}")
+    except Exception as e:
+        print(f"   错误: {e}")
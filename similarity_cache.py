@@ -0,0 +1,221 @@
+# my-project/similarity_cache.py
+"""
+近似重复的评估结果缓存
+
+家长经常输入几乎相同的话，只差标点、语气词或词序（"快去写作业吧！" / "快去写作业"），
+精确匹配缓存（llm_cache.py）对它们无效，但评估结果本来就会相同。
+这里按人格 × 情境（以及数据目录版本）划分范围，对家长输入做规范化后取字符 n-gram 集合，
+用 MinHash 签名 + LSH 分桶快速找到候选，再用精确的 Jaccard 相似度确认，
+达到阈值时直接返回已保存的评估结果，省掉一次评估调用（最贵的一个阶段）。
+
+索引容量有限，超出时按 LRU 淘汰并从 LSH 桶中移除。
+
+精确度通过抽样测量：命中时以 verify_rate 的概率仍然调用大模型，
+比较两次评级（grade）是否一致，累计得到命中结果的精确度，在 /health 中展示，
+用于调整相似度阈值。
+"""
+
+import random
+import sys
+import threading
+import unicodedata
+import zlib
+from collections import OrderedDict
+
+# 只影响语气、不影响评估的语气词，规范化时去掉
+FILLER_CHARACTERS = frozenset('吧呢啊呀嘛哦啦哈哇呐噢喔嗯')
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+
+def normalize_utterance(text):
+    """去掉标点、空白和语气词，英文转小写"""
+    characters = []
+    for ch in str(text or '').lower():
+        if ch.isspace() or ch in FILLER_CHARACTERS:
+            continue
+        if unicodedata.category(ch).startswith(('P', 'S')):
+            continue
+        characters.append(ch)
+    return ''.join(characters)
+
+
+def shingles(text, n=2):
+    """规范化文本的字符 n-gram 集合；文本短于 n 时整段作为一个元素"""
+    if len(text) <= n:
+        return frozenset([text]) if text else frozenset()
+    return frozenset(text[i:i + n] for i in range(len(text) - n + 1))
+
+
+def jaccard(a, b):
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+class MinHasher:
+    """
+    MinHash 签名：num_perm 个形如 (a * x + b) mod p 的随机哈希函数，
+    两个集合签名中相等位置的比例是它们 Jaccard 相似度的无偏估计。
+    """
+
+    def __init__(self, num_perm=64, seed=1):
+        rng = random.Random(seed)
+        self.num_perm = num_perm
+        self._params = [(rng.randrange(1, _MERSENNE_PRIME), rng.randrange(0, _MERSENNE_PRIME)) for _ in range(num_perm)]
+
+    def signature(self, shingle_set):
+        hashes = [zlib.crc32(s.encode('utf-8')) for s in shingle_set]
+        if not hashes:
+            return (_MAX_HASH,) * self.num_perm
+        return tuple(
+            min(((a * h + b) % _MERSENNE_PRIME) & _MAX_HASH for h in hashes)
+            for a, b in self._params
+        )
+
+
+class _Entry:
+    __slots__ = ('scope', 'shingles', 'bands', 'value')
+
+    def __init__(self, scope, shingle_set, bands, value):
+        self.scope = scope
+        self.shingles = shingle_set
+        self.bands = bands
+        self.value = value
+
+
+class SimilarityCache:
+    """
+    MinHash/LSH 近似重复缓存，线程安全。
+
+    签名分成 bands 段、每段 num_perm // bands 行，任意一段完全相同即成为候选；
+    默认 32 段 × 2 行，Jaccard 相似度 0.5 的两句话成为候选的概率超过 99.9%，
+    候选再用精确 Jaccard 与 threshold 比较，因此阈值只由 threshold 决定。
+
+    Args:
+        maxsize (int): 最多保留的条目数
+        threshold (float): 判定为近似重复的 Jaccard 相似度下限
+        verify_rate (float): 命中后仍然调用大模型、用于测量精确度的抽样比例
+        ngram (int): 字符 n-gram 的长度
+        num_perm (int): MinHash 签名长度
+        bands (int): LSH 分段数，必须整除 num_perm
+    """
+
+    def __init__(self, maxsize=2048, threshold=0.8, verify_rate=0.05, ngram=2, num_perm=64, bands=32, seed=1):
+        if num_perm % bands:
+            raise ValueError("num_perm 必须是 bands 的整数倍")
+        self.maxsize = max(1, int(maxsize))
+        self.threshold = threshold
+        self.verify_rate = verify_rate
+        self.ngram = ngram
+        self.bands = bands
+        self.rows = num_perm // bands
+        self._hasher = MinHasher(num_perm, seed)
+        self._random = random.Random()
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._buckets = {}
+        self._next_id = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.similarity_total = 0.0
+        self.verified = 0
+        self.agreed = 0
+
+    def _fingerprint(self, text):
+        shingle_set = shingles(normalize_utterance(text), self.ngram)
+        signature = self._hasher.signature(shingle_set)
+        bands = tuple(
+            (i, signature[i * self.rows:(i + 1) * self.rows]) for i in range(self.bands)
+        )
+        return shingle_set, bands
+
+    def lookup(self, scope, text):
+        """
+        查找同一范围内与 text 近似重复的条目，返回 (value, similarity)；没有时返回 (None, 0.0)。
+        scope 为可哈希的范围键（数据目录版本、人格、情境）。
+        """
+        shingle_set, bands = self._fingerprint(text)
+        if not shingle_set:
+            return None, 0.0
+        with self._lock:
+            candidates = set()
+            for band in bands:
+                candidates.update(self._buckets.get((scope, band), ()))
+            best_id, best_similarity = None, 0.0
+            for entry_id in candidates:
+                similarity = jaccard(shingle_set, self._entries[entry_id].shingles)
+                if similarity > best_similarity:
+                    best_id, best_similarity = entry_id, similarity
+            if best_id is None or best_similarity < self.threshold:
+                self.misses += 1
+                return None, best_similarity
+            self._entries.move_to_end(best_id)
+            self.hits += 1
+            self.similarity_total += best_similarity
+            return self._entries[best_id].value, best_similarity
+
+    def add(self, scope, text, value):
+        """保存 text 的评估结果，超过容量时淘汰最久未使用的条目"""
+        shingle_set, bands = self._fingerprint(text)
+        if not shingle_set:
+            return
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = _Entry(scope, shingle_set, bands, value)
+            for band in bands:
+                self._buckets.setdefault((scope, band), set()).add(entry_id)
+            while len(self._entries) > self.maxsize:
+                self._evict_oldest()
+
+    def _evict_oldest(self):
+        entry_id, entry = self._entries.popitem(last=False)
+        for band in entry.bands:
+            bucket = self._buckets.get((entry.scope, band))
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self._buckets[(entry.scope, band)]
+        self.evictions += 1
+
+    def should_verify(self):
+        """命中后是否抽样调用大模型核对"""
+        return self.verify_rate > 0 and self._random.random() < self.verify_rate
+
+    def record_verification(self, agreed):
+        with self._lock:
+            self.verified += 1
+            if agreed:
+                self.agreed += 1
+        if not agreed:
+            print("WARNING: 近似重复缓存命中的评估结果与大模型重新评估的评级不一致", file=sys.stderr)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+                "mean_hit_similarity": round(self.similarity_total / self.hits, 3) if self.hits else None,
+                "verify_rate": self.verify_rate,
+                "verified": self.verified,
+                "precision": round(self.agreed / self.verified, 3) if self.verified else None,
+            }
+
+    def reset_after_fork(self):
+        """fork 之后在子进程中调用，重新创建可能在 fork 时被持有的锁"""
+        self._lock = threading.Lock()
+        self._random = random.Random()
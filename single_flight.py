@@ -0,0 +1,270 @@
+# my-project/single_flight.py
+"""
+相同大模型请求的合并（single-flight）
+
+课堂或工作坊中，几十位家长常在几秒内对同一人格、同一挑战输入同样的开场白，
+每个请求都会各自调用一次大模型。这里按请求内容（模型、参数、消息）合并正在进行中的相同调用：
+第一个请求（leader）真正调用大模型，之后到达的相同请求等待并共用它的结果。
+
+- 进程内：同一 worker 的请求线程通过 threading.Event 等待 leader；leader 没有得到结果时
+  （它自己的截止时间用完、调用超时或出错），等待方不继承它的失败，而是重新合并，
+  由其中一个在自己的剩余时间内再调用一次；
+- 跨 worker（可选）：通过本机共享的 SQLite 文件登记进行中的调用，
+  其他 worker 中的相同请求轮询等待 leader 写回结果。leader 失败或超过租约时间时，
+  等待方自己调用大模型，不会因为合并而失败。
+
+只合并"正在进行中"的调用，结果不做长期缓存（长期缓存见 llm_cache.py）。
+"""
+
+import concurrent.futures
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+
+class _Call:
+    """进程内一次进行中的调用"""
+    __slots__ = ('done', 'value', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SharedFlights:
+    """
+    基于 SQLite 的跨进程调用登记表，同一台机器上的 worker 共用。
+
+    Args:
+        path (str): SQLite 文件路径
+        lease (float): leader 的租约时间（秒），超过后视为 leader 已失败
+        result_ttl (float): leader 写回的结果保留多久（秒），覆盖刚好错过的请求
+        poll_interval (float): 等待方轮询结果的间隔（秒）
+    """
+
+    def __init__(self, path, lease=30, result_ttl=5, poll_interval=0.05):
+        self.path = path
+        self.lease = lease
+        self.result_ttl = result_ttl
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._conn = None
+        self.errors = 0
+
+    def _connection(self):
+        """在持有 self._lock 时调用，第一次使用时打开数据库"""
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=1, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_flights ("
+                "key TEXT PRIMARY KEY, owner TEXT NOT NULL, lease_until REAL NOT NULL, "
+                "value TEXT, done_at REAL)"
+            )
+            self._conn = conn
+        return self._conn
+
+    def _execute(self, fn):
+        with self._lock:
+            try:
+                return fn(self._connection())
+            except sqlite3.Error as e:
+                self.errors += 1
+                print(f"WARNING: 跨进程请求合并的 SQLite 操作失败: {e}", file=sys.stderr)
+                return None
+
+    def claim(self, key):
+        """
+        尝试成为 leader，返回 (状态, 结果)：
+        ('leader', None) 成为 leader；('done', value) 已有刚完成的结果；
+        ('follower', None) 其他 worker 正在调用；SQLite 出错时返回 ('leader', None)。
+        """
+        owner = f"{os.getpid()}:{threading.get_ident()}"
+
+        def claim(conn):
+            now = time.time()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # 清理超过租约仍未完成的登记和过期的结果
+                conn.execute(
+                    "DELETE FROM llm_flights WHERE (value IS NULL AND lease_until < ?) OR (value IS NOT NULL AND done_at < ?)",
+                    (now, now - self.result_ttl),
+                )
+                row = conn.execute("SELECT value FROM llm_flights WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    conn.execute(
+                        "INSERT INTO llm_flights (key, owner, lease_until) VALUES (?, ?, ?)",
+                        (key, owner, now + self.lease),
+                    )
+                    result = ('leader', None)
+                elif row[0] is not None:
+                    result = ('done', row[0])
+                else:
+                    result = ('follower', None)
+                conn.execute("COMMIT")
+                return result
+            except sqlite3.Error:
+                conn.execute("ROLLBACK")
+                raise
+
+        return self._execute(claim) or ('leader', None)
+
+    def publish(self, key, value):
+        """leader 写回结果"""
+        self._execute(lambda conn: conn.execute(
+            "UPDATE llm_flights SET value = ?, done_at = ? WHERE key = ?", (value, time.time(), key)))
+
+    def release(self, key):
+        """leader 没有得到结果时删除登记，等待方随即自己调用"""
+        self._execute(lambda conn: conn.execute("DELETE FROM llm_flights WHERE key = ? AND value IS NULL", (key,)))
+
+    def wait(self, key, timeout):
+        """轮询等待 leader 的结果；leader 放弃、租约过期或超时返回 None"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            row = self._execute(lambda conn: conn.execute(
+                "SELECT value, lease_until FROM llm_flights WHERE key = ?", (key,)).fetchone())
+            if row is None:
+                return None
+            value, lease_until = row
+            if value is not None:
+                return value
+            if lease_until < time.time():
+                return None
+            time.sleep(self.poll_interval)
+        return None
+
+    def reset_after_fork(self):
+        """fork 之后在子进程中调用：SQLite 连接不能跨进程使用，下一次访问时重新打开"""
+        self._lock = threading.Lock()
+        self._conn = None
+
+
+class SingleFlight:
+    """
+    合并相同 key 的进行中调用，线程安全。
+
+    Args:
+        shared (SharedFlights): 跨 worker 的登记表，为 None 时只在进程内合并
+        wait_timeout (float): 等待其他 worker 中 leader 的最长时间（秒），超时后自己调用
+        shared_errors (tuple): leader 抛出时同样传给等待方的异常类型（如熔断器打开），
+            其余异常和 None 结果只属于 leader 自己
+    """
+
+    def __init__(self, shared=None, wait_timeout=30, shared_errors=()):
+        self.shared = shared
+        self.wait_timeout = wait_timeout
+        self.shared_errors = tuple(shared_errors)
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._stages = {}
+
+    def _count(self, stage, outcome):
+        with self._lock:
+            counts = self._stages.setdefault(stage, {
+                "leaders": 0, "coalesced": 0, "retried": 0, "shared_hits": 0, "shared_fallbacks": 0,
+            })
+            counts[outcome] += 1
+
+    def do(self, key, fn, stage="default", timeout=None):
+        """
+        执行 fn() 并返回结果；相同 key 的调用正在进行时等待并返回它的结果。
+        leader 抛出 shared_errors 中的异常时传给所有等待方；其他异常或返回 None 时，
+        等待方重新合并，其中一个成为新的 leader 再调用 fn()（fn 应使用调用方自己的截止时间）。
+
+        timeout 为等待其他请求结果的最长时间（秒），为 None 时使用 wait_timeout（跨 worker）或一直等待（进程内）。
+
+        Raises:
+            concurrent.futures.TimeoutError: 等待进程内的 leader 超过 timeout 秒
+        """
+        until = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = _Call()
+            if leader:
+                break
+
+            remaining = None if until is None else until - time.monotonic()
+            if (remaining is not None and remaining <= 0) or not call.done.wait(remaining):
+                raise concurrent.futures.TimeoutError()
+            if call.error is not None and isinstance(call.error, self.shared_errors):
+                self._count(stage, "coalesced")
+                raise call.error
+            if call.error is None and call.value is not None:
+                self._count(stage, "coalesced")
+                return call.value
+            # leader 的失败只属于它自己（截止时间、超时或调用出错），重新合并后在自己的时间内再试
+            self._count(stage, "retried")
+            if until is not None:
+                timeout = until - time.monotonic()
+
+        try:
+            call.value = self._lead(key, fn, stage, timeout)
+            return call.value
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def _lead(self, key, fn, stage, timeout=None):
+        """进程内的 leader：再通过共享登记表与其他 worker 合并"""
+        if self.shared is None:
+            self._count(stage, "leaders")
+            return fn()
+
+        state, value = self.shared.claim(key)
+        if state == 'done':
+            self._count(stage, "shared_hits")
+            return value
+        if state == 'follower':
+            wait_timeout = self.wait_timeout if timeout is None else min(self.wait_timeout, timeout)
+            value = self.shared.wait(key, wait_timeout)
+            if value is not None:
+                self._count(stage, "shared_hits")
+                return value
+            self._count(stage, "shared_fallbacks")
+            return fn()
+
+        self._count(stage, "leaders")
+        value = None
+        try:
+            value = fn()
+        finally:
+            if value is not None:
+                self.shared.publish(key, value)
+            else:
+                self.shared.release(key)
+        return value
+
+    def stats(self):
+        with self._lock:
+            stages = {stage: dict(counts) for stage, counts in self._stages.items()}
+            in_flight = len(self._calls)
+        for counts in stages.values():
+            counts["saved_calls"] = counts["coalesced"] + counts["shared_hits"]
+        return {
+            "in_flight": in_flight,
+            "shared": self.shared.path if self.shared else None,
+            "shared_errors": self.shared.errors if self.shared else 0,
+            "saved_calls": sum(counts["saved_calls"] for counts in stages.values()),
+            "stages": stages,
+        }
+
+    def reset_after_fork(self):
+        """fork 之后在子进程中调用，重新创建可能在 fork 时被持有的锁"""
+        self._lock = threading.Lock()
+        self._calls = {}
+        if self.shared:
+            self.shared.reset_after_fork()
@@ -1,3 +1,5 @@
+import { getBootstrapBundle, resolveBundleCollections } from '../../../utils/bootstrap-bundle';
+
 export default {
   test: async (ctx) => {
     ctx.body = {
@@ -114,6 +116,37 @@ export default {
     }
   },
 
+  /**
+   * 一次返回模拟器需要的全部集合（字段投影），带内容版本号和 ETag。
+   * ?collections=personality-traits,daily-challenges 只返回指定集合。
+   * If-None-Match 与当前版本一致时返回 304。
+   */
+  getBootstrapBundle: async (ctx) => {
+    try {
+      const names = resolveBundleCollections(ctx.query.collections);
+      if (!names.length) {
+        ctx.status = 400;
+        ctx.body = { error: 'collections 参数中没有可用的集合', success: false };
+        return;
+      }
+
+      const bundle = await getBootstrapBundle(strapi, names);
+      ctx.set('ETag', bundle.etag);
+      ctx.set('Cache-Control', 'no-cache');
+      if (ctx.get('If-None-Match') === bundle.etag) {
+        ctx.status = 304;
+        return;
+      }
+      ctx.type = 'application/json';
+      ctx.body = bundle.body;
+    } catch (error) {
+      ctx.body = {
+        error: error.message,
+        success: false,
+      };
+    }
+  },
+
   getDailyChallenges: async (ctx) => {
     try {
       const challenges = await strapi.entityService.findMany('api::daily-challenge.daily-challenge', {
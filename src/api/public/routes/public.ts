@@ -64,5 +64,13 @@ export default {
         auth: false,
       },
     },
+    {
+      method: 'GET',
+      path: '/public/bootstrap-bundle',
+      handler: 'public.getBootstrapBundle',
+      config: {
+        auth: false,
+      },
+    },
   ],
 }; 
\ No newline at end of file
@@ -1,4 +1,6 @@
 // import type { Core } from '@strapi/strapi';
+import { registerBootstrapBundleInvalidation } from './utils/bootstrap-bundle';
+import { registerCacheWebhook } from './utils/cache-webhook';
 
 export default {
   /**
@@ -16,5 +18,10 @@ export default {
    * This gives you an opportunity to set up your data model,
    * run jobs, or perform some special logic.
    */
-  bootstrap(/* { strapi }: { strapi: Core.Strapi } */) {},
+  bootstrap({ strapi }) {
+    // 条目变更时通知 Flask 端更新内存缓存
+    registerCacheWebhook(strapi);
+    // 条目变更时清空 /api/public/bootstrap-bundle 的缓存
+    registerBootstrapBundleInvalidation(strapi);
+  },
 };
@@ -0,0 +1,147 @@
+import crypto from 'crypto';
+
+/**
+ * 模拟器启动所需集合的字段投影，key 为 REST 集合路径。
+ * 前三个集合、responses 和 ideal-responses 与 Flask 端 strapi_catalog.py 中各记录类的 SOURCE_FIELDS / SOURCE_RELATIONS 保持一致。
+ */
+const BUNDLE_COLLECTIONS = {
+  'personality-traits': {
+    uid: 'api::personality-trait.personality-trait',
+    fields: ['name', 'description', 'keycharacteristic', 'core_need_description', 'updatedAt'],
+  },
+  'daily-challenges': {
+    uid: 'api::daily-challenge.daily-challenge',
+    fields: ['name', 'description', 'updatedAt'],
+    populate: {
+      scenario: {
+        fields: ['name', 'description', 'child_typical_behavior', 'parent_typical_emotion', 'potential_root_causes'],
+      },
+    },
+  },
+  'evaluation-rules': {
+    uid: 'api::evaluation-rule.evaluation-rule',
+    fields: ['rule_name', 'rule_description', 'trigger_condition', 'score_impact', 'updatedAt'],
+  },
+  'trait-expressions': {
+    uid: 'api::trait-expression.trait-expression',
+    fields: ['initia_dialog', 'general_response_guidance', 'updatedAt'],
+    populate: {
+      personality_trait: { fields: ['name'] },
+      daily_challenge: { fields: ['name'] },
+      parent_inputs_map: { fields: ['parent_keywords', 'follow_up_prompt_hint', 'child_response_template'] },
+    },
+  },
+  'dialogue-scenarios': {
+    uid: 'api::dialogue-scenario.dialogue-scenario',
+    fields: ['name', 'description', 'child_typical_behavior', 'parent_typical_emotion', 'potential_root_causes', 'updatedAt'],
+    populate: {
+      personality_trait: { fields: ['name'] },
+    },
+  },
+  'ideal-responses': {
+    uid: 'api::ideal-response.ideal-response',
+    fields: ['content', 'updatedAt'],
+    populate: {
+      personality_trait: { fields: ['name'] },
+      dialogue_scenario: { fields: ['name'] },
+      core_need: { fields: ['name'] },
+    },
+  },
+  responses: {
+    uid: 'api::response.response',
+    fields: [
+      'ruleName', 'parentKeywords', 'evaluationGrade', 'reasonAnalysis', 'suggestion_encouragement',
+      'childDesiredResponseInnerMonologue', 'parentInputAnalysis', 'updatedAt',
+    ],
+    populate: {
+      personality_traits: { fields: ['name'] },
+      daily_challenge: { fields: ['name'] },
+    },
+  },
+  'core-needs': {
+    uid: 'api::core-need.core-need',
+    fields: ['name', 'description', 'phraseexample', 'updatedAt'],
+  },
+};
+
+// 不带 collections 参数时返回的集合：Flask 端数据目录启动时需要的集合
+export const DEFAULT_BUNDLE_COLLECTIONS = ['personality-traits', 'daily-challenges', 'evaluation-rules', 'responses', 'ideal-responses'];
+
+export const BUNDLE_MODELS = Object.values(BUNDLE_COLLECTIONS).map((spec) => spec.uid);
+
+type Bundle = { body: string; version: string; etag: string };
+
+// 已序列化的结果，按请求的集合组合缓存；任何相关模型有写入时整体清空
+const memo = new Map<string, Promise<Bundle>>();
+
+export const invalidateBootstrapBundle = () => {
+  memo.clear();
+};
+
+/**
+ * 解析 collections 查询参数（逗号分隔），忽略未知的集合名。
+ */
+export const resolveBundleCollections = (value?: string) => {
+  if (!value) {
+    return DEFAULT_BUNDLE_COLLECTIONS;
+  }
+  const requested = String(value).split(',').map((name) => name.trim());
+  return Object.keys(BUNDLE_COLLECTIONS).filter((name) => requested.includes(name));
+};
+
+const buildBundle = async (strapi, names: string[]): Promise<Bundle> => {
+  const entries = await Promise.all(
+    names.map(async (name) => {
+      const { uid, fields, populate } = BUNDLE_COLLECTIONS[name];
+      const items = await strapi.documents(uid).findMany({
+        fields,
+        populate: populate || {},
+        status: 'published',
+      });
+      return [name, items];
+    })
+  );
+  const collections = Object.fromEntries(entries);
+  const version = crypto.createHash('sha1').update(JSON.stringify(collections)).digest('hex').slice(0, 16);
+  const body = JSON.stringify({
+    data: collections,
+    meta: { version, collections: names, generatedAt: new Date().toISOString() },
+    success: true,
+  });
+  return { body, version, etag: `"${version}"` };
+};
+
+/**
+ * 返回指定集合组合的 bundle。同一组合的并发请求共用一次查询；
+ * 查询期间发生写入时缓存已被清空，下一次请求会重新查询。
+ */
+export const getBootstrapBundle = (strapi, names: string[]) => {
+  const key = names.join(',');
+  let pending = memo.get(key);
+  if (!pending) {
+    pending = buildBundle(strapi, names);
+    memo.set(key, pending);
+    // 查询失败的结果不缓存
+    pending.catch(() => {
+      if (memo.get(key) === pending) {
+        memo.delete(key);
+      }
+    });
+  }
+  return pending;
+};
+
+/**
+ * 相关模型的任何写入（包括发布、取消发布）都清空 bundle 缓存。
+ */
+export const registerBootstrapBundleInvalidation = (strapi) => {
+  strapi.db.lifecycles.subscribe({
+    models: BUNDLE_MODELS,
+    afterCreate: invalidateBootstrapBundle,
+    afterCreateMany: invalidateBootstrapBundle,
+    afterUpdate: invalidateBootstrapBundle,
+    afterUpdateMany: invalidateBootstrapBundle,
+    afterDelete: invalidateBootstrapBundle,
+    afterDeleteMany: invalidateBootstrapBundle,
+  });
+};
@@ -0,0 +1,79 @@
+import crypto from 'crypto';
+
+// 需要同步到 Flask 内存缓存的模型
+const CACHE_WEBHOOK_MODELS = [
+  'api::personality-trait.personality-trait',
+  'api::daily-challenge.daily-challenge',
+  'api::evaluation-rule.evaluation-rule',
+  'api::response.response',
+  'api::ideal-response.ideal-response',
+];
+
+const CACHE_WEBHOOK_EVENTS = [
+  'entry.create',
+  'entry.update',
+  'entry.delete',
+  'entry.publish',
+  'entry.unpublish',
+];
+
+/**
+ * 用共享密钥对 "<时间戳>.<请求体>" 做 HMAC-SHA256 签名，
+ * 与 Flask 端 strapi_webhook.sign_payload 保持一致。
+ */
+export const signPayload = (secret: string, timestamp: number, body: string) =>
+  'sha256=' + crypto.createHmac('sha256', secret).update(`${timestamp}.${body}`).digest('hex');
+
+/**
+ * 订阅条目的生命周期事件，并把变更推送到 Flask 的 /webhooks/strapi 接口。
+ * 需要设置 PYTHON_CACHE_WEBHOOK_URL 和 STRAPI_WEBHOOK_SECRET，否则不启用。
+ */
+export const registerCacheWebhook = (strapi) => {
+  const url = process.env.PYTHON_CACHE_WEBHOOK_URL;
+  const secret = process.env.STRAPI_WEBHOOK_SECRET;
+
+  if (!url || !secret) {
+    strapi.log.info('[cache-webhook] PYTHON_CACHE_WEBHOOK_URL 或 STRAPI_WEBHOOK_SECRET 未设置，不推送缓存失效事件');
+    return;
+  }
+
+  const send = async (event: string, payload) => {
+    if (!payload || !CACHE_WEBHOOK_MODELS.includes(payload.uid)) {
+      return;
+    }
+
+    const body = JSON.stringify({
+      event,
+      createdAt: new Date().toISOString(),
+      model: payload.model,
+      uid: payload.uid,
+      entry: payload.entry,
+    });
+    const timestamp = Math.floor(Date.now() / 1000);
+
+    try {
+      const response = await fetch(url, {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+          'X-Strapi-Timestamp': String(timestamp),
+          'X-Strapi-Signature': signPayload(secret, timestamp, body),
+        },
+        body,
+        signal: AbortSignal.timeout(5000),
+      });
+      if (!response.ok) {
+        strapi.log.warn(`[cache-webhook] ${event} ${payload.uid} 推送失败: ${response.status}`);
+      }
+    } catch (error) {
+      // 推送失败不影响内容保存，Flask 端的增量同步会补上
+      strapi.log.warn(`[cache-webhook] ${event} ${payload.uid} 推送出错: ${error.message}`);
+    }
+  };
+
+  CACHE_WEBHOOK_EVENTS.forEach((event) => {
+    strapi.eventHub.on(event, (payload) => send(event, payload));
+  });
+
+  strapi.log.info(`[cache-webhook] 已启用，推送地址: ${url}`);
+};
@@ -70,21 +70,26 @@ document.addEventListener('DOMContentLoaded', function() {
         bubbleDiv.classList.add('bubble');
         bubbleDiv.innerHTML = text; // 使用 innerHTML 支持换行符
         
+        messageContentDiv.appendChild(bubbleDiv);
+
         if (sender === 'child' && score !== null) {
-            // 如果是孩子回应，并且有分数，把分数标签放在气泡左侧
-            const scoreTag = document.createElement('span');
-            scoreTag.classList.add('score-tag');
-            scoreTag.textContent = `${score > 0 ? '+' : ''}${score}`;
-            scoreTag.classList.add(`score-${score > 0 ? (score >= 8 ? 'a' : 'b') : 'c'}`);
-            messageContentDiv.appendChild(scoreTag);
+            addScoreTag(messageContentDiv, score);
         }
         
-        messageContentDiv.appendChild(bubbleDiv);
-        
         messageDiv.appendChild(messageContentDiv);
 
         chatBox.appendChild(messageDiv);
         chatBox.scrollTop = chatBox.scrollHeight; // 滚动到底部
+        return { messageContentDiv, bubbleDiv };
+    }
+
+    function addScoreTag(messageContentDiv, score) {
+        // 孩子回应的分数标签放在气泡左侧
+        const scoreTag = document.createElement('span');
+        scoreTag.classList.add('score-tag');
+        scoreTag.textContent = `${score > 0 ? '+' : ''}${score}`;
+        scoreTag.classList.add(`score-${score > 0 ? (score >= 8 ? 'a' : 'b') : 'c'}`);
+        messageContentDiv.insertBefore(scoreTag, messageContentDiv.firstChild);
     }
 
     function addLoadingMessage() {
@@ -184,6 +189,127 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
 
+    // 逐个解析 Server-Sent Events 响应中的事件，回调 onEvent(事件名, 数据)
+    async function readEventStream(response, onEvent) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder('utf-8');
+        let buffer = '';
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const block = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+                let event = 'message';
+                const dataLines = [];
+                block.split('\n').forEach(line => {
+                    if (line.startsWith('event:')) event = line.slice(6).trim();
+                    else if (line.startsWith('data:')) dataLines.push(line.slice(5).trim());
+                });
+                onEvent(event, dataLines.length ? JSON.parse(dataLines.join('\n')) : {});
+            }
+        }
+    }
+
+    function finishTurn(parent_input, childResponse, evaluation) {
+        const score = evaluation.score || evaluation.evaluation_score || 0;
+        totalScore += score;
+        totalScoreSpan.textContent = `总分: ${totalScore}`;
+        dialogueLog.push({
+            parent_input: parent_input,
+            child_response: childResponse,
+            evaluation: evaluation
+        });
+        return score;
+    }
+
+    function enableInput() {
+        removeLoadingMessage();
+        parentInput.disabled = false;
+        sendBtn.disabled = false;
+        guidanceBtn.disabled = false;
+    }
+
+    // 一次性返回完整结果的接口，浏览器不支持流式读取时使用
+    async function simulateDialogueOnce(payload) {
+        const response = await fetch('/simulate_dialogue', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify(payload)
+        });
+
+        const data = await response.json();
+        enableInput();
+
+        if (response.ok) {
+            console.log("DEBUG: 收到对话响应:", data);
+            
+            // 检查响应数据结构
+            const childResponse = data.child_response || data.response;
+            const evaluation = data.evaluation || {};
+            const score = finishTurn(payload.parent_input, childResponse, evaluation);
+            addMessageToChat('child', childResponse, score);
+        } else {
+            console.error("DEBUG: API错误:", data);
+            addMessageToChat('child', '系统错误: ' + (data.error || '未知错误'));
+        }
+    }
+
+    // 流式接口：孩子回应边生成边显示，评估结果到达后补上分数标签
+    async function simulateDialogueStream(payload) {
+        const response = await fetch('/simulate_dialogue_stream', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify(payload)
+        });
+
+        if (!response.ok) {
+            const data = await response.json();
+            enableInput();
+            console.error("DEBUG: API错误:", data);
+            addMessageToChat('child', '系统错误: ' + (data.error || '未知错误'));
+            return;
+        }
+
+        let message = null;
+        let childResponse = '';
+        let finished = false;
+        await readEventStream(response, (event, data) => {
+            if (event === 'delta') {
+                if (!message) {
+                    removeLoadingMessage();
+                    message = addMessageToChat('child', '');
+                }
+                childResponse += data.text;
+                message.bubbleDiv.textContent = childResponse;
+                chatBox.scrollTop = chatBox.scrollHeight;
+            } else if (event === 'child_response') {
+                childResponse = data.response;
+                if (message) message.bubbleDiv.textContent = childResponse;
+            } else if (event === 'evaluation') {
+                console.log("DEBUG: 收到评估结果:", data);
+                const score = finishTurn(payload.parent_input, childResponse, data);
+                addScoreTag(message.messageContentDiv, score);
+            } else if (event === 'error') {
+                finished = true;
+                console.error("DEBUG: API错误:", data);
+                addMessageToChat('child', '系统错误: ' + (data.error || '未知错误'));
+            } else if (event === 'done') {
+                finished = true;
+            }
+        });
+        enableInput();
+        if (!finished) {
+            addMessageToChat('child', '错误: 连接中断，请重试。');
+        }
+    }
+
     async function handleParentInput() {
         const parent_input = parentInput.value.trim();
         const personality_id = personalitySelect.value;
@@ -199,53 +325,21 @@ document.addEventListener('DOMContentLoaded', function() {
         sendBtn.disabled = true;
         guidanceBtn.disabled = true;
 
-        try {
-            const response = await fetch('/simulate_dialogue', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json'
-                },
-                body: JSON.stringify({
-                    parent_input: parent_input,
-                    personality_id: personality_id,
-                    daily_challenge_id: daily_challenge_id
-                })
-            });
-
-            const data = await response.json();
-            
-            removeLoadingMessage();
-            parentInput.disabled = false;
-            sendBtn.disabled = false;
-            guidanceBtn.disabled = false;
+        const payload = {
+            parent_input: parent_input,
+            personality_id: personality_id,
+            daily_challenge_id: daily_challenge_id
+        };
 
-            if (response.ok) {
-                console.log("DEBUG: 收到对话响应:", data);
-                
-                // 检查响应数据结构
-                const childResponse = data.child_response || data.response;
-                const evaluation = data.evaluation || {};
-                const score = evaluation.score || evaluation.evaluation_score || 0;
-                
-                addMessageToChat('child', childResponse, score);
-                
-                totalScore += score;
-                totalScoreSpan.textContent = `总分: ${totalScore}`;
-                dialogueLog.push({
-                    parent_input: parent_input,
-                    child_response: childResponse,
-                    evaluation: evaluation
-                });
+        try {
+            if (window.ReadableStream && window.TextDecoder) {
+                await simulateDialogueStream(payload);
             } else {
-                console.error("DEBUG: API错误:", data);
-                addMessageToChat('child', '系统错误: ' + (data.error || '未知错误'));
+                await simulateDialogueOnce(payload);
             }
         } catch (error) {
             console.error('模拟对话请求失败:', error);
-            removeLoadingMessage();
-            parentInput.disabled = false;
-            sendBtn.disabled = false;
-            guidanceBtn.disabled = false;
+            enableInput();
             addMessageToChat('child', '错误: 请求失败，请检查网络。');
         }
     }
@@ -0,0 +1,638 @@
+# my-project/strapi_catalog.py
+"""
+Strapi 数据目录
+
+把从 Strapi 拉取的原始集合（人格、日常挑战、评估规则、预设的家长反馈规则）规范化为紧凑的只读记录，
+并按 id 和名称建立索引，查找为 O(1)；反馈规则的关键词编译为一个多关键词匹配自动机。
+同时兼容 Strapi v4（字段嵌套在 attributes 中）和 v5（扁平结构）两种数据格式，
+调用方不再需要到处判断 'attributes' in x。
+
+Catalog 构建完成后不可修改：数据重新加载时构建新的 Catalog 整体替换，
+多线程 worker 在一次请求中拿到的始终是同一个完整快照。
+"""
+
+import hashlib
+import json
+from types import MappingProxyType
+
+from example_index import ExampleIndex, ideal_response_examples
+from keyword_matcher import KeywordMatcher
+from rule_engine import RuleEngine
+from rule_selector import RuleIndex
+
+
+def entity_fields(entity):
+    """返回实体的扁平字段字典，兼容 v4 的 attributes 嵌套格式"""
+    if not isinstance(entity, dict):
+        return {}
+    if isinstance(entity.get('attributes'), dict):
+        fields = dict(entity['attributes'])
+        fields.setdefault('id', entity.get('id'))
+        return fields
+    return entity
+
+
+def relation_items(value):
+    """把关联字段统一展开为扁平字典列表（v4 为 {'data': ...}，v5 直接是对象或列表）"""
+    if isinstance(value, dict) and 'data' in value:
+        value = value['data']
+    if not value:
+        return []
+    if isinstance(value, dict):
+        value = [value]
+    return [entity_fields(item) for item in value if isinstance(item, dict)]
+
+
+def blocks_to_text(value):
+    """把 Strapi 的 blocks 富文本转换为纯文本，普通字符串原样返回"""
+    if value is None:
+        return ''
+    if isinstance(value, str):
+        return value
+    if isinstance(value, list):
+        return '\n'.join(text for text in (blocks_to_text(block) for block in value) if text)
+    if isinstance(value, dict):
+        if 'text' in value:
+            return value.get('text') or ''
+        return ''.join(blocks_to_text(child) for child in value.get('children', []))
+    return str(value)
+
+
+def _string_list(value):
+    """把 JSON 字段规范化为字符串元组"""
+    if not value:
+        return ()
+    if isinstance(value, str):
+        return (value,)
+    if isinstance(value, (list, tuple)):
+        return tuple(str(item) for item in value if item)
+    return ()
+
+
+class _FrozenRecord:
+    """只读记录基类：字段只能在 __init__ 中通过 _set 赋值"""
+    __slots__ = ()
+
+    def _set(self, **fields):
+        for name, value in fields.items():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} 是只读记录，不能修改字段 '{name}'")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} 是只读记录，不能删除字段 '{name}'")
+
+
+class Scenario(_FrozenRecord):
+    """对话情境记录"""
+    # from_entity 读取的 Strapi 字段，用于生成字段投影查询（见 projection_params）
+    SOURCE_FIELDS = ('name', 'description', 'child_typical_behavior',
+                     'parent_typical_emotion', 'potential_root_causes')
+    SOURCE_RELATIONS = {}
+    __slots__ = ('id', 'name', 'description', 'child_typical_behavior',
+                 'parent_typical_emotion', 'potential_root_causes')
+
+    def __init__(self, id, name='', description='', child_typical_behavior=(),
+                 parent_typical_emotion=(), potential_root_causes=()):
+        self._set(
+            id=id,
+            name=name,
+            description=description,
+            child_typical_behavior=child_typical_behavior,
+            parent_typical_emotion=parent_typical_emotion,
+            potential_root_causes=potential_root_causes,
+        )
+
+    @classmethod
+    def from_entity(cls, entity):
+        fields = entity_fields(entity)
+        return cls(
+            id=fields.get('id'),
+            name=fields.get('name') or '',
+            description=blocks_to_text(fields.get('description')),
+            child_typical_behavior=_string_list(fields.get('child_typical_behavior')),
+            parent_typical_emotion=_string_list(fields.get('parent_typical_emotion')),
+            potential_root_causes=_string_list(fields.get('potential_root_causes')),
+        )
+
+    def __repr__(self):
+        return f"Scenario(id={self.id!r}, name={self.name!r})"
+
+
+class Personality(_FrozenRecord):
+    """孩子人格记录"""
+    SOURCE_FIELDS = ('name', 'description', 'keycharacteristic', 'core_need_description')
+    SOURCE_RELATIONS = {}
+    __slots__ = ('id', 'document_id', 'name', 'description',
+                 'key_characteristics', 'core_need_description')
+
+    def __init__(self, id, document_id=None, name='', description='',
+                 key_characteristics=(), core_need_description=''):
+        self._set(
+            id=id,
+            document_id=document_id,
+            name=name,
+            description=description,
+            key_characteristics=key_characteristics,
+            core_need_description=core_need_description,
+        )
+
+    @classmethod
+    def from_entity(cls, entity):
+        fields = entity_fields(entity)
+        return cls(
+            id=fields.get('id'),
+            document_id=fields.get('documentId'),
+            name=fields.get('name') or '',
+            description=blocks_to_text(fields.get('description')),
+            key_characteristics=_string_list(fields.get('keycharacteristic')),
+            core_need_description=blocks_to_text(fields.get('core_need_description')),
+        )
+
+    def __repr__(self):
+        return f"Personality(id={self.id!r}, name={self.name!r})"
+
+
+class DailyChallenge(_FrozenRecord):
+    """日常挑战主题记录，scenarios 为该主题下的情境元组"""
+    SOURCE_FIELDS = ('name', 'description')
+    # v4 数据中的 dialogue_scenarios 在 v5 schema 中不存在，投影只展开 scenario
+    SOURCE_RELATIONS = {'scenario': Scenario}
+    __slots__ = ('id', 'document_id', 'name', 'description', 'scenarios')
+
+    def __init__(self, id, document_id=None, name='', description='', scenarios=()):
+        self._set(
+            id=id,
+            document_id=document_id,
+            name=name,
+            description=description,
+            scenarios=scenarios,
+        )
+
+    @classmethod
+    def from_entity(cls, entity):
+        fields = entity_fields(entity)
+        # v4 数据使用 dialogue_scenarios，v5 的 schema 中是 scenario 单一关联
+        scenario_items = relation_items(fields.get('dialogue_scenarios')) + relation_items(fields.get('scenario'))
+        return cls(
+            id=fields.get('id'),
+            document_id=fields.get('documentId'),
+            name=fields.get('name') or '',
+            description=blocks_to_text(fields.get('description')),
+            scenarios=tuple(Scenario.from_entity(item) for item in scenario_items),
+        )
+
+    def __repr__(self):
+        return f"DailyChallenge(id={self.id!r}, name={self.name!r}, scenarios={len(self.scenarios)})"
+
+
+class EvaluationRule(_FrozenRecord):
+    """评估规则记录"""
+    SOURCE_FIELDS = ('rule_name', 'rule_description', 'trigger_condition', 'score_impact')
+    SOURCE_RELATIONS = {}
+    __slots__ = ('id', 'rule_name', 'rule_description', 'trigger_condition', 'score_impact')
+
+    def __init__(self, id, rule_name='', rule_description='', trigger_condition='', score_impact=0):
+        self._set(
+            id=id,
+            rule_name=rule_name,
+            rule_description=rule_description,
+            trigger_condition=trigger_condition,
+            score_impact=score_impact,
+        )
+
+    @classmethod
+    def from_entity(cls, entity):
+        fields = entity_fields(entity)
+        return cls(
+            id=fields.get('id'),
+            rule_name=fields.get('rule_name') or '',
+            rule_description=blocks_to_text(fields.get('rule_description')),
+            trigger_condition=blocks_to_text(fields.get('trigger_condition')),
+            score_impact=fields.get('score_impact') or 0,
+        )
+
+    def __repr__(self):
+        return f"EvaluationRule(id={self.id!r}, rule_name={self.rule_name!r})"
+
+
+class ParentInputResponse(_FrozenRecord):
+    """特质表现中的家长输入-孩子回应映射（dialog.parent-input-response 组件）"""
+    SOURCE_FIELDS = ('parent_keywords', 'follow_up_prompt_hint', 'child_response_template')
+    SOURCE_RELATIONS = {}
+    __slots__ = ('parent_keywords', 'follow_up_prompt_hint', 'child_response_template')
+
+    def __init__(self, parent_keywords=(), follow_up_prompt_hint='', child_response_template=''):
+        self._set(
+            parent_keywords=parent_keywords,
+            follow_up_prompt_hint=follow_up_prompt_hint,
+            child_response_template=child_response_template,
+        )
+
+    @classmethod
+    def from_entity(cls, entity):
+        fields = entity_fields(entity)
+        return cls(
+            parent_keywords=_string_list(fields.get('parent_keywords')),
+            follow_up_prompt_hint=fields.get('follow_up_prompt_hint') or '',
+            child_response_template=blocks_to_text(fields.get('child_response_template')),
+        )
+
+    def __repr__(self):
+        return f"ParentInputResponse(parent_keywords={self.parent_keywords!r})"
+
+
+class TraitExpression(_FrozenRecord):
+    """某个人格在某个日常挑战下的特质表现，按需加载（见 strapi_details.py）"""
+    # initia_dialog 为 schema 中的原始拼写
+    SOURCE_FIELDS = ('initia_dialog', 'general_response_guidance')
+    SOURCE_RELATIONS = {'parent_inputs_map': ParentInputResponse}
+    __slots__ = ('id', 'document_id', 'initial_dialog', 'general_response_guidance', 'parent_inputs')
+
+    def __init__(self, id, document_id=None, initial_dialog='', general_response_guidance='', parent_inputs=()):
+        self._set(
+            id=id,
+            document_id=document_id,
+            initial_dialog=initial_dialog,
+            general_response_guidance=general_response_guidance,
+            parent_inputs=parent_inputs,
+        )
+
+    @classmethod
+    def from_entity(cls, entity):
+        fields = entity_fields(entity)
+        parent_inputs = fields.get('parent_inputs_map') or []
+        return cls(
+            id=fields.get('id'),
+            document_id=fields.get('documentId'),
+            initial_dialog=fields.get('initia_dialog') or '',
+            general_response_guidance=blocks_to_text(fields.get('general_response_guidance')),
+            parent_inputs=tuple(ParentInputResponse.from_entity(item) for item in parent_inputs if isinstance(item, dict)),
+        )
+
+    def __repr__(self):
+        return f"TraitExpression(id={self.id!r}, parent_inputs={len(self.parent_inputs)})"
+
+
+class RecordRef(_FrozenRecord):
+    """关联记录的引用，只保留用于比较的 id / documentId"""
+    SOURCE_FIELDS = ('name',)
+    SOURCE_RELATIONS = {}
+    __slots__ = ('id', 'document_id')
+
+    def __init__(self, id, document_id=None):
+        self._set(id=id, document_id=document_id)
+
+    @classmethod
+    def from_entity(cls, entity):
+        fields = entity_fields(entity)
+        return cls(id=fields.get('id'), document_id=fields.get('documentId'))
+
+    def refers_to(self, record):
+        """是否指向 record（v5 比较 documentId，v4 数据没有 documentId 时比较 id）"""
+        if self.document_id and getattr(record, 'document_id', None):
+            return self.document_id == record.document_id
+        return self.id is not None and str(self.id) == str(record.id)
+
+    def __repr__(self):
+        return f"RecordRef(id={self.id!r}, document_id={self.document_id!r})"
+
+
+class ParentFeedbackRule(_FrozenRecord):
+    """
+    预设的家长反馈规则（responses 集合）：家长的话命中 parent_keywords 中任一关键词时，
+    直接使用预设的评级和分析。personality_traits / daily_challenge 为空表示适用于全部人格 / 挑战。
+    """
+    SOURCE_FIELDS = ('ruleName', 'parentKeywords', 'evaluationGrade', 'reasonAnalysis',
+                     'suggestion_encouragement', 'childDesiredResponseInnerMonologue', 'parentInputAnalysis')
+    SOURCE_RELATIONS = {'personality_traits': RecordRef, 'daily_challenge': RecordRef}
+    __slots__ = ('id', 'document_id', 'rule_name', 'parent_keywords', 'evaluation_grade', 'reason_analysis',
+                 'suggestion_encouragement', 'inner_monologue', 'parent_input_analysis',
+                 'personality_traits', 'daily_challenge')
+
+    def __init__(self, id, document_id=None, rule_name='', parent_keywords=(), evaluation_grade='',
+                 reason_analysis='', suggestion_encouragement='', inner_monologue='',
+                 parent_input_analysis=None, personality_traits=(), daily_challenge=None):
+        self._set(
+            id=id,
+            document_id=document_id,
+            rule_name=rule_name,
+            parent_keywords=parent_keywords,
+            evaluation_grade=evaluation_grade,
+            reason_analysis=reason_analysis,
+            suggestion_encouragement=suggestion_encouragement,
+            inner_monologue=inner_monologue,
+            parent_input_analysis=parent_input_analysis,
+            personality_traits=personality_traits,
+            daily_challenge=daily_challenge,
+        )
+
+    @classmethod
+    def from_entity(cls, entity):
+        fields = entity_fields(entity)
+        keywords = fields.get('parentKeywords')
+        # 旧数据中 parentKeywords 可能是 JSON 字符串
+        if isinstance(keywords, str):
+            try:
+                keywords = json.loads(keywords)
+            except ValueError:
+                keywords = [keywords]
+        challenges = relation_items(fields.get('daily_challenge'))
+        return cls(
+            id=fields.get('id'),
+            document_id=fields.get('documentId'),
+            rule_name=fields.get('ruleName') or '',
+            parent_keywords=_string_list(keywords),
+            evaluation_grade=(fields.get('evaluationGrade') or '').strip().upper(),
+            reason_analysis=blocks_to_text(fields.get('reasonAnalysis')),
+            suggestion_encouragement=blocks_to_text(fields.get('suggestion_encouragement')),
+            inner_monologue=fields.get('childDesiredResponseInnerMonologue') or '',
+            parent_input_analysis=fields.get('parentInputAnalysis'),
+            personality_traits=tuple(RecordRef.from_entity(item) for item in relation_items(fields.get('personality_traits'))),
+            daily_challenge=RecordRef.from_entity(challenges[0]) if challenges else None,
+        )
+
+    def applies_to(self, personality=None, challenge=None):
+        """规则是否适用于该人格和挑战"""
+        if personality is not None and self.personality_traits:
+            if not any(ref.refers_to(personality) for ref in self.personality_traits):
+                return False
+        if challenge is not None and self.daily_challenge is not None:
+            if not self.daily_challenge.refers_to(challenge):
+                return False
+        return True
+
+    def __repr__(self):
+        return f"ParentFeedbackRule(id={self.id!r}, rule_name={self.rule_name!r}, grade={self.evaluation_grade!r})"
+
+
+def projection_params(record_cls, extra_fields=('updatedAt',)):
+    """
+    根据记录类实际读取的字段生成 Strapi 字段投影查询参数，代替 populate=*。
+
+    例如 DailyChallenge 生成：
+        fields[0]=name&fields[1]=description&fields[2]=updatedAt
+        &populate[scenario][fields][0]=name&...
+
+    extra_fields 为增量同步需要的 updatedAt 等字段；id / documentId 总会返回。
+    """
+    params = []
+    for index, field in enumerate(tuple(record_cls.SOURCE_FIELDS) + tuple(extra_fields)):
+        params.append((f'fields[{index}]', field))
+    for relation, related_cls in record_cls.SOURCE_RELATIONS.items():
+        for index, field in enumerate(related_cls.SOURCE_FIELDS):
+            params.append((f'populate[{relation}][fields][{index}]', field))
+    return params
+
+
+class IdealResponse(_FrozenRecord):
+    """精选的理想回应（ideal-responses 集合），评估时作为 A 级的参考示例"""
+    SOURCE_FIELDS = ('content',)
+    SOURCE_RELATIONS = {'personality_trait': RecordRef, 'dialogue_scenario': RecordRef}
+    __slots__ = ('id', 'document_id', 'content', 'personality_trait', 'dialogue_scenario')
+
+    def __init__(self, id, document_id=None, content='', personality_trait=None, dialogue_scenario=None):
+        self._set(
+            id=id,
+            document_id=document_id,
+            content=content,
+            personality_trait=personality_trait,
+            dialogue_scenario=dialogue_scenario,
+        )
+
+    @classmethod
+    def from_entity(cls, entity):
+        fields = entity_fields(entity)
+        personalities = relation_items(fields.get('personality_trait'))
+        scenarios = relation_items(fields.get('dialogue_scenario'))
+        return cls(
+            id=fields.get('id'),
+            document_id=fields.get('documentId'),
+            content=blocks_to_text(fields.get('content')).strip(),
+            personality_trait=RecordRef.from_entity(personalities[0]) if personalities else None,
+            dialogue_scenario=RecordRef.from_entity(scenarios[0]) if scenarios else None,
+        )
+
+    def __repr__(self):
+        return f"IdealResponse(id={self.id!r}, content={self.content[:20]!r})"
+
+
+def _ref_applies(ref, record):
+    """关联为空（不限）、record 未知或关联指向 record 时为真"""
+    return ref is None or record is None or ref.refers_to(record)
+
+
+# 挑战主题没有关联情境时使用的默认情境
+DEFAULT_SCENARIO = Scenario(id=1, name='默认情境', description='这是一个默认的情境，用于测试对话功能。')
+
+
+def _index_by_id(records):
+    """按 id（字符串形式）和 documentId 建立索引，路由参数可能是字符串也可能是数字"""
+    index = {}
+    for record in records:
+        if record.id is not None:
+            index[str(record.id)] = record
+        document_id = getattr(record, 'document_id', None)
+        if document_id:
+            index[str(document_id)] = record
+    return index
+
+
+def _index_by_name(records, attr='name'):
+    """按名称建立索引，名称重复时保留第一条，与原先 next(...) 线性查找的结果一致"""
+    index = {}
+    for record in records:
+        name = getattr(record, attr)
+        if name and name not in index:
+            index[name] = record
+    return index
+
+
+def _rule_prompt_line(rule, with_conditions):
+    """一条评估规则在提示词中的文本"""
+    if with_conditions:
+        return f"- {rule.rule_name}: {rule.rule_description}\n  触发条件: {rule.trigger_condition}\n  分数影响: {rule.score_impact}\n"
+    return f"- {rule.rule_name}: {rule.rule_description}\n"
+
+
+def _rules_prompt_text(rules, with_conditions, rule_lines=None):
+    """
+    渲染评估规则提示文本；rule_lines 为预先渲染的 {规则: (带触发条件的文本, 不带触发条件的文本)}，
+    其中没有的规则当场渲染
+    """
+    if not rules:
+        return ""
+    lines = ["\n\n评估规则参考：\n"]
+    for rule in rules:
+        rendered = rule_lines.get(rule) if rule_lines else None
+        lines.append(rendered[0 if with_conditions else 1] if rendered else _rule_prompt_line(rule, with_conditions))
+    return "".join(lines)
+
+
+def collections_version(collections):
+    """根据原始集合内容计算版本号，内容不变则版本号不变"""
+    payload = json.dumps(collections, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:12]
+
+
+class Catalog:
+    """
+    规范化后的数据目录快照，按 id 和名称提供 O(1) 查找。
+
+    构建后不可修改，并预先生成请求处理需要的派生数据（评估规则提示文本等）。
+    数据重新加载时构建新的 Catalog 并整体替换，不在原对象上修改。
+    """
+    __slots__ = (
+        'personalities', 'daily_challenges', 'evaluation_rules', 'feedback_rules', 'ideal_responses', 'raw', 'version',
+        'evaluation_rules_text', 'guidance_rules_text', 'rule_engine',
+        '_personalities_by_id', '_personalities_by_name',
+        '_challenges_by_id', '_challenges_by_name',
+        '_rules_by_id', '_rules_by_name', '_feedback_matcher', '_rule_index', '_narrative_rule_index', '_rule_lines',
+        '_ideal_example_index',
+    )
+
+    def __init__(self, personalities=(), daily_challenges=(), evaluation_rules=(), feedback_rules=(), ideal_responses=(),
+                 raw=None, version=''):
+        fields = {
+            'personalities': tuple(personalities),
+            'daily_challenges': tuple(daily_challenges),
+            'evaluation_rules': tuple(evaluation_rules),
+            'feedback_rules': tuple(feedback_rules),
+            'ideal_responses': tuple(ideal_responses),
+            # 原始集合（供 /get_personalities 等接口原样返回），只读视图
+            'raw': MappingProxyType({key: tuple(items) for key, items in (raw or {}).items()}),
+            'version': version,
+        }
+        # 每条规则的提示文本预先渲染，筛选出部分规则时只需要拼接（记录按对象身份作为键）
+        rule_lines = MappingProxyType({
+            rule: (_rule_prompt_line(rule, True), _rule_prompt_line(rule, False)) for rule in fields['evaluation_rules']
+        })
+        fields.update({
+            'evaluation_rules_text': _rules_prompt_text(fields['evaluation_rules'], with_conditions=True, rule_lines=rule_lines),
+            'guidance_rules_text': _rules_prompt_text(fields['evaluation_rules'], with_conditions=False, rule_lines=rule_lines),
+            '_rule_lines': rule_lines,
+            '_personalities_by_id': MappingProxyType(_index_by_id(fields['personalities'])),
+            '_personalities_by_name': MappingProxyType(_index_by_name(fields['personalities'])),
+            '_challenges_by_id': MappingProxyType(_index_by_id(fields['daily_challenges'])),
+            '_challenges_by_name': MappingProxyType(_index_by_name(fields['daily_challenges'])),
+            '_rules_by_id': MappingProxyType(_index_by_id(fields['evaluation_rules'])),
+            '_rules_by_name': MappingProxyType(_index_by_name(fields['evaluation_rules'], attr='rule_name')),
+            # 所有反馈规则的关键词编译为一个自动机，随快照一起重建
+            '_feedback_matcher': KeywordMatcher((rule.parent_keywords, rule) for rule in fields['feedback_rules']),
+            # 评估规则的相关性索引（BM25 + 触发条件），用于只把相关的规则放进提示词
+            '_rule_index': RuleIndex(fields['evaluation_rules']),
+            # 能机械判定的触发条件编译为本地匹配器，其余规则单独建索引，交给大模型判断
+            'rule_engine': RuleEngine(fields['evaluation_rules']),
+        })
+        fields['_narrative_rule_index'] = RuleIndex(fields['rule_engine'].uncompiled)
+        # 理想回应的示例索引（评估提示中的评级参考示例），没有理想回应时为 None
+        ideal_examples = ideal_response_examples(fields['ideal_responses'])
+        fields['_ideal_example_index'] = ExampleIndex(ideal_examples) if ideal_examples else None
+        for name, value in fields.items():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"Catalog 是只读快照，不能修改字段 '{name}'")
+
+    @classmethod
+    def from_collections(cls, personalities=None, daily_challenges=None, evaluation_rules=None, feedback_rules=None,
+                         ideal_responses=None):
+        """从 Strapi 原始集合（v4 或 v5 格式均可）构建目录"""
+        raw = {
+            'personalities': list(personalities or []),
+            'daily-challenges': list(daily_challenges or []),
+            'evaluation-rules': list(evaluation_rules or []),
+        }
+        # 没有反馈规则时不加入 raw，保持与之前快照相同的版本号
+        if feedback_rules:
+            raw['feedback-rules'] = list(feedback_rules)
+        if ideal_responses:
+            raw['ideal-responses'] = list(ideal_responses)
+        return cls(
+            personalities=[Personality.from_entity(p) for p in raw['personalities']],
+            daily_challenges=[DailyChallenge.from_entity(c) for c in raw['daily-challenges']],
+            evaluation_rules=[EvaluationRule.from_entity(r) for r in raw['evaluation-rules']],
+            feedback_rules=[ParentFeedbackRule.from_entity(r) for r in raw.get('feedback-rules', [])],
+            ideal_responses=[IdealResponse.from_entity(r) for r in raw.get('ideal-responses', [])],
+            raw=raw,
+            version=collections_version(raw),
+        )
+
+    def get_personality(self, personality_id):
+        return self._personalities_by_id.get(str(personality_id))
+
+    def personality_by_name(self, name):
+        return self._personalities_by_name.get(name)
+
+    def get_challenge(self, challenge_id):
+        return self._challenges_by_id.get(str(challenge_id))
+
+    def challenge_by_name(self, name):
+        return self._challenges_by_name.get(name)
+
+    def get_rule(self, rule_id):
+        return self._rules_by_id.get(str(rule_id))
+
+    def rule_by_name(self, rule_name):
+        return self._rules_by_name.get(rule_name)
+
+    def select_rules(self, query, context='', k=0, narrative_only=False):
+        """
+        与 query（家长输入）和 context（人格、情境描述）最相关的 k 条评估规则，k <= 0 时返回全部规则；
+        narrative_only 为真时只在规则引擎无法判定、需要大模型判断的规则中选取
+        """
+        index = self._narrative_rule_index if narrative_only else self._rule_index
+        return index.select(query, context, k)
+
+    def rules_prompt(self, query, context='', k=0, with_conditions=True, narrative_only=False):
+        """
+        只包含最相关的 k 条评估规则的提示文本，返回 (文本, 入选规则数)；
+        全部规则入选时直接返回预先渲染的文本。
+        """
+        rules = self.select_rules(query, context, k, narrative_only)
+        if len(rules) == len(self.evaluation_rules):
+            return (self.evaluation_rules_text if with_conditions else self.guidance_rules_text), len(rules)
+        return _rules_prompt_text(rules, with_conditions, self._rule_lines), len(rules)
+
+    def rule_context_cache_stats(self):
+        """两个规则索引中人格、情境描述得分缓存的统计"""
+        return {
+            "all_rules": self._rule_index.context_cache_stats(),
+            "llm_judged_rules": self._narrative_rule_index.context_cache_stats(),
+        }
+
+    def search_ideal_examples(self, text, personality=None, scenario=None, k=3, min_similarity=0.0):
+        """
+        与 text 最相似的 k 条理想回应示例 [(相似度, Example)]；
+        只在适用于该人格和情境的理想回应中选取（关联为空的适用于全部人格 / 情境）
+        """
+        if self._ideal_example_index is None:
+            return []
+        return self._ideal_example_index.search(
+            text, k, min_similarity,
+            accept=lambda example: _ref_applies(example.personality, personality) and _ref_applies(example.scenario, scenario))
+
+    def ideal_example_stats(self):
+        """理想回应示例索引的统计，没有理想回应时返回 None"""
+        return self._ideal_example_index.stats() if self._ideal_example_index is not None else None
+
+    def reset_after_fork(self):
+        """fork 之后在子进程中调用，重新创建规则索引中可能在 fork 时被持有的锁"""
+        self._rule_index.reset_after_fork()
+        self._narrative_rule_index.reset_after_fork()
+
+    def match_feedback_rule(self, parent_input, personality=None, challenge=None):
+        """
+        返回家长输入命中的第一条适用的反馈规则，没有时返回 None。
+        对 parent_input 只扫描一遍，与规则数量无关。
+        """
+        return self._feedback_matcher.first(parent_input, lambda rule: rule.applies_to(personality, challenge))
+
+    def __repr__(self):
+        return (f"Catalog(version={self.version!r}, "
+                f"personalities={len(self.personalities)}, "
+                f"daily_challenges={len(self.daily_challenges)}, "
+                f"evaluation_rules={len(self.evaluation_rules)}, "
+                f"feedback_rules={len(self.feedback_rules)}, "
+                f"ideal_responses={len(self.ideal_responses)})")
@@ -0,0 +1,132 @@
+# my-project/strapi_details.py
+"""
+按需加载的 Strapi 详细数据
+
+特质表现（trait-expressions）和情境实例（dialogue-scenarios）按人格 × 挑战组合，
+数量远多于启动时加载的三个集合，而一个 worker 实际用到的只是其中少数组合。
+因此不在启动时全部加载，而是在对话第一次用到某个组合时按过滤条件拉取，
+结果放入容量有限、带过期时间的 LRU 缓存（lru_cache.py）。
+
+缓存键包含数据目录版本号，人格或挑战数据变化后旧条目自然失效并被淘汰；
+特质表现本身的修改在 ttl 过期后生效。
+"""
+
+import sys
+import time
+
+import deadline
+from strapi_catalog import Scenario, TraitExpression, projection_params
+from strapi_loader import StrapiFetchError, fetch_collection
+
+TRAIT_EXPRESSIONS_PATH = 'trait-expressions'
+SCENARIO_INSTANCES_PATH = 'dialogue-scenarios'
+# 请求剩余时间少于该值（秒）时不再按需加载，直接使用数据目录中的数据
+MIN_FETCH_TIMEOUT = 0.5
+
+
+class _BackingOff(Exception):
+    """请求失败后的暂停期间跳过按需加载"""
+
+
+def _relation_filter(relation, record):
+    """按关联记录过滤：v5 使用 documentId，v4 数据没有 documentId 时使用 id"""
+    if getattr(record, 'document_id', None):
+        return (f'filters[{relation}][documentId][$eq]', record.document_id)
+    return (f'filters[{relation}][id][$eq]', record.id)
+
+
+class StrapiDetailLoader:
+    """
+    按人格 × 挑战加载特质表现和情境实例，结果缓存在 LRUCache 中。
+
+    Strapi 请求失败或请求的剩余时间不足时记录警告并返回空结果，失败不会被缓存；
+    查询成功但没有数据的组合同样会被缓存，避免反复请求。
+    Strapi 请求失败后的 failure_backoff 秒内不再按需加载（所有组合都直接返回空结果），
+    Strapi 休眠或不可达时，每轮对话不必在 LLM 调用之前先等两次请求超时。
+
+    Args:
+        base_url (str): Strapi 地址
+        cache (LRUCache): 结果缓存
+        timeout (float): 单次请求超时（秒），位于对话请求的关键路径上，应当较短
+        use_projection (bool): 是否使用字段投影（否则 populate=*）
+        failure_backoff (float): 请求失败后暂停按需加载的时间（秒），0 表示不暂停
+        clock (callable): 时间函数，默认 time.monotonic
+    """
+
+    def __init__(self, base_url, cache, timeout=5, use_projection=True, failure_backoff=30, clock=time.monotonic):
+        self.base_url = base_url
+        self.cache = cache
+        self.timeout = timeout
+        self.use_projection = use_projection
+        self.failure_backoff = failure_backoff
+        self._clock = clock
+        # 暂停到该时间点为止；多个线程同时写入时取哪一个都可以，不需要加锁
+        self._backoff_until = 0.0
+        self.failures = 0
+        self.skipped = 0
+
+    def _params(self, record_cls, filters):
+        if self.use_projection:
+            return projection_params(record_cls, extra_fields=()) + list(filters)
+        return [('populate', '*')] + list(filters)
+
+    def _fetch(self, entity_name, record_cls, filters):
+        # 请求设置了截止时间时，超时不超过剩余时间
+        timeout = deadline.budget(self.timeout, minimum=MIN_FETCH_TIMEOUT)
+        items = fetch_collection(self.base_url, entity_name,
+                                 params=self._params(record_cls, filters), timeout=timeout)
+        return tuple(record_cls.from_entity(item) for item in items)
+
+    def _cached(self, kind, catalog, personality, challenge, load):
+        key = (kind, catalog.version, str(personality.id), str(challenge.id))
+
+        def guarded_load():
+            # 缓存中已有的组合照常使用，暂停期间只跳过新的请求
+            if self._clock() < self._backoff_until:
+                raise _BackingOff()
+            return load()
+
+        try:
+            return self.cache.get_or_load(key, guarded_load)
+        except _BackingOff:
+            self.skipped += 1
+            return None
+        except StrapiFetchError as e:
+            self.failures += 1
+            if self.failure_backoff:
+                self._backoff_until = self._clock() + self.failure_backoff
+            print(f"WARNING: 按需加载 {kind}（人格 {personality.id}，挑战 {challenge.id}）失败，"
+                  f"{self.failure_backoff:g} 秒内不再按需加载: {e}", file=sys.stderr)
+            return None
+        except deadline.DeadlineExceeded as e:
+            print(f"WARNING: 按需加载 {kind}（人格 {personality.id}，挑战 {challenge.id}）失败: {e}", file=sys.stderr)
+            return None
+
+    def trait_expression(self, catalog, personality, challenge):
+        """返回该人格在该挑战下的特质表现，没有时返回 None"""
+        filters = [_relation_filter('personality_trait', personality), _relation_filter('daily_challenge', challenge)]
+        expressions = self._cached(
+            TRAIT_EXPRESSIONS_PATH, catalog, personality, challenge,
+            lambda: self._fetch(TRAIT_EXPRESSIONS_PATH, TraitExpression, filters),
+        )
+        return expressions[0] if expressions else None
+
+    def scenario_instances(self, catalog, personality, challenge):
+        """返回该挑战下属于该人格的情境实例元组，没有时返回空元组"""
+        filters = [_relation_filter('personality_trait', personality), _relation_filter('daily_challenges', challenge)]
+        return self._cached(
+            SCENARIO_INSTANCES_PATH, catalog, personality, challenge,
+            lambda: self._fetch(SCENARIO_INSTANCES_PATH, Scenario, filters),
+        ) or ()
+
+    def stats(self):
+        stats = self.cache.stats()
+        stats.update({
+            "fetch_failures": self.failures,
+            "skipped_during_backoff": self.skipped,
+            "backoff_remaining_seconds": round(max(0.0, self._backoff_until - self._clock()), 1),
+        })
+        return stats
+
+    def reset_after_fork(self):
+        self.cache.reset_after_fork()
@@ -0,0 +1,193 @@
+# my-project/strapi_loader.py
+"""
+Strapi REST 拉取工具
+
+按页遍历 Strapi 集合接口（pagination[page] / pagination[pageSize]，直到 pageCount），
+避免默认分页大小截断大集合；启动时多个集合并发拉取，并记录每个集合的耗时。
+"""
+
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from strapi_catalog import DailyChallenge, EvaluationRule, IdealResponse, ParentFeedbackRule, Personality, projection_params
+
+# 缓存中的集合键 -> Strapi 集合 API 路径
+STRAPI_COLLECTIONS = {
+    'personalities': 'personality-traits',
+    'daily-challenges': 'daily-challenges',
+    'evaluation-rules': 'evaluation-rules',
+    'feedback-rules': 'responses',
+    'ideal-responses': 'ideal-responses',
+}
+
+# 集合键 -> 字段投影查询参数，只请求提示词构建实际用到的字段和关联
+STRAPI_PROJECTIONS = {
+    'personalities': projection_params(Personality),
+    'daily-challenges': projection_params(DailyChallenge),
+    'evaluation-rules': projection_params(EvaluationRule),
+    'feedback-rules': projection_params(ParentFeedbackRule),
+    'ideal-responses': projection_params(IdealResponse),
+}
+
+# 不使用投影时的查询参数（兼容字段与 schema 不一致的旧 Strapi 实例）
+POPULATE_ALL = [('populate', '*')]
+
+# Strapi 的 rest.maxLimit 为 100（见 config/api.ts），超过会被截断为 100
+DEFAULT_PAGE_SIZE = 100
+
+# 一次返回多个集合的 bundle 接口（src/api/public，带 ETag），返回的集合以 REST 路径为键
+BOOTSTRAP_BUNDLE_PATH = 'public/bootstrap-bundle'
+
+
+class StrapiFetchError(Exception):
+    """从 Strapi 拉取数据失败"""
+
+
+def fetch_collection(base_url, entity_name, params=None, page_size=DEFAULT_PAGE_SIZE, timeout=10, session=None):
+    """
+    拉取一个集合的全部记录（自动翻页）。
+
+    Args:
+        base_url (str): Strapi 地址，例如 http://localhost:1337
+        entity_name (str): 集合 API 路径，例如 personality-traits
+        params (list | dict): 额外的查询参数（过滤、populate 等）
+        page_size (int): 每页条数
+        timeout (float): 单次请求超时（秒）
+        session (requests.Session): 可选的复用会话
+
+    Returns:
+        list: 全部记录
+
+    Raises:
+        StrapiFetchError: 任一页请求失败或返回格式不正确
+    """
+    http = session or requests
+    url = f"{base_url}/api/{entity_name}"
+    base_params = list(params.items()) if isinstance(params, dict) else list(params or [])
+    items = []
+    page = 1
+    while True:
+        page_params = base_params + [
+            ('pagination[page]', page),
+            ('pagination[pageSize]', page_size),
+        ]
+        try:
+            response = http.get(url, params=page_params, timeout=timeout)
+            response.raise_for_status()
+            payload = response.json()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            raise StrapiFetchError(f"拉取 {entity_name} 第 {page} 页失败: {e}") from e
+
+        data = payload.get('data')
+        if not isinstance(data, list):
+            raise StrapiFetchError(f"{entity_name} 返回的数据格式不正确: {str(payload)[:200]}")
+        items.extend(data)
+
+        pagination = (payload.get('meta') or {}).get('pagination') or {}
+        page_count = pagination.get('pageCount') or 1
+        if page >= page_count or not data:
+            return items
+        page += 1
+
+
+def fetch_collection_ids(base_url, entity_name, page_size=DEFAULT_PAGE_SIZE, timeout=10, session=None):
+    """只拉取集合中全部记录的 id，用于发现已删除的记录（id 总会随记录返回，只需请求一个最小字段）"""
+    items = fetch_collection(base_url, entity_name, params=[('fields[0]', 'updatedAt')],
+                             page_size=page_size, timeout=timeout, session=session)
+    return {str(item.get('id')) for item in items if item.get('id') is not None}
+
+
+def collection_params(key, use_projection=True):
+    """返回某个集合的查询参数：字段投影，或 populate=*"""
+    if use_projection and key in STRAPI_PROJECTIONS:
+        return list(STRAPI_PROJECTIONS[key])
+    return list(POPULATE_ALL)
+
+
+def load_collections(base_url, collections=None, use_projection=True, page_size=DEFAULT_PAGE_SIZE, timeout=10):
+    """
+    并发拉取多个集合的全部页。
+
+    Args:
+        base_url (str): Strapi 地址
+        collections (dict): 集合键 -> Strapi 集合 API 路径，默认 STRAPI_COLLECTIONS
+        use_projection (bool): 是否使用字段投影（否则 populate=*）
+        page_size (int): 每页条数
+        timeout (float): 单次请求超时（秒）
+
+    Returns:
+        tuple: (results, timings)
+            results: 集合键 -> 记录列表，拉取失败的集合为 None
+            timings: 集合键 -> 耗时（秒）
+    """
+    collections = dict(collections or STRAPI_COLLECTIONS)
+
+    def load_one(key):
+        entity_name = collections[key]
+        started = time.perf_counter()
+        try:
+            items = fetch_collection(base_url, entity_name, params=collection_params(key, use_projection),
+                                     page_size=page_size, timeout=timeout)
+            elapsed = time.perf_counter() - started
+            print(f"INFO: 加载 {entity_name} 完成: {len(items)} 条，耗时 {elapsed:.2f} 秒", file=sys.stderr)
+            return key, items, elapsed
+        except StrapiFetchError as e:
+            elapsed = time.perf_counter() - started
+            print(f"ERROR: 加载 {entity_name} 失败，耗时 {elapsed:.2f} 秒。错误: {e}", file=sys.stderr)
+            return key, None, elapsed
+
+    results, timings = {}, {}
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, len(collections)), thread_name_prefix='strapi-load') as pool:
+        for key, items, elapsed in pool.map(load_one, collections):
+            results[key] = items
+            timings[key] = elapsed
+    print(f"INFO: 全部集合加载结束，总耗时 {time.perf_counter() - started:.2f} 秒", file=sys.stderr)
+    return results, timings
+
+
+def fetch_bootstrap_bundle(base_url, collections=None, etag=None, timeout=10, session=None):
+    """
+    一次请求拉取多个集合（/api/public/bootstrap-bundle）。
+
+    Args:
+        base_url (str): Strapi 地址
+        collections (dict): 集合键 -> Strapi 集合 API 路径，默认 STRAPI_COLLECTIONS
+        etag (str): 上一次拿到的 ETag，内容未变化时服务端返回 304
+        timeout (float): 请求超时（秒）
+        session (requests.Session): 可选的复用会话
+
+    Returns:
+        tuple: (results, etag)
+            results: 集合键 -> 记录列表；内容未变化（304）时为 None
+
+    Raises:
+        StrapiFetchError: 请求失败（包括没有该接口的旧版 Strapi）或返回格式不正确
+    """
+    http = session or requests
+    collections = dict(collections or STRAPI_COLLECTIONS)
+    headers = {'If-None-Match': etag} if etag else {}
+    try:
+        response = http.get(f"{base_url}/api/{BOOTSTRAP_BUNDLE_PATH}",
+                            params={'collections': ','.join(collections.values())},
+                            headers=headers, timeout=timeout)
+        if response.status_code == 304:
+            return None, etag
+        response.raise_for_status()
+        payload = response.json()
+    except (requests.exceptions.RequestException, ValueError) as e:
+        raise StrapiFetchError(f"拉取 bootstrap bundle 失败: {e}") from e
+
+    data = payload.get('data') if isinstance(payload, dict) else None
+    if not isinstance(data, dict):
+        raise StrapiFetchError(f"bootstrap bundle 返回的数据格式不正确: {str(payload)[:200]}")
+    results = {}
+    for key, entity_name in collections.items():
+        items = data.get(entity_name)
+        if not isinstance(items, list):
+            raise StrapiFetchError(f"bootstrap bundle 中缺少集合 {entity_name}")
+        results[key] = items
+    return results, response.headers.get('ETag')
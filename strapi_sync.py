@@ -0,0 +1,219 @@
+# my-project/strapi_sync.py
+"""
+Strapi 后台增量同步
+
+定期用 filters[updatedAt][$gt]=<上次同步时间> 只拉取有变化的记录，合并进内存中的原始集合；
+每隔若干轮再拉取一次 id 集合，删除 Strapi 中已不存在的记录。
+有变化时通过 on_change 回调交出新的集合字典，由调用方构建新快照并原子切换。
+"""
+
+import sys
+import threading
+from datetime import datetime, timezone
+
+from strapi_catalog import entity_fields
+from strapi_loader import (
+    STRAPI_COLLECTIONS,
+    StrapiFetchError,
+    collection_params,
+    fetch_collection,
+    fetch_collection_ids,
+)
+
+
+def _utc_now_iso():
+    return datetime.now(timezone.utc).isoformat(timespec='milliseconds').replace('+00:00', 'Z')
+
+
+def _entity_key(entity):
+    entity_id = entity_fields(entity).get('id')
+    return None if entity_id is None else str(entity_id)
+
+
+def _latest_updated_at(entities):
+    """返回一组记录中最新的 updatedAt（ISO 字符串可以直接比较大小）"""
+    stamps = [entity_fields(e).get('updatedAt') for e in entities]
+    stamps = [s for s in stamps if s]
+    return max(stamps) if stamps else None
+
+
+class StrapiSyncer:
+    """
+    后台增量同步器。
+
+    Args:
+        base_url (str): Strapi 地址
+        on_change (callable): 有变化时调用，参数为 {集合键: 记录列表}
+        interval (float): 轮询间隔（秒）
+        id_check_every (int): 每隔多少轮做一次 id 集合检查以发现删除
+        collections (dict): 集合键 -> Strapi 集合 API 路径
+        timeout (float): 单次请求超时（秒）
+        use_projection (bool): 是否使用字段投影（否则 populate=*）
+    """
+
+    def __init__(self, base_url, on_change, interval=60, id_check_every=10,
+                 collections=None, timeout=10, use_projection=True):
+        self.base_url = base_url
+        self.on_change = on_change
+        self.interval = interval
+        self.id_check_every = max(1, int(id_check_every))
+        self.collections = dict(collections or STRAPI_COLLECTIONS)
+        self.timeout = timeout
+        self.use_projection = use_projection
+
+        self._lock = threading.Lock()
+        self._records = {key: {} for key in self.collections}
+        self._last_sync = {key: None for key in self.collections}
+        self._poll_count = 0
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def seed(self, key, entities):
+        """
+        用启动时已加载的数据初始化某个集合。
+        entities 为 None 表示该集合没有从 Strapi 加载到（使用了默认数据），
+        下一轮轮询会对它做一次全量拉取。
+        """
+        with self._lock:
+            if entities is None:
+                self._records[key] = {}
+                self._last_sync[key] = None
+                return
+            self._records[key] = {k: e for k, e in ((_entity_key(e), e) for e in entities) if k is not None}
+            self._last_sync[key] = _latest_updated_at(entities) or _utc_now_iso()
+
+    def snapshot(self):
+        """返回当前全部集合的副本 {集合键: 记录列表}"""
+        with self._lock:
+            return {key: list(records.values()) for key, records in self._records.items()}
+
+    def upsert(self, key, entities):
+        """合并新增或更新的记录，返回是否有变化"""
+        changed = False
+        with self._lock:
+            records = self._records.setdefault(key, {})
+            for entity in entities:
+                entity_id = _entity_key(entity)
+                if entity_id is None:
+                    continue
+                if records.get(entity_id) != entity:
+                    records[entity_id] = entity
+                    changed = True
+            latest = _latest_updated_at(entities)
+            if latest and (self._last_sync.get(key) or '') < latest:
+                self._last_sync[key] = latest
+        return changed
+
+    def remove(self, key, entity_ids):
+        """删除指定 id 的记录，返回是否有变化"""
+        changed = False
+        with self._lock:
+            records = self._records.setdefault(key, {})
+            for entity_id in entity_ids:
+                if records.pop(str(entity_id), None) is not None:
+                    changed = True
+        return changed
+
+    def patch_entry(self, key, entry):
+        """
+        把单条事件中的记录合并进集合（Webhook 使用）。
+
+        事件里的记录通常不带 populate 的关联字段，因此在已有记录上覆盖字段，
+        保留已展开的关联。Strapi 5 发布时会生成新的 id，同一 documentId 的旧记录一并替换。
+        """
+        entry_id = _entity_key(entry)
+        if entry_id is None:
+            return False
+        document_id = entity_fields(entry).get('documentId')
+        with self._lock:
+            records = self._records.setdefault(key, {})
+            previous = records.get(entry_id)
+            if previous is None and document_id:
+                stale_ids = [k for k, e in records.items() if entity_fields(e).get('documentId') == document_id]
+                previous = records.get(stale_ids[-1]) if stale_ids else None
+                for stale_id in stale_ids:
+                    del records[stale_id]
+            merged = dict(entity_fields(previous)) if previous else {}
+            merged.update(entry)
+            if previous == merged:
+                return False
+            records[entry_id] = merged
+        return True
+
+    def remove_entry(self, key, entry):
+        """按 id 以及 documentId 删除事件中的记录（Webhook 使用），返回是否有变化"""
+        entry_id = _entity_key(entry)
+        document_id = entity_fields(entry).get('documentId')
+        with self._lock:
+            records = self._records.get(key, {})
+            doomed = [k for k, e in records.items()
+                      if k == entry_id or (document_id and entity_fields(e).get('documentId') == document_id)]
+            for record_id in doomed:
+                del records[record_id]
+        return bool(doomed)
+
+    def _sync_collection(self, key, entity_name, check_ids):
+        with self._lock:
+            last_sync = self._last_sync.get(key)
+        params = collection_params(key, self.use_projection)
+        if last_sync:
+            params.append(('filters[updatedAt][$gt]', last_sync))
+        changed_entities = fetch_collection(self.base_url, entity_name, params=params, timeout=self.timeout)
+        changed = self.upsert(key, changed_entities)
+        if changed_entities:
+            print(f"INFO: 增量同步 {entity_name}: {len(changed_entities)} 条记录有更新", file=sys.stderr)
+
+        if check_ids and last_sync:
+            live_ids = fetch_collection_ids(self.base_url, entity_name, timeout=self.timeout)
+            with self._lock:
+                deleted = [entity_id for entity_id in self._records.get(key, {}) if entity_id not in live_ids]
+            if deleted and self.remove(key, deleted):
+                print(f"INFO: 增量同步 {entity_name}: 删除了 {len(deleted)} 条已不存在的记录", file=sys.stderr)
+                changed = True
+        return changed
+
+    def poll_once(self):
+        """执行一轮同步，有变化时调用 on_change，返回是否有变化"""
+        self._poll_count += 1
+        check_ids = self._poll_count % self.id_check_every == 0
+        changed = False
+        for key, entity_name in self.collections.items():
+            try:
+                changed = self._sync_collection(key, entity_name, check_ids) or changed
+            except StrapiFetchError as e:
+                print(f"WARNING: 增量同步 {entity_name} 失败，下一轮重试。错误: {e}", file=sys.stderr)
+        if changed:
+            self.notify()
+        return changed
+
+    def notify(self):
+        """把当前集合交给 on_change 回调"""
+        try:
+            self.on_change(self.snapshot())
+        except Exception as e:
+            print(f"ERROR: 应用同步结果失败: {e}", file=sys.stderr)
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            self.poll_once()
+
+    def start(self):
+        """启动后台同步线程（守护线程，不阻塞进程退出）"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='strapi-sync', daemon=True)
+        self._thread.start()
+        print(f"INFO: Strapi 后台增量同步已启动，间隔 {self.interval} 秒", file=sys.stderr)
+
+    def stop(self):
+        self._stop_event.set()
+
+    def reset_after_fork(self):
+        """
+        fork 之后在子进程中调用：父进程的线程不会被继承，
+        fork 时可能被其他线程持有的锁需要重新创建。
+        """
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
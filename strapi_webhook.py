@@ -0,0 +1,90 @@
+# my-project/strapi_webhook.py
+"""
+Strapi 缓存失效 Webhook 的签名与解析
+
+Strapi 端（src/index.ts 的 bootstrap）在条目创建、更新、删除、发布、取消发布时
+发送 JSON 事件，并用共享密钥对 "<时间戳>.<请求体>" 做 HMAC-SHA256 签名：
+
+    X-Strapi-Timestamp: 1735689600
+    X-Strapi-Signature: sha256=<hex>
+
+Flask 端校验签名和时间戳后，把事件应用到内存中的原始集合上。
+"""
+
+import hashlib
+import hmac
+import json
+import time
+
+SIGNATURE_HEADER = 'X-Strapi-Signature'
+TIMESTAMP_HEADER = 'X-Strapi-Timestamp'
+
+# 允许的时钟偏差（秒），超出视为重放请求
+MAX_CLOCK_SKEW = 300
+
+UPSERT_EVENTS = {'entry.create', 'entry.update', 'entry.publish'}
+REMOVE_EVENTS = {'entry.delete', 'entry.unpublish'}
+
+# Strapi 模型 uid -> 缓存中的集合键
+MODEL_COLLECTIONS = {
+    'api::personality-trait.personality-trait': 'personalities',
+    'api::daily-challenge.daily-challenge': 'daily-challenges',
+    'api::evaluation-rule.evaluation-rule': 'evaluation-rules',
+    'api::response.response': 'feedback-rules',
+    'api::ideal-response.ideal-response': 'ideal-responses',
+}
+
+
+class WebhookError(Exception):
+    """Webhook 请求无效（签名错误、过期或格式不正确）"""
+
+
+def sign_payload(secret, timestamp, body):
+    """计算签名头的值，body 为原始请求体字节串"""
+    message = str(timestamp).encode('utf-8') + b'.' + body
+    digest = hmac.new(secret.encode('utf-8'), message, hashlib.sha256).hexdigest()
+    return f"sha256={digest}"
+
+
+def verify_request(secret, timestamp, signature, body, now=None):
+    """
+    校验签名和时间戳，失败时抛出 WebhookError。
+
+    Args:
+        secret (str): 共享密钥
+        timestamp (str): X-Strapi-Timestamp 头
+        signature (str): X-Strapi-Signature 头
+        body (bytes): 原始请求体
+    """
+    if not timestamp or not signature:
+        raise WebhookError("缺少签名或时间戳请求头")
+    try:
+        sent_at = int(timestamp)
+    except ValueError:
+        raise WebhookError("时间戳格式不正确")
+    now = time.time() if now is None else now
+    if abs(now - sent_at) > MAX_CLOCK_SKEW:
+        raise WebhookError("时间戳已过期")
+    if not hmac.compare_digest(sign_payload(secret, sent_at, body), signature):
+        raise WebhookError("签名不匹配")
+
+
+def parse_event(body):
+    """
+    解析事件，返回 (event, collection_key, entry)。
+    collection_key 为 None 表示该模型不在缓存范围内。
+    """
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        raise WebhookError("请求体不是有效的 JSON")
+    if not isinstance(payload, dict):
+        raise WebhookError("请求体格式不正确")
+
+    event = payload.get('event')
+    entry = payload.get('entry')
+    if event not in UPSERT_EVENTS | REMOVE_EVENTS:
+        raise WebhookError(f"不支持的事件类型: {event}")
+    if not isinstance(entry, dict) or entry.get('id') is None:
+        raise WebhookError("事件缺少 entry.id")
+    return event, MODEL_COLLECTIONS.get(payload.get('uid')), entry
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+测试评估规则触发条件的本地判定（rule_engine.py）
+
+    python test_rule_engine.py   或   python -m pytest test_rule_engine.py
+"""
+
+from rule_engine import RuleEngine, compile_condition
+from strapi_catalog import EvaluationRule
+
+
+def _rule(name, condition, score_impact=-5):
+    return EvaluationRule.from_entity({
+        "id": name, "rule_name": name, "rule_description": "", "trigger_condition": condition,
+        "score_impact": score_impact,
+    })
+
+
+def test_negated_descriptions_left_to_llm():
+    """引号外带否定词的描述性条件不编译，交给大模型判断"""
+    for condition in (
+        '家长没有使用"好吗"等商量语气',
+        '不包含“请”字',
+        '家长未说出"谢谢"',
+        '避免使用"你应该"这样的说法',
+        '缺少‘我理解你’之类的共情表达',
+        '禁止说"笨"',
+    ):
+        assert compile_condition(condition, {}) is None, condition
+
+    engine = RuleEngine([_rule("缺少商量", '家长没有使用"好吗"等商量语气')])
+    assert len(engine) == 0
+    assert engine.uncompiled_names == frozenset({"缺少商量"})
+    assert engine.triggered("去写作业，好吗？") == []
+
+
+def test_descriptions_with_examples_compile():
+    """不带否定的描述，出现任一示例即触发；示例本身含否定词不影响"""
+    engine = RuleEngine([
+        _rule("命令", '家长说出"快去"、"马上"等命令词'),
+        _rule("威胁", '家长说"不许哭"之类的话'),
+    ])
+    assert len(engine) == 2
+    assert [rule.rule_name for rule in engine.triggered("马上给我去睡觉")] == ["命令"]
+    assert [rule.rule_name for rule in engine.triggered("不许哭了")] == ["威胁"]
+
+
+def test_parenthesized_prose_uses_examples():
+    """带全角括号或"或"字的描述不按表达式解析：有示例时出现任一示例即触发，否则交给大模型"""
+    engine = RuleEngine([
+        _rule("命令", '家长使用命令语气（如"快去"、"马上"）'),
+        _rule("催促", '家长大声说话 或 反复催促'),
+        _rule("强硬", '（语气强硬）'),
+    ])
+    assert [rule.rule_name for rule, _ in engine.compiled] == ["命令"]
+    assert engine.uncompiled_names == frozenset({"催促", "强硬"})
+    assert [rule.rule_name for rule in engine.triggered("快去写作业！马上！")] == ["命令"]
+    assert [rule.rule_name for rule in engine.triggered("马上过来")] == ["命令"]
+
+
+def test_expressions_keep_explicit_negation():
+    """表达式中的 NOT / 非 仍按布尔运算处理"""
+    engine = RuleEngine([_rule("命令", '("快去" 或 "马上") 且 非 "好吗"')])
+    assert [rule.rule_name for rule in engine.triggered("快去写作业")] == ["命令"]
+    assert engine.triggered("快去写作业，好吗") == []
+
+
+if __name__ == '__main__':
+    for name, test in list(globals().items()):
+        if name.startswith('test_') and callable(test):
+            test()
+            print(f"✅ {name}")